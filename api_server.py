@@ -0,0 +1,377 @@
+"""HTTP API for generating books without the UI.
+
+    python api_server.py --port 8000
+    BOOKCREATOR_API_TOKEN=... python api_server.py --host 0.0.0.0 --port 8000
+
+Endpoints build their prompts with the same prompts.py functions as the
+app and generate through the same providers, so a chapter requested here
+is the request the UI would have sent.
+
+- POST /structure: a book structure from the book details.
+- POST /chapter: a chapter from the structure and the chapter's outline
+  entry. With "stream": true the text arrives as server-sent events:
+  "token" events with each piece of text, then "done" with the whole
+  text and the generation info, or "error". A client that disconnects
+  stops the provider stream, so the rest is never paid for.
+- POST /description: a fresh description for a chapter.
+- POST /export: the final book in one of the export formats.
+- POST /jobs, GET /jobs/{id}, GET /jobs/{id}/export/{format}: a whole
+  book generated in the background as a checkpointed run (see runs.py),
+  polled for progress and downloaded when done. A job left unfinished by
+  a restart is resumed by posting the same job id again.
+
+Provider calls are blocking, so each request runs them in a worker thread
+while the event loop keeps serving other requests; the provider registry
+applies each provider's request and concurrency limits. If
+BOOKCREATOR_API_TOKEN is set, every request needs it as a bearer token;
+without it, only clients on this machine are served, and
+`python api_server.py` refuses to listen on any other address.
+"""
+import asyncio
+import hmac
+import ipaddress
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from pydantic import BaseModel, ConfigDict, Field
+
+import batch_runner
+import book_export
+import prompts
+import providers
+import runs
+import structure_generation
+import token_budget
+import tracing
+
+API_TOKEN = os.environ.get("BOOKCREATOR_API_TOKEN")
+JOBS_DIR = os.environ.get(
+    "BOOKCREATOR_JOBS_DIR",
+    os.path.join(os.path.expanduser("~"), ".bookcreator", "jobs")
+)
+# Books generated at once by the job endpoints; each runs its parts in parallel too
+JOB_WORKERS = int(os.environ.get("BOOKCREATOR_JOB_WORKERS", "2"))
+PARALLEL_PARTS = 4
+
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def check_token(request: Request, authorization: Optional[str] = Header(None)):
+    if API_TOKEN:
+        # Constant time, so the token cannot be guessed from response times
+        if not hmac.compare_digest((authorization or "").encode("utf-8"), f"Bearer {API_TOKEN}".encode("utf-8")):
+            raise HTTPException(401, "Missing or wrong bearer token")
+    elif request.client is None or not is_loopback(request.client.host):
+        raise HTTPException(403, "Set BOOKCREATOR_API_TOKEN to serve clients on other machines")
+
+
+app = FastAPI(title="Book Creator API", dependencies=[Depends(check_token)])
+
+
+class ModelChoice(BaseModel):
+    provider: str = providers.DEFAULT_PROVIDER
+    model: Optional[str] = None
+
+    def resolve(self):
+        """Return (provider, model), rejecting unknown providers"""
+        try:
+            providers.get_provider(self.provider)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+        return self.provider, self.model or providers.default_model(self.provider)
+
+
+class BookDetails(ModelChoice):
+    title: str
+    theme: str
+    audience: str
+    style: str = "Informative"
+    goals: str = ""
+
+
+class ChapterInfo(BaseModel):
+    number: int
+    title: str
+    description: str = ""
+
+
+class ChapterRequest(ModelChoice):
+    book_structure: dict
+    chapter: ChapterInfo
+    key_points: str = ""
+    custom_content: Optional[str] = None
+    word_count: int = Field(2000, ge=100, le=20000)
+    # Tolerance above word_count past which the chapter stops at a paragraph end (see token_budget)
+    early_stop: Optional[float] = Field(None, ge=0, le=1)
+    stream: bool = False
+
+
+class DescriptionRequest(ModelChoice):
+    book_structure: dict
+    chapter_title: str
+
+
+class ExportStructure(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    title: str
+    introduction: str
+    conclusion: str
+    chapters: list = []
+
+
+class ExportChapter(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+    title: str
+    content: str
+
+
+class ExportRequest(BaseModel):
+    book_structure: ExportStructure
+    # Keyed by chapter number
+    book_content: Dict[int, ExportChapter]
+    format: str = "Markdown"
+
+
+class JobRequest(BookDetails):
+    chapter_words: int = Field(2000, ge=100, le=20000)
+    id: Optional[str] = None
+
+
+# Generations whose client has gone, kept referenced until their thread returns
+_abandoned = set()
+
+
+def _provider_error(provider, error):
+    """Return the HTTPException for a failed provider call, telling it apart from a bad request"""
+    return HTTPException(502, f"{provider} request failed: {type(error).__name__}: {error}")
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _event_stream(work):
+    """Run work(on_text) in a worker thread and yield its text, then its result, as server-sent events"""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    disconnected = threading.Event()
+
+    def on_text(text):
+        loop.call_soon_threadsafe(queue.put_nowait, ("token", {"text": text}))
+        # Returning True stops the provider stream
+        return disconnected.is_set()
+
+    async def run():
+        try:
+            queue.put_nowait(("done", await run_in_threadpool(work, on_text)))
+        except Exception as e:
+            queue.put_nowait(("error", {"error": f"{type(e).__name__}: {e}"}))
+
+    task = asyncio.create_task(run())
+    try:
+        while True:
+            event, data = await queue.get()
+            yield _sse(event, data)
+            if event != "token":
+                break
+    finally:
+        if not task.done():
+            # The client went away: the next piece of text stops the stream
+            disconnected.set()
+            _abandoned.add(task)
+            task.add_done_callback(_abandoned.discard)
+
+
+@app.get("/providers")
+def list_providers():
+    return [
+        {"name": name, "models": list(spec.models), "configured": providers.has_credentials(name)}
+        for name, spec in providers.PROVIDERS.items()
+    ]
+
+
+@app.post("/structure")
+async def create_structure(request: BookDetails):
+    provider, model = request.resolve()
+    prompt = prompts.create_structure_prompt(request.title, request.theme, request.audience, request.style, request.goals)
+    info = {}
+    try:
+        with tracing.span("api.structure", provider=provider, model=model):
+            structure = await run_in_threadpool(
+                structure_generation.generate_structure, provider, model, prompt,
+                token_budget.max_tokens_for(model, structure_generation.TARGET_WORDS), info=info
+            )
+    except structure_generation.StructureGenerationError as e:
+        raise HTTPException(502, str(e))
+    except Exception as e:
+        raise _provider_error(provider, e)
+    structure.update(theme=request.theme, audience=request.audience, style=request.style, goals=request.goals)
+    return {"book_structure": structure, "info": info}
+
+
+@app.post("/chapter")
+async def create_chapter(request: ChapterRequest):
+    provider, model = request.resolve()
+    chapter = request.chapter.model_dump()
+    try:
+        prompt = prompts.create_chapter_prompt(
+            request.book_structure, chapter, request.key_points, f"{request.word_count} words", request.custom_content
+        )
+    except (KeyError, TypeError) as e:
+        raise HTTPException(400, f"Incomplete book_structure: {type(e).__name__}: {e}")
+
+    def generate(on_text=None):
+        def call(messages, max_tokens, stream_text):
+            return providers.complete(provider, model, messages, max_tokens, stream_text)
+
+        with tracing.span("api.chapter", chapter=chapter["number"], provider=provider, model=model):
+            text, info = token_budget.generate_with_continuation(
+                call, prompt, model, request.word_count, prefill=providers.supports_prefill(provider),
+                on_text=on_text, early_stop=request.early_stop
+            )
+        return {"text": text, "info": info}
+
+    if request.stream:
+        return StreamingResponse(
+            _event_stream(generate), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+        )
+    try:
+        return await run_in_threadpool(generate)
+    except Exception as e:
+        raise _provider_error(provider, e)
+
+
+@app.post("/description")
+async def create_description(request: DescriptionRequest):
+    provider, model = request.resolve()
+    try:
+        prompt = prompts.create_description_prompt(request.book_structure, request.chapter_title)
+    except (KeyError, TypeError) as e:
+        raise HTTPException(400, f"Incomplete book_structure: {type(e).__name__}: {e}")
+    max_tokens = token_budget.max_tokens_for(model, prompts.DESCRIPTION_TARGET_WORDS)
+    start = time.perf_counter()
+    try:
+        completion = await run_in_threadpool(providers.complete, provider, model, prompt, max_tokens)
+    except Exception as e:
+        raise _provider_error(provider, e)
+    token_budget.record_usage(
+        model, len(completion.text.split()), completion.output_tokens,
+        completion.input_tokens, time.perf_counter() - start
+    )
+    return {"description": completion.text, "truncated": completion.truncated}
+
+
+@app.post("/export")
+def export_book(request: ExportRequest):
+    if request.format not in book_export.EXPORT_FORMATS:
+        raise HTTPException(400, f"Unknown format; expected one of {', '.join(book_export.EXPORT_FORMATS)}")
+    book_structure = request.book_structure.model_dump()
+    book_content = {number: chapter.model_dump() for number, chapter in request.book_content.items()}
+    content = "".join(book_export.export_blocks(book_structure, book_content, request.format))
+    file_name = book_export.export_file_name(book_structure, request.format)
+    return Response(
+        content, media_type=book_export.EXPORT_FORMATS[request.format]["mime"],
+        headers={"Content-Disposition": f'attachment; filename="{file_name}"'}
+    )
+
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+_job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="book-job")
+
+
+def _job_dir(job_id):
+    if not batch_runner.ID_PATTERN.match(job_id):
+        raise ValueError(f"Invalid job id: {job_id!r}")
+    return os.path.join(JOBS_DIR, job_id)
+
+
+def _run_job(job_id, spec):
+    job = _jobs[job_id]
+    job["status"] = "running"
+    try:
+        with tracing.span("api.job", job=job_id, model=spec["model"]):
+            book_structure, generated_chapters, report = batch_runner.generate_book(
+                spec, os.path.join(_job_dir(job_id), "run"), PARALLEL_PARTS
+            )
+            batch_runner.write_book(_job_dir(job_id), spec, book_structure, generated_chapters)
+        job.update(
+            status="partial" if report["failed_parts"] else "complete",
+            report=report, finished=time.time()
+        )
+    except Exception as e:
+        job.update(status="failed", error=f"{type(e).__name__}: {e}", finished=time.time())
+
+
+@app.post("/jobs", status_code=202)
+def create_job(request: JobRequest):
+    provider, model = request.resolve()
+    job_id = batch_runner.slug(request.id) if request.id else uuid.uuid4().hex[:12]
+    spec = dict(request.model_dump(exclude={"id"}), provider=provider, model=model, id=job_id)
+    with _jobs_lock:
+        if _jobs.get(job_id, {}).get("status") in ("queued", "running"):
+            raise HTTPException(409, f"Job {job_id} is already running")
+        _jobs[job_id] = {"id": job_id, "status": "queued", "created": time.time()}
+    _job_executor.submit(_run_job, job_id, spec)
+    return {"id": job_id, "status": "queued"}
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = _jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, f"No job {job_id}")
+    progress = {"parts": None, "done": 0}
+    try:
+        run = runs.Run(os.path.join(_job_dir(job_id), "run"))
+    except OSError:
+        pass  # Still writing the structure
+    else:
+        progress = {"parts": len(run.parts), "done": len(run.completed_keys())}
+    formats = [
+        name for name, info in book_export.EXPORT_FORMATS.items()
+        if os.path.exists(os.path.join(_job_dir(job_id), f"book.{info['extension']}"))
+    ]
+    return dict(job, progress=progress, exports=formats)
+
+
+@app.get("/jobs/{job_id}/export/{export_format}")
+def get_job_export(job_id: str, export_format: str):
+    if job_id not in _jobs:
+        raise HTTPException(404, f"No job {job_id}")
+    info = book_export.EXPORT_FORMATS.get(export_format)
+    path = os.path.join(_job_dir(job_id), f"book.{info['extension']}") if info else None
+    if path is None or not os.path.exists(path):
+        raise HTTPException(404, f"No {export_format} export for job {job_id}")
+    return FileResponse(path, media_type=info["mime"], filename=os.path.basename(path))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve the book generation API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    if not API_TOKEN and not is_loopback(args.host):
+        parser.error(f"set BOOKCREATOR_API_TOKEN before listening on {args.host}")
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -1,25 +1,49 @@
+import time
+_script_start = time.perf_counter()
+
 import streamlit as st
-import requests
 import json
 import os
+import re
+import shutil
+import uuid
 from datetime import datetime
-from openai import OpenAI
-from anthropic import Anthropic
-
-# Initialize AI clients
-def init_openai_client():
-    """Initialize OpenAI client using environment secret"""
-    api_key = os.environ.get('OPENAI_API_KEY')
-    if not api_key:
-        return None
-    return OpenAI(api_key=api_key)
 
-def init_anthropic_client():
-    """Initialize Anthropic client using environment secret"""
-    api_key = os.environ.get('ANTHROPIC_API_KEY')
-    if not api_key:
-        return None
-    return Anthropic(api_key=api_key)
+import book_export
+import book_scheduler
+import book_stats
+import cost_estimate
+import project_import
+import project_store
+import prompts
+import providers
+import revisions
+import rewrite
+import runs
+import search_index
+import session_memory
+import startup_probe
+import structure_generation
+import token_budget
+import tracing
+import translation
+
+_imports_done = time.perf_counter()
+
+# Number of chapters rendered per page of the export preview
+PREVIEW_CHAPTERS_PER_PAGE = 3
+# Number of chapters per page of the status table on the content screen
+CHAPTERS_PER_PAGE = 10
+
+# Length of a chapter nobody has chosen a length for
+DEFAULT_CHAPTER_WORDS = 2000
+# max_tokens used when a call has no word target
+DEFAULT_MAX_TOKENS = 4000
+# Book parts generated at the same time by "Generate Whole Book"
+PARALLEL_PARTS = 4
+# Chunks translated at the same time, and the request rate they share
+TRANSLATION_WORKERS = 4
+TRANSLATION_REQUESTS_PER_MINUTE = 60
 
 # Page configuration
 st.set_page_config(
@@ -39,12 +63,12 @@ if 'current_chapter' not in st.session_state:
 if 'generated_chapters' not in st.session_state:
     st.session_state.generated_chapters = {}
 if 'ai_provider' not in st.session_state:
-    st.session_state.ai_provider = 'OpenAI'
+    st.session_state.ai_provider = providers.DEFAULT_PROVIDER
 if 'ai_model' not in st.session_state:
-    st.session_state.ai_model = {
-        'OpenAI': 'gpt-4o',
-        'Anthropic': 'claude-3-5-sonnet-20241022'
-    }
+    st.session_state.ai_model = {name: providers.default_model(name) for name in providers.provider_names()}
+# Tolerance above the word target past which chapters are cut at a paragraph end, or None
+if 'early_stop' not in st.session_state:
+    st.session_state.early_stop = None
 # Add new session state variables for book details
 if 'book_details' not in st.session_state:
     st.session_state.book_details = {
@@ -57,120 +81,88 @@ if 'book_details' not in st.session_state:
 # Add new session state variable for book content
 if 'book_content' not in st.session_state:
     st.session_state.book_content = {}
+# Per-chapter text statistics, updated whenever a chapter's text changes
+if 'chapter_stats' not in st.session_state:
+    st.session_state.chapter_stats = book_stats.StatsIndex()
+# Generation settings of chapters not generated yet, by chapter number. Streamlit
+# drops the state of widgets that are not rendered, and only the open chapter's are.
+if 'chapter_plans' not in st.session_state:
+    st.session_state.chapter_plans = {}
+# Project archive backing this session; chapter bodies are read from it lazily.
+# The id is kept in the page URL, so a reloaded tab gets its unfinished runs back.
+if 'project_id' not in st.session_state:
+    url_project = st.query_params.get("project", "")
+    st.session_state.project_id = url_project if re.fullmatch(r"[0-9a-f]{32}", url_project) else uuid.uuid4().hex
+if st.query_params.get("project") != st.session_state.project_id:
+    st.query_params["project"] = st.session_state.project_id
+if 'project_archive' not in st.session_state:
+    st.session_state.project_archive = None
+# Revision history and draft branches of every chapter
+if 'history' not in st.session_state:
+    st.session_state.history = revisions.BookHistory()
+# Full-text index over chapters, final book, introduction and conclusion
+if 'search_index' not in st.session_state:
+    st.session_state.search_index = search_index.SearchIndex()
+# Compresses cold chapters and evicts the book of an idle session to its project archive
+if 'memory' not in st.session_state:
+    st.session_state.memory = session_memory.SessionMemory()
 
 # AI API Functions
-def call_anthropic_api(prompt):
-    """Call Anthropic (Claude) API"""
+def generate_ai_response(prompt, target_words=None):
+    """Generate response from selected AI provider"""
+    provider = st.session_state.ai_provider
+    model = st.session_state.ai_model[provider]
+    max_tokens = token_budget.max_tokens_for(model, target_words) if target_words else DEFAULT_MAX_TOKENS
     try:
-        client = init_anthropic_client()
-        if not client:
-            raise ValueError("Anthropic API key not found in environment")
-
-        # Usa il modello selezionato dall'utente
-        response = client.messages.create(
-            model=st.session_state.ai_model['Anthropic'],
-            max_tokens=4000,
-            messages=[{"role": "user", "content": prompt}]
-        )
-        return response.content[0].text
+        start = time.perf_counter()
+        completion = providers.complete(provider, model, prompt, max_tokens)
     except Exception as e:
-        st.error(f"Error calling Anthropic API: {str(e)}")
+        st.error(f"Error calling {provider} API: {str(e)}")
         return None
 
-def call_openai_api(prompt):
-    """Call OpenAI (GPT) API"""
+    token_budget.record_usage(
+        model, len(completion.text.split()), completion.output_tokens,
+        completion.input_tokens, time.perf_counter() - start
+    )
+    if completion.truncated:
+        st.warning("The response was cut off by the output token limit.")
+    return completion.text
+
+def generate_structure(prompt):
+    """Generate a validated book structure with the provider's structured output"""
+    provider = st.session_state.ai_provider
+    model = st.session_state.ai_model[provider]
+    max_tokens = token_budget.max_tokens_for(model, structure_generation.TARGET_WORDS)
     try:
-        client = init_openai_client()
-        if not client:
-            raise ValueError("OpenAI API key not found in environment")
-
-        # Usa il modello selezionato dall'utente
-        response = client.chat.completions.create(
-            model=st.session_state.ai_model['OpenAI'],
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=4000
-        )
-        return response.choices[0].message.content
+        return structure_generation.generate_structure(provider, model, prompt, max_tokens)
+    except structure_generation.StructureGenerationError as e:
+        st.error(f"Error processing the response: {str(e)}")
+        if e.response:
+            st.write("Received response:", e.response)
     except Exception as e:
-        st.error(f"Error calling OpenAI API: {str(e)}")
-        return None
+        st.error(f"Error calling {provider} API: {str(e)}")
+    return None
 
-def generate_ai_response(prompt):
-    """Generate response from selected AI provider"""
-    if st.session_state.ai_provider == "Anthropic":
-        return call_anthropic_api(prompt)
-    else:
-        return call_openai_api(prompt)
-
-# Prompt Generation Functions
-def create_structure_prompt(title, theme, audience, style, goals):
-    return f"""
-    As an expert editorial consultant, help me create a detailed structure for a non-fiction book with these characteristics:
-
-    - Title: {title}
-    - Main Theme: {theme}
-    - Target Audience: {audience}
-    - Writing Style: {style}
-    - Book Goals: {goals}
-
-    Please generate a complete structure including:
-    1. A compelling introduction presenting the theme and book objectives
-    2. 6-10 logically organized chapters, each with an engaging title and brief content description (3-5 sentences)
-    3. A conclusion summarizing key points and leaving readers with meaningful reflections
-
-    Format the response in JSON as follows:
-    {{
-        "title": "Book Title",
-        "introduction": "Introduction text...",
-        "chapters": [
-            {{
-                "number": 1,
-                "title": "Chapter 1 Title",
-                "description": "Chapter description..."
-            }},
-            ...
-        ],
-        "conclusion": "Conclusion text..."
-    }}
-    """
+def generate_long_response(prompt, target_words):
+    """Generate about target_words words, continuing automatically if the response is cut off"""
+    provider = st.session_state.ai_provider
+    model = st.session_state.ai_model[provider]
 
-def create_chapter_prompt(book_info, chapter_info, key_points, length, custom_content=None):
-    """Crea il prompt per generare un capitolo specifico"""
-    prompt = f"""
-    Sei un autore di libri non-fiction esperto. Stai scrivendo un capitolo per il seguente libro:
+    def call(messages, max_tokens, on_text):
+        return providers.complete(provider, model, messages, max_tokens, on_text)
 
-    - Titolo del libro: {book_info['title']}
-    - Tema principale: {book_info['theme']}
-    - Pubblico target: {book_info['audience']}
-    - Stile di scrittura: {book_info['style']}
-
-    CAPITOLO DA SCRIVERE:
-    - Numero: {chapter_info['number']}
-    - Titolo: {chapter_info['title']}
-    - Descrizione: {chapter_info['description']}
-
-    Punti chiave da includere:
-    {key_points if key_points else "Utilizza la tua creatività basandoti sulla descrizione del capitolo."}
-    """
-
-    if custom_content:
-        prompt += f"""
-
-    Contenuto personalizzato da incorporare nel capitolo:
-    {custom_content}
-
-    Per favore, integra organicamente questo contenuto personalizzato nel capitolo, mantenendo uno stile coerente e fluido.
-    """
-
-    prompt += f"""
-
-    Lunghezza approssimativa: {length}
-
-    Scrivi un capitolo completo, ben strutturato e coinvolgente. Includi esempi concreti, riferimenti pertinenti e, dove appropriato, aneddoti per illustrare i concetti. Assicurati che il capitolo mantenga uno stile coerente con il resto del libro e si colleghi logicamente ai capitoli precedenti e successivi.
+    try:
+        text, info = token_budget.generate_with_continuation(
+            call, prompt, model, target_words,
+            prefill=providers.supports_prefill(provider), early_stop=st.session_state.early_stop
+        )
+    except Exception as e:
+        st.error(f"Error calling {provider} API: {str(e)}")
+        return None, None
 
-    Formatta il contenuto con titoli chiari usando la sintassi Markdown (##) per le sezioni principali e (###) per le sottosezioni.
-    """
-    return prompt
+    if info["truncated"]:
+        st.warning(f"The text was still cut off after {info['rounds']} continuation requests.")
+    return text, info
 
 # Navigation Functions
 def go_to_structure():
@@ -231,6 +223,466 @@ def update_chapter_info(chapter_number, title=None, description=None):
         if description:
             st.session_state.generated_chapters[chapter_key]["description"] = description
 
+def chapter_text(chapter):
+    """Return a chapter's text, reading it from the project archive if not loaded yet"""
+    if chapter.get("content") is None:
+        return project_store.load_body(st.session_state.project_archive, chapter)
+    return chapter["content"]
+
+def save_current_project():
+    """Save the session's book to its project archive and return the archive path"""
+    path = project_store.project_path(st.session_state.project_id)
+    with tracing.span("project.save"):
+        project_store.save_project(
+            path,
+            st.session_state.book_structure,
+            st.session_state.book_details,
+            st.session_state.generated_chapters,
+            st.session_state.book_content
+        )
+    st.session_state.project_archive = project_store.ProjectArchive(path)
+    project_store.prune_projects(keep=session_memory.project_paths() | {path})
+    return path
+
+def load_project(uploaded_file):
+    """Open an uploaded project without loading chapter bodies
+
+    Archives are stored as they are; JSON projects from older versions are
+    streamed into a new archive. Returns the import report for JSON files.
+    """
+    project_id = uuid.uuid4().hex
+    path = project_store.project_path(project_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    report = None
+    if uploaded_file.name.lower().endswith(".json"):
+        progress_bar = st.progress(0.0, text="Importing project...")
+
+        def show_progress(bytes_read, total_bytes, imported):
+            fraction = min(bytes_read / total_bytes, 1.0) if total_bytes else 0.0
+            progress_bar.progress(fraction, text=f"Importing project... {imported} chapters")
+
+        with tracing.span("project.import", bytes=uploaded_file.size) as import_span:
+            report = project_import.import_json_project(uploaded_file, path, uploaded_file.size, show_progress)
+            import_span.set(chapters=report["imported"], quarantined=len(report["quarantined"]))
+        progress_bar.empty()
+    else:
+        with open(path, "wb") as f:
+            shutil.copyfileobj(uploaded_file, f)
+    try:
+        archive = project_store.ProjectArchive(path)
+    except project_store.ProjectFormatError:
+        os.remove(path)
+        raise
+    project_store.prune_projects(keep=session_memory.project_paths() | {path})
+
+    structure = archive.structure
+    st.session_state.project_id = project_id
+    st.session_state.project_archive = archive
+    st.session_state.book_structure = structure["book_structure"]
+    st.session_state.book_details.update(structure.get("book_details") or {})
+    st.session_state.generated_chapters = archive.generated_chapters()
+    st.session_state.book_content = archive.book_content()
+    st.session_state.current_chapter = None
+    st.session_state.chapter_stats = book_stats.StatsIndex()
+    st.session_state.chapter_plans = {}
+    st.session_state.search_index = search_index.SearchIndex()
+    st.session_state.history = revisions.BookHistory()
+    return report
+
+def session_book():
+    """Return the session's book data, as handed to the memory manager"""
+    return {
+        "book_structure": st.session_state.book_structure,
+        "book_details": st.session_state.book_details,
+        "chapters": st.session_state.generated_chapters,
+        "book_content": st.session_state.book_content,
+        "project_path": project_store.project_path(st.session_state.project_id),
+    }
+
+def session_indexes():
+    """Return the derived indexes that an evicted session rebuilds on demand"""
+    return [st.session_state.search_index, st.session_state.get('redundancy_index')]
+
+def release_chapter_copies(section, key):
+    """Drop the copies of a compressed chapter's text held by the indexes and cached revisions
+
+    The indexes keep what they search and compare by, so the chapter is
+    only decompressed again when it matches.
+    """
+    doc_id = key if section == "chapters" else f"book_{key}"
+    for index in session_indexes():
+        if index is not None:
+            index.release(doc_id)
+    if section == "chapters":
+        st.session_state.history.forget_texts(key)
+
+def chapter_fields(chapter):
+    """Return a chapter's fields other than its text"""
+    return {k: v for k, v in chapter.items() if k not in project_store.BODY_FIELDS}
+
+def show_chapter_text(chapter_key, text):
+    """Put new text in a draft chapter and refresh everything derived from it"""
+    chapter = st.session_state.generated_chapters[chapter_key]
+    chapter["content"] = text
+    st.session_state.chapter_stats.update(chapter_key, text)
+    st.session_state.search_index.update(chapter_key, text)
+    # Drop the editor's widget state so it shows the new text
+    st.session_state.pop(f"edit_content_{chapter['number']}", None)
+
+def store_chapter_text(chapter_key, text, label):
+    """Save an edit of a draft chapter as a new revision"""
+    show_chapter_text(chapter_key, text)
+    chapter = st.session_state.generated_chapters[chapter_key]
+    chapter["last_edited"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    st.session_state.history.commit(chapter_key, text, label, chapter_fields(chapter))
+
+def commit_all_chapters():
+    """Make sure every draft chapter's current text is in the history"""
+    for chapter_key, chapter in st.session_state.generated_chapters.items():
+        st.session_state.history.commit(chapter_key, chapter_text(chapter), "Saved", chapter_fields(chapter))
+
+def switch_branch(name):
+    """Replace the draft chapters with those of another branch"""
+    commit_all_chapters()
+    chapters = st.session_state.history.switch_branch(name)
+    st.session_state.generated_chapters = {}
+    for chapter_key in list(st.session_state.chapter_stats.records):
+        st.session_state.chapter_stats.remove(chapter_key)
+        st.session_state.search_index.remove(chapter_key)
+    for chapter_key, (text, fields) in chapters.items():
+        st.session_state.generated_chapters[chapter_key] = dict(fields)
+        show_chapter_text(chapter_key, text)
+
+def search_documents():
+    """Return every searchable text of the book keyed by search document id
+
+    Chapters kept compressed or not loaded yet map to None; the indexes
+    read them through search_text only when they need to.
+    """
+    documents = {}
+    book = st.session_state.book_structure
+    if book:
+        documents["introduction"] = book.get("introduction", "")
+        documents["conclusion"] = book.get("conclusion", "")
+    for chapter_key, chapter in st.session_state.generated_chapters.items():
+        documents[chapter_key] = chapter.get("content")
+    for number, chapter in st.session_state.book_content.items():
+        documents[f"book_{number}"] = chapter.get("content")
+    return documents
+
+def search_text(doc_id, keep=True):
+    """Return the text of a search document; keep=False leaves a compressed or unloaded chapter as it is"""
+    if doc_id in ("introduction", "conclusion"):
+        return st.session_state.book_structure.get(doc_id, "")
+    if doc_id.startswith("chapter_"):
+        chapter = st.session_state.generated_chapters[doc_id]
+    else:
+        number = doc_id.split("_", 1)[1]
+        chapter = next(c for k, c in st.session_state.book_content.items() if str(k) == number)
+    if keep:
+        return chapter_text(chapter)
+    return project_store.peek_body(st.session_state.project_archive, chapter)
+
+def peek_search_text(doc_id):
+    """Return the text of a search document without loading its chapter"""
+    return search_text(doc_id, keep=False)
+
+def search_document_label(doc_id):
+    """Return a readable name for a search document id"""
+    if doc_id.startswith("chapter_"):
+        return f"Chapter {doc_id.split('_', 1)[1]} (draft)"
+    if doc_id.startswith("book_"):
+        return f"Chapter {doc_id.split('_', 1)[1]} (final book)"
+    if doc_id.startswith("description_"):
+        return f"Chapter {doc_id.split('_', 1)[1]} (description)"
+    return doc_id.capitalize()
+
+def redundancy_index():
+    """Return the session's repeated-content index, brought up to date with the book
+
+    The module needs numpy, so it is imported on first use. Draft chapters
+    and chapter descriptions are indexed; a chapter is not compared with
+    its own description.
+    """
+    if 'redundancy_index' not in st.session_state:
+        start = time.perf_counter()
+        import redundancy
+        startup_probe.record_lazy_import("redundancy", time.perf_counter() - start)
+        st.session_state.redundancy_index = redundancy.RedundancyIndex()
+    documents, groups, min_words = {}, {}, {}
+    for chapter in st.session_state.book_structure["chapters"]:
+        doc_id = f"description_{chapter['number']}"
+        documents[doc_id] = chapter["description"]
+        groups[doc_id] = str(chapter["number"])
+        # A description is one short paragraph
+        min_words[doc_id] = 5
+    for chapter_key, chapter in st.session_state.generated_chapters.items():
+        documents[chapter_key] = chapter.get("content")
+        groups[chapter_key] = str(chapter["number"])
+    index = st.session_state.redundancy_index
+    index.sync(documents, groups, min_words, load=peek_search_text)
+    return index
+
+def apply_search_replacements(changed):
+    """Write texts changed by a bulk replace back to the book and reindex them"""
+    for doc_id, text in changed.items():
+        if doc_id in ("introduction", "conclusion"):
+            st.session_state.book_structure[doc_id] = text
+        elif doc_id.startswith("chapter_"):
+            store_chapter_text(doc_id, text, "Find & replace")
+            continue
+        else:
+            number = doc_id.split("_", 1)[1]
+            key = next(k for k in st.session_state.book_content if str(k) == number)
+            st.session_state.book_content[key]["content"] = text
+        st.session_state.search_index.update(doc_id, text)
+
+def chapter_settings(chapter):
+    """Return a chapter's generation settings: the stored ones once generated, else the form values
+
+    Chapters generated or imported without a stored length fall back to
+    the planned or default length, so word_count is always a number.
+    """
+    plan = st.session_state.chapter_plans.get(chapter['number'], {})
+    word_count = plan.get("word_count") or DEFAULT_CHAPTER_WORDS
+    generated = st.session_state.generated_chapters.get(f"chapter_{chapter['number']}")
+    if generated:
+        metadata = generated.get("metadata", {})
+        return {
+            "word_count": metadata.get("word_count") or word_count,
+            "key_points": metadata.get("key_points", ""),
+            "custom_content": metadata.get("custom_content")
+        }
+    return {
+        "word_count": word_count,
+        "key_points": plan.get("key_points", ""),
+        "custom_content": plan.get("custom_content")
+    }
+
+def chapter_is_stale(chapter):
+    """Whether a generated chapter's outline or the book details changed since it was written"""
+    generated = st.session_state.generated_chapters.get(f"chapter_{chapter['number']}")
+    stored = generated.get("metadata", {}).get("inputs") if generated else None
+    if stored is None:
+        return False
+    current = book_scheduler.chapter_inputs(st.session_state.book_structure, chapter, chapter_settings(chapter))
+    return stored != current
+
+def chapter_status(chapter):
+    """Return a chapter's row of the status table on the content screen"""
+    chapter_key = f"chapter_{chapter['number']}"
+    stats = st.session_state.chapter_stats.get(chapter_key)
+    return {
+        "Chapter": chapter['number'],
+        "Title": chapter['title'],
+        "Generated": chapter_key in st.session_state.generated_chapters,
+        "In final book": chapter['number'] in st.session_state.book_content,
+        "Stale": chapter_is_stale(chapter),
+        "Words": stats["words"] if stats else None,
+    }
+
+def store_generated_chapter(chapter, text, generation_info, settings):
+    """Store a newly generated draft chapter and index it"""
+    chapter_key = f"chapter_{chapter['number']}"
+    st.session_state.generated_chapters[chapter_key] = book_scheduler.chapter_record(
+        chapter, text, generation_info, settings, st.session_state.book_structure
+    )
+    st.session_state.pop(f"edit_content_{chapter['number']}", None)
+    with tracing.span("chapter.index", chapter=chapter['number']):
+        st.session_state.chapter_stats.update(chapter_key, text, settings["word_count"])
+        st.session_state.search_index.update(chapter_key, text)
+        st.session_state.history.commit(
+            chapter_key, text, "Generated", chapter_fields(st.session_state.generated_chapters[chapter_key])
+        )
+
+def section_chapter_texts():
+    """Return the draft chapter texts the introduction and conclusion are written from"""
+    texts = {}
+    for chapter in st.session_state.book_structure["chapters"]:
+        chapter_key = book_scheduler.chapter_key(chapter["number"])
+        if chapter_key in st.session_state.generated_chapters:
+            texts[chapter_key] = chapter_text(st.session_state.generated_chapters[chapter_key])
+    return texts
+
+def store_generated_section(section, text, generation_info, inputs):
+    """Replace the short introduction or conclusion of the structure with the full one"""
+    book_scheduler.apply_section(st.session_state.book_structure, section, text, generation_info, inputs)
+    st.session_state.search_index.update(section, text)
+
+def early_stop_note(info):
+    """Describe what stopping a generation at its word target saved"""
+    if not info or not info.get("stopped_early"):
+        return ""
+    return f", stopped at the target (~{info.get('saved_tokens', 0):,} tokens and ~{info.get('saved_seconds', 0):.0f} s saved)"
+
+def plan_parts(include_generated=False):
+    """Return the parts a whole-book run would generate: the missing and stale ones, or all of them"""
+    book = st.session_state.book_structure
+    parts = {
+        book_scheduler.chapter_key(chapter["number"]) for chapter in book["chapters"]
+        if include_generated or f"chapter_{chapter['number']}" not in st.session_state.generated_chapters
+        or chapter_is_stale(chapter)
+    }
+    # The introduction and conclusion are written again whenever a chapter is
+    rewrite_sections = include_generated or bool(parts)
+    generated_sections = book.get("generated_sections", {})
+    parts.update(
+        section for section in book_scheduler.SECTIONS
+        if rewrite_sections or section not in generated_sections
+    )
+    return parts
+
+def estimate_plan(parts, settings, provider, model):
+    """Estimate the cost and time of generating parts with a provider's model
+
+    Estimates are kept for the current plan only, so reruns that leave the
+    plan unchanged reuse them.
+    """
+    plan = book_scheduler.inputs_hash(
+        st.session_state.book_structure, settings, sorted(parts), st.session_state.early_stop
+    )
+    cache = st.session_state.get('estimate_cache')
+    if cache is None or cache["plan"] != plan:
+        cache = st.session_state.estimate_cache = {"plan": plan, "estimates": {}}
+    if (provider, model) not in cache["estimates"]:
+        cache["estimates"][provider, model] = cost_estimate.estimate_book(
+            st.session_state.book_structure, settings, parts, provider, model,
+            PARALLEL_PARTS, st.session_state.early_stop
+        )
+    return cache["estimates"][provider, model]
+
+def format_cost(cost):
+    return "unknown" if cost is None else f"${cost:,.2f}"
+
+def generate_whole_book(status):
+    """Start a checkpointed run generating every missing or stale part of the book
+
+    Chapters run in parallel; the introduction and conclusion are written
+    once all chapters are done. Progress is written to the status container.
+    Returns the {part: exception} of the parts that failed.
+    """
+    book = st.session_state.book_structure
+    provider = st.session_state.ai_provider
+    model = st.session_state.ai_model[provider]
+    chapters = {book_scheduler.chapter_key(chapter["number"]): chapter for chapter in book["chapters"]}
+    settings = {key: chapter_settings(chapter) for key, chapter in chapters.items()}
+
+    deps = book_scheduler.book_dependencies(book)
+    dirty = {
+        key for key, chapter in chapters.items()
+        if key not in st.session_state.generated_chapters or chapter_is_stale(chapter)
+    }
+    parts = book_scheduler.invalidate(deps, dirty)
+    if not parts.issuperset(book_scheduler.SECTIONS):
+        texts = section_chapter_texts()
+        for section in book_scheduler.SECTIONS:
+            stored = book.get("generated_sections", {}).get(section, {}).get("inputs")
+            brief = book_scheduler.section_brief(book, section)
+            if stored != book_scheduler.section_inputs(book, section, brief, texts):
+                parts.add(section)
+    if not parts:
+        status.write("Every part of the book is up to date.")
+        return {}
+
+    run = runs.Run.create(
+        book, provider, model, settings, parts,
+        project_id=st.session_state.project_id, early_stop=st.session_state.early_stop
+    )
+    st.session_state.run_id = run.run_id
+    return resume_run(run, status)
+
+def load_run_structure(run):
+    """Start from the book structure of a run, e.g. after the session was lost"""
+    st.session_state.book_structure = json.loads(json.dumps(run.meta["book_structure"]))
+    st.session_state.book_details.update(book_scheduler.book_info(st.session_state.book_structure))
+
+def resume_problem(run):
+    """Return why the session cannot resume a run, or None if it can"""
+    book = st.session_state.book_structure
+    if run.meta.get("project_id") != st.session_state.project_id:
+        return "the run belongs to another project"
+    if book is not None and book.get("title") != run.meta["book_structure"].get("title"):
+        return "the run was started for a different book structure"
+    if run.is_active():
+        return "the run is already being generated"
+    return None
+
+def resume_run(run, status):
+    """Generate what is left of a checkpointed run, storing each part as it completes
+
+    Parts finished before an interruption are taken from the checkpoint
+    instead of being generated again. A run from a lost session brings
+    back its book structure first. Raises runs.RunBusyError if the run is
+    being generated elsewhere.
+    """
+    if st.session_state.book_structure is None:
+        load_run_structure(run)
+    st.session_state.run_id = run.run_id
+    chapters = {book_scheduler.chapter_key(chapter["number"]): chapter for chapter in run.meta["book_structure"]["chapters"]}
+    resumed = run.completed_keys()
+
+    def on_start(key):
+        partial_words = len(run.partial_text(key).split())
+        resuming = f" (continuing from {partial_words:,} streamed words)" if partial_words else ""
+        status.write(f"⏳ {search_document_label(key)}...{resuming}")
+
+    def on_done(key, record, error):
+        label = search_document_label(key)
+        if error is not None:
+            status.write(f"❌ {label}: {error}")
+            return
+        text, info = record["text"], record["info"]
+        if key in book_scheduler.SECTIONS:
+            store_generated_section(key, text, info, record["inputs"])
+        else:
+            store_generated_chapter(chapters[key], text, info, run.meta["settings"][key])
+        source = "from checkpoint" if key in resumed else f"{len(text.split()):,} words{early_stop_note(info)}"
+        status.write(f"✅ {label}: {source}")
+
+    with tracing.span("book.generate", run=run.run_id):
+        return runs.execute(run, section_chapter_texts, on_done, PARALLEL_PARTS, on_start)
+
+def rewrite_chapter_text(chapter, text, operation, options, smooth, progress_bar):
+    """Run a rewrite operation over a chapter's sections in parallel"""
+    provider = st.session_state.ai_provider
+    model = st.session_state.ai_model[provider]
+
+    def progress(done, total):
+        progress_bar.progress(done / total if total else 1.0, text=f"{done}/{total} steps done")
+
+    return rewrite.rewrite_chapter(
+        text, operation, st.session_state.book_structure, chapter["title"], provider, model,
+        options, smooth, PARALLEL_PARTS, progress=progress
+    )
+
+def translate_final_book(language, glossary, progress_bar):
+    """Translate the final book, reusing every chunk already translated in the cache"""
+    provider = st.session_state.ai_provider
+    model = st.session_state.ai_model[provider]
+    limiter = providers.RateLimiter(TRANSLATION_REQUESTS_PER_MINUTE, TRANSLATION_WORKERS)
+
+    def progress(done, total):
+        progress_bar.progress(done / total if total else 1.0, text=f"{done}/{total} chunks translated")
+
+    return translation.translate_book(
+        st.session_state.book_structure, st.session_state.book_content, language, glossary,
+        provider, model, TRANSLATION_WORKERS,
+        limiter.wrap(providers.complete), limiter.wrap(providers.complete_structured),
+        progress=progress
+    )
+
+
+# Each script run is one trace. A run cut short by st.rerun() or st.stop()
+# leaves its spans open, so they are closed when the next run starts.
+for open_span in st.session_state.pop('trace_open_spans', []):
+    open_span.end(interrupted=True)
+tracing.detach()
+run_span = tracing.start_span("streamlit.run", step=st.session_state.current_step)
+
+# A session evicted while idle reads its chapters back from the archive it was saved to
+evicted_archive = st.session_state.memory.begin_run(session_book(), session_indexes())
+if evicted_archive is not None:
+    st.session_state.project_archive = evicted_archive
 
 # Main Application
 st.title("📚 BookCreator")
@@ -254,62 +706,204 @@ with st.sidebar:
     if st.button("4. Export Book", disabled=export_disabled):
         st.session_state.current_step = 'export'
 
+    st.header("Project")
+    if st.session_state.book_structure:
+        if st.button("💾 Save Project"):
+            save_current_project()
+            st.success("Project saved!")
+        if st.session_state.project_archive:
+            with open(st.session_state.project_archive.path, "rb") as project_file:
+                st.download_button(
+                    "📥 Download Project",
+                    data=project_file,
+                    file_name=f"{st.session_state.book_structure['title'].lower().replace(' ', '_')}.{project_store.FILE_EXTENSION}",
+                    mime="application/zip"
+                )
+
+    uploaded_project = st.file_uploader("Load a project", type=[project_store.FILE_EXTENSION, "json"])
+    if uploaded_project is not None and st.button("📂 Load Project"):
+        try:
+            report = load_project(uploaded_project)
+            st.session_state.current_step = 'structure'
+            if report and (report["quarantined"] or report["error"]):
+                # Shown after the rerun, since the import itself succeeded
+                st.session_state.import_report = report
+            st.rerun()
+        except project_store.ProjectFormatError as e:
+            st.error(f"Error loading the project: {str(e)}")
+
+    # Only this project's runs, and none being generated right now
+    unfinished_runs = [run for run in runs.list_runs(project_id=st.session_state.project_id) if not run.is_active()]
+    if unfinished_runs:
+        run_labels = {
+            run.run_id: (
+                f"{run.meta['book_structure']['title']} — {len(run.completed_keys())}/{len(run.parts)} parts, "
+                f"{datetime.fromtimestamp(run.meta['created']).strftime('%Y-%m-%d %H:%M')}"
+            )
+            for run in unfinished_runs
+        }
+        selected_run = st.selectbox("Unfinished runs", list(run_labels), format_func=run_labels.get)
+        if st.button("▶️ Resume Run", help="Completed parts are kept; only the rest is generated"):
+            run = runs.Run.open(selected_run)
+            if st.session_state.book_structure is None:
+                load_run_structure(run)
+            st.session_state.pending_run = selected_run
+            st.session_state.current_step = 'content'
+            st.rerun()
+
+    import_report = st.session_state.pop('import_report', None)
+    if import_report:
+        st.warning(
+            f"Imported {import_report['imported']} chapters; "
+            f"{len(import_report['quarantined'])} invalid entries were quarantined in the project file."
+        )
+        for entry in import_report["quarantined"]:
+            st.caption(f"{entry['key']}: {'; '.join(entry['errors'])}")
+        if import_report["error"]:
+            st.error(import_report["error"])
+
+    if startup_probe.SHOW_IN_SIDEBAR and startup_probe.cold_start:
+        st.header("Startup")
+        st.caption(
+            f"Cold start: imports {startup_probe.cold_start['imports_ms']:.0f} ms, "
+            f"first render {startup_probe.cold_start['render_ms']:.0f} ms"
+        )
+        if startup_probe.last_run:
+            st.caption(
+                f"Last rerun: imports {startup_probe.last_run['imports_ms']:.0f} ms, "
+                f"render {startup_probe.last_run['render_ms']:.0f} ms"
+            )
+        for name, elapsed_ms in startup_probe.lazy_imports.items():
+            st.caption(f"Lazy import of {name}: {elapsed_ms:.0f} ms")
+
+    if session_memory.SHOW_IN_SIDEBAR:
+        st.header("🧠 Memory")
+        memory = st.session_state.memory.report()
+        st.caption(
+            f"This session: {memory['resident_bytes'] / 1024:,.0f} KB held "
+            f"({memory['compressed_bytes'] / 1024:,.0f} KB compressed, {memory['index_bytes'] / 1024:,.0f} KB of indexes), "
+            f"{memory['saved_bytes'] / 1024:,.0f} KB saved"
+        )
+        all_sessions = session_memory.totals()
+        st.caption(
+            f"{all_sessions['sessions']} sessions, {all_sessions['evicted_sessions']} evicted: "
+            f"{all_sessions.get('resident_bytes', 0) / 1024:,.0f} KB held, "
+            f"{all_sessions.get('saved_bytes', 0) / 1024:,.0f} KB saved"
+        )
+
+    if tracing.SHOW_PANEL:
+        st.header("Slowest spans")
+        slowest = tracing.slowest_spans()
+        if slowest:
+            st.dataframe(
+                [
+                    {"Span": s.name, "ms": round(s.duration_ms, 1), **{k: str(v) for k, v in s.attributes.items()}}
+                    for s in slowest
+                ],
+                hide_index=True
+            )
+            with st.expander("By span name"):
+                st.dataframe(
+                    [
+                        {"Span": name, "Count": count, "Avg ms": round(total / count, 1), "Max ms": round(longest, 1)}
+                        for name, (count, total, longest) in sorted(
+                            tracing.span_summary().items(), key=lambda item: item[1][1], reverse=True
+                        )
+                    ],
+                    hide_index=True
+                )
+        else:
+            st.caption("No spans recorded yet.")
+
+screen_span = tracing.start_span(f"screen.{st.session_state.current_step}")
+st.session_state.trace_open_spans = [screen_span, run_span]
+
 # Configuration Screen
 if st.session_state.current_step == 'config':
     st.header("Configuration")
 
-    # Check API keys status
-    openai_key = os.environ.get('OPENAI_API_KEY')
-    anthropic_key = os.environ.get('ANTHROPIC_API_KEY')
-
     st.info("API keys are now stored securely in the application's environment.")
 
-    col1, col2 = st.columns(2)
-    with col1:
-        st.markdown("#### OpenAI API Status")
-        if openai_key:
-            st.success("✅ OpenAI API key is configured")
-        else:
-            st.error("❌ OpenAI API key is missing")
-
-    with col2:
-        st.markdown("#### Anthropic API Status")
-        if anthropic_key:
-            st.success("✅ Anthropic API key is configured")
-        else:
-            st.error("❌ Anthropic API key is missing")
+    # Status of every registered provider
+    provider_names = providers.provider_names()
+    for column, name in zip(st.columns(len(provider_names)), provider_names):
+        spec = providers.get_provider(name)
+        with column:
+            st.markdown(f"#### {name}")
+            if spec.api_key_env is None:
+                st.success(f"✅ Local server at {spec.base_url}")
+            elif providers.has_credentials(name):
+                st.success(f"✅ {name} API key is configured")
+            else:
+                st.error(f"❌ {name} API key is missing")
 
     # Provider selection
     provider = st.selectbox(
         "Select AI Provider",
-        ["OpenAI", "Anthropic"],
-        index=0 if st.session_state.ai_provider == "OpenAI" else 1
+        provider_names,
+        index=provider_names.index(st.session_state.ai_provider) if st.session_state.ai_provider in provider_names else 0
+    )
+    spec = providers.get_provider(provider)
+
+    # Model selection based on provider; a server may also be asked what it serves
+    models = list(st.session_state.get('fetched_models', {}).get(provider) or spec.models)
+    current_model = st.session_state.ai_model.get(provider, spec.models[0])
+    model = st.selectbox(
+        f"Select {provider} Model",
+        models,
+        index=models.index(current_model) if current_model in models else 0,
+        help=f"{spec.models[0]} is the default model"
+    )
+    if spec.base_url and st.button("🔄 Fetch Models from Server"):
+        try:
+            st.session_state.setdefault('fetched_models', {})[provider] = providers.list_models(provider)
+            st.rerun()
+        except Exception as e:
+            st.error(f"Could not list the models of {provider}: {str(e)}")
+
+    # OpenAI-compatible inference servers, e.g. vLLM or llama.cpp on the local network.
+    # They are saved for every user, so only an admin instance offers this, and never with a key
+    if providers.ALLOW_SERVER_ADMIN:
+        with st.expander("➕ Add an OpenAI-compatible Server"):
+            server_name = st.text_input("Name", placeholder="Local vLLM")
+            server_url = st.text_input("Base URL", placeholder="http://localhost:8000/v1")
+            server_models = st.text_input("Models (comma separated)", placeholder="meta-llama/Llama-3.1-8B-Instruct")
+            server_concurrent = st.number_input("Max concurrent requests (0 for no limit)", min_value=0, value=0)
+            server_streaming = st.checkbox("Server supports streaming", value=True)
+            st.caption("Servers that need an API key are added to the providers file instead.")
+            if st.button("Add Server", disabled=not (server_name and server_url and server_models)):
+                try:
+                    providers.register(providers.ProviderSpec(
+                        server_name.strip(), "openai",
+                        [m.strip() for m in server_models.split(",") if m.strip()],
+                        None, server_url.strip(),
+                        streaming=server_streaming, max_concurrent=server_concurrent or None
+                    ), save=True, replace=False)
+                    st.session_state.ai_provider = server_name.strip()
+                    st.rerun()
+                except (OSError, ValueError) as e:
+                    st.error(f"Could not add the server: {str(e)}")
+
+    # Models often write 30-50% more than the chapter length asked for
+    stop_at_target = st.checkbox(
+        "Stop chapters at the word target",
+        value=st.session_state.early_stop is not None,
+        help="Once a chapter passes its target by the tolerance, generation stops at the end of the paragraph"
+    )
+    tolerance = st.slider(
+        "Tolerance above the target (%)", 0, 50,
+        round((st.session_state.early_stop or token_budget.EARLY_STOP_TOLERANCE) * 100), 5,
+        disabled=not stop_at_target
     )
-
-    # Model selection based on provider
-    if provider == "OpenAI":
-        model = st.selectbox(
-            "Select OpenAI Model",
-            ["gpt-4o", "gpt-4-turbo-preview", "gpt-4"],
-            index=0 if st.session_state.ai_model['OpenAI'] == "gpt-4o" else (1 if st.session_state.ai_model['OpenAI'] == "gpt-4-turbo-preview" else 2),
-            help="gpt-4o is the latest and most capable model"
-        )
-    else:
-        model = st.selectbox(
-            "Select Anthropic Model",
-            ["claude-3-5-sonnet-20241022", "claude-3-opus-20240229", "claude-3-sonnet-20240229"],
-            index=0 if st.session_state.ai_model['Anthropic'] == "claude-3-5-sonnet-20241022" else (1 if st.session_state.ai_model['Anthropic'] == "claude-3-opus-20240229" else 2),
-            help="claude-3-5-sonnet-20241022 is the latest model"
-        )
 
     if st.button("Save Configuration"):
         # Verify selected provider has its API key
-        selected_key = openai_key if provider == "OpenAI" else anthropic_key
-        if not selected_key:
+        if not providers.has_credentials(provider):
             st.error(f"Cannot use {provider}: API key not configured")
         else:
             st.session_state.ai_provider = provider
             st.session_state.ai_model[provider] = model
+            st.session_state.early_stop = tolerance / 100 if stop_at_target else None
             st.success(f"Configuration saved! Using {provider} ({model}) for text generation.")
             st.session_state.current_step = 'structure'
             st.rerun()
@@ -332,6 +926,12 @@ elif st.session_state.current_step == 'structure':
             'goals': ''
         }
         st.session_state.book_content = {} # Reset book content as well
+        st.session_state.chapter_stats = book_stats.StatsIndex()
+        st.session_state.chapter_plans = {}
+        st.session_state.search_index = search_index.SearchIndex()
+        st.session_state.project_id = uuid.uuid4().hex
+        st.session_state.project_archive = None
+        st.session_state.history = revisions.BookHistory()
         st.success("Ready to start a new book!")
         st.rerun()
 
@@ -365,32 +965,28 @@ elif st.session_state.current_step == 'structure':
             })
 
             with st.spinner("Generating book structure..."):
-                prompt = create_structure_prompt(book_title, book_theme, book_audience, book_style, book_goals)
-                result = generate_ai_response(prompt)
-
-                if result:
-                    try:
-                        # Extract JSON from response
-                        json_str = result
-                        if "```json" in result:
-                            json_str = result.split("```json")[1].split("```")[0].strip()
-                        elif "```" in result:
-                            json_str = result.split("```")[1].strip()
-
-                        book_structure = json.loads(json_str)
-
-                        # Add additional information
-                        book_structure["theme"] = book_theme
-                        book_structure["audience"] = book_audience
-                        book_structure["style"] = book_style
-                        book_structure["goals"] = book_goals
-
-                        st.session_state.book_structure = book_structure
-                        st.success("Book structure generated successfully!")
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"Error processing the response: {str(e)}")
-                        st.write("Received response:", result)
+                prompt = prompts.create_structure_prompt(book_title, book_theme, book_audience, book_style, book_goals)
+                book_structure = generate_structure(prompt)
+
+                if book_structure:
+                    # Add additional information
+                    book_structure["theme"] = book_theme
+                    book_structure["audience"] = book_audience
+                    book_structure["style"] = book_style
+                    book_structure["goals"] = book_goals
+
+                    st.session_state.book_structure = book_structure
+                    st.session_state.search_index.update("introduction", book_structure.get("introduction", ""))
+                    st.session_state.search_index.update("conclusion", book_structure.get("conclusion", ""))
+                    st.success("Book structure generated successfully!")
+                    st.rerun()
+
+    structure_retries = structure_generation.retry_stats()
+    if structure_retries["requests"]:
+        st.caption(
+            f"Structure requests: {structure_retries['requests']}, "
+            f"retried {structure_retries['retry_rate']:.0%}"
+        )
 
     if st.session_state.book_structure:
         st.header("Book Structure")
@@ -462,7 +1058,7 @@ elif st.session_state.current_step == 'structure':
                             Scrivi solo una descrizione sintetica (3-5 frasi) che spieghi chiaramente di cosa tratterà questo capitolo.
                             La descrizione dovrebbe essere accattivante e informativa, e dovrebbe adattarsi al contesto generale del libro.
                             """
-                            result = generate_ai_response(prompt)
+                            result = generate_ai_response(prompt, target_words=prompts.DESCRIPTION_TARGET_WORDS)
                             if result:
                                 chapter["description"] = result
                                 st.success(f"Descrizione del capitolo {chapter['number']} rigenerata!")
@@ -483,16 +1079,235 @@ elif st.session_state.current_step == 'content':
     else:
         book = st.session_state.book_structure
 
-        # Chapter selection with improved UI
+        # Book-level statistics, read from the running totals
+        totals = st.session_state.chapter_stats.totals()
+        if totals["chapters"]:
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Chapters generated", f"{totals['chapters']}/{len(book['chapters'])}")
+            col2.metric("Words", f"{totals['words']:,}")
+            col3.metric("Reading time", f"{totals['reading_minutes']:.0f} min")
+            if totals["target_ratio"] is not None:
+                col4.metric("Target vs actual", f"{totals['target_ratio']:.0%}", delta=f"{totals['target_delta']:+,} words")
+
+        # Draft branches: alternative versions of the whole book
+        history = st.session_state.history
+        col1, col2, col3 = st.columns([2, 2, 1])
+        with col1:
+            branch_names = list(history.branches)
+            selected_branch = st.selectbox(
+                "Draft branch",
+                branch_names,
+                index=branch_names.index(history.current_branch),
+                help="Each branch keeps its own version of every chapter"
+            )
+            if selected_branch != history.current_branch:
+                switch_branch(selected_branch)
+                st.rerun()
+        with col2:
+            new_branch = st.text_input("New branch name")
+        with col3:
+            if st.button("🌿 Create Branch", disabled=not new_branch or new_branch in history.branches):
+                commit_all_chapters()
+                history.create_branch(new_branch)
+                st.success(f"Now working on branch '{new_branch}'")
+                st.rerun()
+
+        # Search and bulk replace across the whole book
+        with st.expander("🔍 Search & Replace"):
+            index = st.session_state.search_index
+            query = st.text_input("Search", help='Words must all appear; put phrases in "double quotes"')
+            if query:
+                # Index anything not indexed yet, e.g. chapters of a freshly loaded project
+                with tracing.span("search.query"):
+                    documents = search_documents()
+                    if documents.keys() != index.documents.keys():
+                        index.sync(documents, load=peek_search_text)
+                    # Only the chapters that match are loaded
+                    results = index.search(query, load=search_text)
+                match_count = sum(len(spans) for spans in results.values())
+                st.caption(f"{match_count} matches in {len(results)} sections")
+                for doc_id, spans in sorted(results.items()):
+                    st.markdown(f"**{search_document_label(doc_id)}** — {len(spans)} matches")
+                    for snippet in index.snippets(doc_id, spans):
+                        st.markdown(f"> {snippet}")
+
+                replacement = st.text_input("Replace with", key="search_replacement")
+                match_case = st.checkbox("Match case", value=True, key="search_match_case")
+                if st.button("Replace in all chapters", help="Replaces the exact search text as one phrase"):
+                    changed = index.replace(
+                        query.strip('"'), replacement, search_documents(), match_case=match_case, load=search_text
+                    )
+                    apply_search_replacements(changed)
+                    st.success(f"Replaced text in {len(changed)} sections")
+                    st.rerun()
+
+        # Near-duplicate paragraphs across chapters and overlapping chapter descriptions
+        with st.expander("🔁 Repeated Content"):
+            st.caption(
+                "Finds paragraphs that say nearly the same thing in different chapters. "
+                "Chapter descriptions are checked too, so overlapping chapters can be fixed before generating them."
+            )
+            if st.checkbox("Check for repeated content", key="check_redundancy"):
+                threshold = st.slider("Similarity threshold", 0.4, 1.0, 0.6, 0.05)
+                with tracing.span("redundancy.check"):
+                    index = redundancy_index()
+                    matches = index.duplicates(threshold)
+                st.caption(f"{len(matches)} near-duplicates among {index.paragraph_count():,} paragraphs")
+                for match in matches[:20]:
+                    st.markdown(
+                        f"**{search_document_label(match.doc_a)}** ↔ **{search_document_label(match.doc_b)}** "
+                        f"— similarity {match.score:.0%}"
+                    )
+                    col1, col2 = st.columns(2)
+                    col1.markdown(f"> {index.paragraph(match.doc_a, match.paragraph_a, load=search_text)}")
+                    col2.markdown(f"> {index.paragraph(match.doc_b, match.paragraph_b, load=search_text)}")
+                if len(matches) > 20:
+                    st.caption(f"{len(matches) - 20} more; raise the threshold to see only the closest ones.")
+
+        # Whole-book generation: chapters in parallel, then introduction and conclusion
+        with st.expander("🧩 Generate Whole Book", expanded='pending_run' in st.session_state):
+            missing = [c for c in book["chapters"] if f"chapter_{c['number']}" not in st.session_state.generated_chapters]
+            stale = [c for c in book["chapters"] if chapter_is_stale(c)]
+            generated_sections = book.get("generated_sections", {})
+            st.caption(
+                f"{len(missing)} chapters to generate, {len(stale)} out of date; "
+                f"full introduction {'written' if 'introduction' in generated_sections else 'not written yet'}, "
+                f"conclusion {'written' if 'conclusion' in generated_sections else 'not written yet'}."
+            )
+            for chapter in stale:
+                st.caption(f"Chapter {chapter['number']} changed since it was generated and will be rewritten.")
+            pending_run = st.session_state.pop('pending_run', None)
+            if pending_run or st.button("🚀 Generate Missing and Stale Parts"):
+                with st.status("Generating the book...", expanded=True) as status:
+                    run = runs.Run.open(pending_run) if pending_run else None
+                    problem = resume_problem(run) if run else None
+                    if problem:
+                        status.update(label=f"Cannot resume the run: {problem}", state="error")
+                    else:
+                        try:
+                            errors = resume_run(run, status) if run else generate_whole_book(status)
+                        except runs.RunBusyError as e:
+                            status.update(label=str(e), state="error")
+                        else:
+                            status.update(
+                                label="Some parts failed" if errors else "The book is up to date",
+                                state="error" if errors else "complete"
+                            )
+
+        # Preflight estimate of the whole-book plan. It prices every part with every model,
+        # so it is only computed on request, and reused while the plan is unchanged
+        with st.expander("💰 Cost and Time Estimate"):
+            if not st.checkbox("Estimate the plan", key="show_estimate"):
+                st.caption("Projects the tokens, time and cost of the plan, with this model and every other one.")
+            else:
+                include_generated = st.checkbox("Include parts already generated", key="estimate_all")
+                parts = plan_parts(include_generated)
+                scale = st.slider(
+                    "Chapter lengths (% of the plan)", 50, 150, 100, 10, key="estimate_scale",
+                    help="Try shorter or longer chapters before changing the plan"
+                )
+                settings = {}
+                for chapter in book["chapters"]:
+                    chapter_plan = chapter_settings(chapter)
+                    settings[book_scheduler.chapter_key(chapter["number"])] = dict(
+                        chapter_plan, word_count=round(chapter_plan["word_count"] * scale / 100)
+                    )
+                provider = st.session_state.ai_provider
+                model = st.session_state.ai_model[provider]
+                estimates, plan_totals = estimate_plan(parts, settings, provider, model)
+
+                col1, col2, col3, col4 = st.columns(4)
+                col1.metric("Input tokens", f"{plan_totals['input_tokens']:,}")
+                col2.metric("Output tokens", f"{plan_totals['output_tokens']:,}")
+                col3.metric("Time", f"{plan_totals['seconds'] / 60:.0f} min",
+                            help=f"{plan_totals['sequential_seconds'] / 60:.0f} min one part at a time")
+                col4.metric("Cost", format_cost(plan_totals["cost"]))
+                st.caption(f"{plan_totals['parts']} parts with {provider} {model}, {PARALLEL_PARTS} at a time")
+                st.dataframe(
+                    [
+                        {
+                            "Part": search_document_label(part.key),
+                            "Input tokens": part.input_tokens,
+                            "Output tokens": part.output_tokens,
+                            "Minutes": round(part.seconds / 60, 1),
+                            "Cost": format_cost(part.cost),
+                        }
+                        for part in estimates
+                    ],
+                    hide_index=True, use_container_width=True
+                )
+
+                # The same plan with every other model
+                alternatives = [
+                    (name, other_model) for name in providers.provider_names()
+                    for other_model in providers.get_provider(name).models
+                    if (name, other_model) != (provider, model)
+                ]
+                comparison = []
+                for name, other_model in alternatives:
+                    _, other_totals = estimate_plan(parts, settings, name, other_model)
+                    comparison.append({
+                        "Provider": name, "Model": other_model,
+                        "Minutes": round(other_totals["seconds"] / 60), "Cost": other_totals["cost"],
+                    })
+                comparison.sort(key=lambda row: (row["Cost"] is None, row["Cost"] or 0))
+                st.markdown("**Other models**")
+                st.dataframe(
+                    [dict(row, Cost=format_cost(row["Cost"])) for row in comparison],
+                    hide_index=True, use_container_width=True
+                )
+
+                col1, col2 = st.columns(2)
+                with col1:
+                    if scale != 100 and st.button(f"📏 Apply {scale}% to the chapter lengths"):
+                        for chapter in book["chapters"]:
+                            if f"chapter_{chapter['number']}" in st.session_state.generated_chapters:
+                                continue
+                            chapter_plan = chapter_settings(chapter)
+                            st.session_state.chapter_plans[chapter["number"]] = dict(
+                                chapter_plan, word_count=min(max(round(chapter_plan["word_count"] * scale / 10000) * 100, 500), 7000)
+                            )
+                            st.session_state.pop(f"length_{chapter['number']}", None)
+                        st.session_state.pop("estimate_scale", None)
+                        st.rerun()
+                with col2:
+                    if comparison:
+                        labels = {(row["Provider"], row["Model"]): f"{row['Provider']} {row['Model']}" for row in comparison}
+                        choice = st.selectbox("Switch model", list(labels), format_func=labels.get, key="estimate_model")
+                        if st.button("Use this model", disabled=not providers.has_credentials(choice[0])):
+                            st.session_state.ai_provider = choice[0]
+                            st.session_state.ai_model[choice[0]] = choice[1]
+                            st.rerun()
+
+        # Chapter selection: a status table of one page of chapters, and the
+        # editing widgets of the open chapter only, so reruns cost the same
+        # however long the book is
         st.markdown("### Select a Chapter to Generate")
 
-        # Display chapters as cards
         chapters = book["chapters"]
-        for chapter in chapters:
+        page_count = max(1, -(-len(chapters) // CHAPTERS_PER_PAGE))
+        page = st.number_input("Chapter page", min_value=1, max_value=page_count, value=1, step=1, key="chapter_page")
+        start = (page - 1) * CHAPTERS_PER_PAGE
+        page_chapters = chapters[start:start + CHAPTERS_PER_PAGE]
+        st.dataframe([chapter_status(chapter) for chapter in page_chapters], hide_index=True, use_container_width=True)
+        st.caption(f"Page {page} of {page_count}")
+
+        page_numbers = [chapter['number'] for chapter in page_chapters]
+        page_titles = {chapter['number']: chapter['title'] for chapter in page_chapters}
+        current_number = (st.session_state.current_chapter or {}).get('number')
+        open_number = st.selectbox(
+            "Open chapter",
+            page_numbers,
+            index=page_numbers.index(current_number) if current_number in page_numbers else 0,
+            format_func=lambda number: f"Chapter {number}: {page_titles[number]}"
+        )
+        for chapter in page_chapters:
+            if chapter['number'] != open_number:
+                continue
             chapter_key = f"chapter_{chapter['number']}"
             is_generated = chapter_key in st.session_state.generated_chapters
 
-            # Create a card-like container for each chapter
+            # Card of the open chapter
             with st.container():
                 st.markdown(f"""
                 <div style="padding: 1rem; margin: 0.5rem 0; border: 1px solid #e0e0e0; border-radius: 5px; background: {'#f8f9fa' if not is_generated else '#e8f5e9'}">
@@ -528,15 +1343,8 @@ elif st.session_state.current_step == 'content':
                 # Add regenerate description button
                 if st.button("🤖 Regenerate Description", key=f"regen_desc_{chapter['number']}"):
                     with st.spinner("Regenerating chapter description..."):
-                        prompt = f"""
-                        You are an expert editorial consultant. Help write an engaging description for
-                        the chapter '{chapter_title}' of a book titled '{book["title"]}' on the theme '{book["theme"]}' 
-                        for an audience of '{book["audience"]}' in {book["style"]} style.
-
-                        Write a concise description (3-5 sentences) that clearly explains what this chapter will cover.
-                        The description should be engaging and informative, fitting the book's overall context.
-                        """
-                        result = generate_ai_response(prompt)
+                        prompt = prompts.create_description_prompt(book, chapter_title)
+                        result = generate_ai_response(prompt, target_words=prompts.DESCRIPTION_TARGET_WORDS)
                         if result:
                             update_chapter_info(
                                 chapter['number'],
@@ -551,8 +1359,10 @@ elif st.session_state.current_step == 'content':
                 with col1:
                     # Generation options
                     if not is_generated:
+                        plan = chapter_settings(chapter)
                         key_points = st.text_area(
                             "Key Points",
+                            value=plan["key_points"],
                             help="Enter specific points you want to include in this chapter",
                             key=f"key_points_{chapter['number']}"
                         )
@@ -560,6 +1370,7 @@ elif st.session_state.current_step == 'content':
                         # Add custom content field
                         custom_content = st.text_area(
                             "Custom Content (Optional)",
+                            value=plan["custom_content"] or "",
                             help="Add any specific text, data, or information you want to include in this chapter",
                             key=f"custom_content_{chapter['number']}"
                         )
@@ -569,12 +1380,17 @@ elif st.session_state.current_step == 'content':
                             "Chapter Length (words)",
                             min_value=500,
                             max_value=7000,
-                            value=2000,
+                            value=plan["word_count"],
                             step=100,
                             key=f"length_{chapter['number']}",
                             help="Slide to set the approximate number of words for this chapter"
                         )
                         st.caption(f"Selected length: {word_count:,} words")
+                        st.session_state.chapter_plans[chapter['number']] = {
+                            "word_count": word_count,
+                            "key_points": key_points,
+                            "custom_content": custom_content or None
+                        }
 
                 with col2:
                     # Generation/View buttons
@@ -583,21 +1399,32 @@ elif st.session_state.current_step == 'content':
                             st.session_state.current_chapter = chapter
                             st.rerun()
                     else:
+                        if chapter_key in st.session_state.history.cleared_heads:
+                            if st.button("↩️ Restore Draft", key=f"restore_{chapter['number']}",
+                                         help="Bring back the last draft of this chapter instead of paying to regenerate it"):
+                                text, fields = st.session_state.history.restore(chapter_key)
+                                st.session_state.generated_chapters[chapter_key] = dict(fields)
+                                show_chapter_text(chapter_key, text)
+                                st.rerun()
                         if st.button("✨ Generate", key=f"generate_{chapter['number']}"):
                             with st.spinner(f"Generating chapter {chapter['number']}..."):
+                                # The plan stored from the form above, as the whole-book run and estimate read it
+                                settings = chapter_settings(chapter)
+                                word_count = settings["word_count"]
                                 # Create a modified chapter info with updated title and description
                                 chapter_info = chapter.copy()
                                 chapter_info["title"] = chapter_title
                                 chapter_info["description"] = chapter_description
 
-                                prompt = create_chapter_prompt(
-                                    book,
-                                    chapter_info,
-                                    st.session_state.get(f"key_points_{chapter['number']}", ""),
-                                    f"{word_count} words",  # Pass exact word count to prompt
-                                    st.session_state.get(f"custom_content_{chapter['number']}", None)  # Pass custom content
-                                )
-                                result = generate_ai_response(prompt)
+                                with tracing.span("prompt.build", chapter=chapter['number']):
+                                    prompt = prompts.create_chapter_prompt(
+                                        book,
+                                        chapter_info,
+                                        settings["key_points"],
+                                        f"{word_count} words",  # Pass exact word count to prompt
+                                        settings["custom_content"]  # Pass custom content
+                                    )
+                                result, generation_info = generate_long_response(prompt, word_count)
 
                                 if result:
                                     # Aggiorna sia la struttura del libro che i capitoli generati
@@ -615,17 +1442,12 @@ elif st.session_state.current_step == 'content':
                                     )
 
                                     # Aggiorna i capitoli generati
-                                    st.session_state.generated_chapters[chapter_key] = {
-                                        "number": chapter['number'],
-                                        "title": chapter_title,
-                                        "content": result,
-                                        "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                                        "metadata": {
-                                            "word_count": word_count,
-                                            "key_points": st.session_state.get(f"key_points_{chapter['number']}", ""),
-                                            "custom_content": st.session_state.get(f"custom_content_{chapter['number']}", None)
-                                        }
-                                    }
+                                    store_generated_chapter(
+                                        chapter_info,
+                                        result,
+                                        generation_info,
+                                        settings
+                                    )
                                     st.success(f"Chapter {chapter['number']} generated successfully!")
                                     st.session_state.current_chapter = chapter_info
                                     st.rerun()
@@ -643,22 +1465,50 @@ elif st.session_state.current_step == 'content':
                 generated = st.session_state.generated_chapters[chapter_key]
                 edited_content = st.text_area(
                     "Edit Content",
-                    value=generated["content"],
+                    value=chapter_text(generated),
                     height=400,
                     key=f"edit_content_{current_chapter['number']}"
                 )
 
+                stats = st.session_state.chapter_stats.update(
+                    chapter_key,
+                    generated["content"],
+                    generated.get("metadata", {}).get("word_count")
+                )
+                with st.expander("📊 Chapter statistics"):
+                    col1, col2, col3, col4 = st.columns(4)
+                    col1.metric("Words", f"{stats['words']:,}")
+                    col2.metric("Sentences", f"{stats['sentences']:,}")
+                    col3.metric("Paragraphs", f"{stats['paragraphs']:,}")
+                    col4.metric("Reading time", f"{stats['reading_minutes']:.1f} min")
+                    if stats["target_ratio"] is not None:
+                        st.caption(
+                            f"Target: {stats['target_words']:,} words, "
+                            f"actual: {stats['words']:,} ({stats['target_delta']:+,}, {stats['target_ratio']:.0%})"
+                        )
+                    generation_info = generated.get("metadata", {}).get("generation")
+                    if generation_info and generation_info.get("stopped_early"):
+                        st.caption(f"Generation{early_stop_note(generation_info)}.")
+                    if stats["outline"]:
+                        st.markdown("\n".join(
+                            f"{'  ' * (level - 1)}- {title}" for level, title in stats["outline"]
+                        ))
+
                 col1, col2, col3 = st.columns([1, 1, 1])
                 with col1:
                     if st.button("💾 Save Changes"):
-                        generated["content"] = edited_content
-                        generated["last_edited"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                        store_chapter_text(chapter_key, edited_content, "Edited")
                         st.success("Changes saved successfully!")
                         st.rerun()
                 with col2:
                     if st.button("🔄 Regenerate Chapter"):
+                        # Keep the draft as it is now, for "Restore Draft"
+                        commit_all_chapters()
                         st.session_state.generated_chapters.pop(chapter_key, None)
-                        st.success("Chapter cleared. You can now regenerate it.")
+                        st.session_state.chapter_stats.remove(chapter_key)
+                        st.session_state.search_index.remove(chapter_key)
+                        st.session_state.history.clear(chapter_key)
+                        st.success("Chapter cleared. You can now regenerate it, or restore the previous draft.")
                         st.rerun()
                 with col3:
                     if st.button("📋 Copy to final book"):
@@ -667,9 +1517,83 @@ elif st.session_state.current_step == 'content':
                             'content': edited_content,
                             'copied_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                         }
+                        st.session_state.search_index.update(f"book_{current_chapter['number']}", edited_content)
                         st.success(f"Chapter {current_chapter['number']} copied to final book!")
                         st.rerun()
 
+                # Bulk rewrites run over the chapter's sections in parallel
+                with st.expander("✨ AI Chapter Revision"):
+                    operation = st.selectbox(
+                        "Operation", list(rewrite.OPERATIONS), key=f"rewrite_op_{current_chapter['number']}"
+                    )
+                    options = {}
+                    if operation == "Apply style":
+                        col1, col2 = st.columns(2)
+                        options["style"] = rewrite.STYLE_OPTIONS[col1.selectbox(
+                            "Writing style", list(rewrite.STYLE_OPTIONS), key=f"rewrite_style_{current_chapter['number']}"
+                        )]
+                        options["format"] = rewrite.FORMAT_OPTIONS[col2.selectbox(
+                            "Structure format", list(rewrite.FORMAT_OPTIONS), key=f"rewrite_format_{current_chapter['number']}"
+                        )]
+                    smooth = st.checkbox(
+                        "Smooth the transitions between sections", value=True,
+                        key=f"rewrite_smooth_{current_chapter['number']}"
+                    )
+                    if st.button("Apply AI Revision", key=f"rewrite_{current_chapter['number']}"):
+                        progress_bar = st.progress(0.0, text="Revising the sections...")
+                        try:
+                            new_text, report = rewrite_chapter_text(
+                                current_chapter, edited_content, operation, options, smooth, progress_bar
+                            )
+                        except Exception as e:
+                            st.error(f"Error calling {st.session_state.ai_provider} API: {str(e)}")
+                        else:
+                            store_chapter_text(chapter_key, new_text, operation)
+                            st.session_state.rewrite_report = (
+                                f"{operation}: {report['sections']} sections in {report['seconds']:.0f} s, "
+                                f"{report['transitions']} transitions smoothed, {report['output_tokens']:,} tokens generated"
+                            )
+                            st.rerun()
+                    if 'rewrite_report' in st.session_state:
+                        st.success(st.session_state.pop('rewrite_report'))
+
+                # Revision history of this chapter on the current branch
+                with st.expander("🕘 Revision History"):
+                    history = st.session_state.history
+                    lineage = history.lineage(chapter_key)
+                    if not lineage:
+                        st.caption("No revisions recorded yet.")
+                    else:
+                        head = lineage[0]
+                        labels = {
+                            r.id: f"#{r.id} {r.label} — {r.created_at} ({r.words:,} words)"
+                            for r in lineage
+                        }
+                        selected_rev = st.selectbox(
+                            "Revision",
+                            list(labels),
+                            format_func=labels.get,
+                            key=f"revision_{current_chapter['number']}"
+                        )
+                        col1, col2, col3 = st.columns(3)
+                        with col1:
+                            if st.button("↩️ Undo", disabled=history.undo_target(chapter_key) is None,
+                                         key=f"undo_{current_chapter['number']}"):
+                                show_chapter_text(chapter_key, history.undo(chapter_key))
+                                st.rerun()
+                        with col2:
+                            if st.button("⏪ Restore Revision", disabled=selected_rev == head.id,
+                                         key=f"restore_rev_{current_chapter['number']}"):
+                                show_chapter_text(chapter_key, history.checkout(chapter_key, selected_rev))
+                                st.rerun()
+                        with col3:
+                            show_diff = st.checkbox("Show diff", key=f"show_diff_{current_chapter['number']}")
+                        if show_diff and selected_rev != head.id:
+                            st.code(history.diff(chapter_key, selected_rev, head.id) or "No differences", language="diff")
+
+                        stored_bytes, revision_count = history.storage()
+                        st.caption(f"{revision_count} revisions stored in {stored_bytes / 1024:,.1f} KB")
+
 # Export Screen
 elif st.session_state.current_step == 'export':
     st.header("Book")
@@ -677,42 +1601,127 @@ elif st.session_state.current_step == 'export':
     # If there are copied chapters, show them in order
     if st.session_state.book_content:
         book = st.session_state.book_structure
+        # The export needs every chapter body, so load any still in the archive
+        for chapter in st.session_state.book_content.values():
+            chapter_text(chapter)
+        sorted_chapters = book_export.sorted_chapters(st.session_state.book_content)
+
+        # Paginated preview: only one page of chapters is rendered per rerun
+        page_count = max(1, -(-len(sorted_chapters) // PREVIEW_CHAPTERS_PER_PAGE))
+        page = st.number_input("Preview page", min_value=1, max_value=page_count, value=1, step=1)
+        st.caption(f"Page {page} of {page_count}")
+
+        if page == 1:
+            st.markdown("## Introduction")
+            st.markdown(book['introduction'])
+            st.markdown("---")
 
-        # Show the introduction
-        st.markdown("## Introduction")
-        st.markdown(book['introduction'])
-        st.markdown("---")
-
-        # Sort chapters by number and show them
-        sorted_chapters = dict(sorted(st.session_state.book_content.items()))
-        for num, chapter in sorted_chapters.items():
+        start = (page - 1) * PREVIEW_CHAPTERS_PER_PAGE
+        for num, chapter in sorted_chapters[start:start + PREVIEW_CHAPTERS_PER_PAGE]:
             st.markdown(f"## Chapter {num}: {chapter['title']}")
             st.markdown(chapter['content'])
             st.markdown("---")
 
-        # Show the conclusion
-        st.markdown("## Conclusion")
-        st.markdown(book['conclusion'])
+        if page == page_count:
+            st.markdown("## Conclusion")
+            st.markdown(book['conclusion'])
 
         # Export options
-        export_format = st.selectbox("Export Format", ["Markdown", "Plain Text"])
-
-        # Prepare content for export
-        export_content = f"# {book['title']}\n\n"
-        export_content += "## Introduction\n" + book['introduction'] + "\n\n"
-
-        for num, chapter in sorted_chapters.items():
-            export_content += f"## Chapter {num}: {chapter['title']}\n"
-            export_content += chapter['content'] + "\n\n"
+        export_format = st.selectbox("Export Format", list(book_export.EXPORT_FORMATS))
+
+        # The export file is only assembled when the user asks for it
+        version = book_export.book_version_hash(book, st.session_state.book_content)
+        prepared = st.session_state.get('export_prepared')
+        if prepared != (version, export_format):
+            if st.button("Prepare Download"):
+                st.session_state.export_prepared = (version, export_format)
+                st.rerun()
+        else:
+            # Streamlit reads the download into memory and keeps it while the
+            # button is shown, so the button goes away once it has been used
+            with tracing.span("export.write", format=export_format):
+                export_file = book_export.open_export_file(book, st.session_state.book_content, export_format)
+            with export_file:
+                downloaded = st.download_button(
+                    "Download Book",
+                    data=export_file,
+                    file_name=book_export.export_file_name(book, export_format),
+                    mime=book_export.EXPORT_FORMATS[export_format]["mime"]
+                )
+            if downloaded:
+                st.session_state.export_prepared = None
+                st.success("Book downloaded successfully!")
+
+        with st.expander("🌐 Translate Book"):
+            target_language = st.text_input("Target language", value="English")
+            glossary_text = st.text_area(
+                "Glossary (one 'term = translation' per line)",
+                key="translation_glossary",
+                help="These terms are translated the same way in every chapter."
+            )
+            if st.button("Translate", disabled=not target_language.strip()):
+                progress_bar = st.progress(0.0, text="Translating...")
+                try:
+                    translated_book, translated_content, report = translate_final_book(
+                        target_language.strip(), translation.parse_glossary(glossary_text), progress_bar
+                    )
+                    st.session_state.translation = {
+                        "version": version,
+                        "language": target_language.strip(),
+                        "book_structure": translated_book,
+                        "book_content": translated_content,
+                        "report": report,
+                    }
+                    st.session_state.pop('translation_prepared', None)
+                except Exception as e:
+                    st.error(f"Translation failed: {e}. Chunks already translated are kept for the next attempt.")
+
+            translated = st.session_state.get('translation')
+            if translated:
+                report = translated["report"]
+                st.caption(
+                    f"{translated['language']}: {report['chunks']} chunks, {report['cached']} reused from cache, "
+                    f"{report['input_tokens']:,} input and {report['output_tokens']:,} output tokens"
+                )
+                if report["truncated"]:
+                    st.warning(
+                        f"{report['truncated']} chunks were still cut off by the output limit; "
+                        "translate again to retry them."
+                    )
+                if translated["version"] != version:
+                    st.warning("The book changed after this translation; translate again to update it.")
+                # Assembled on request, as the book's own download is
+                translation_key = (translated["language"], translated["version"], export_format)
+                if st.session_state.get('translation_prepared') != translation_key:
+                    if st.button("Prepare Translation Download"):
+                        st.session_state.translation_prepared = translation_key
+                        st.rerun()
+                else:
+                    with tracing.span("export.write", format=export_format, language=translated["language"]):
+                        export_file = book_export.open_export_file(
+                            translated["book_structure"], translated["book_content"], export_format
+                        )
+                    with export_file:
+                        downloaded = st.download_button(
+                            f"Download {translated['language']} Translation",
+                            data=export_file,
+                            file_name=book_export.export_file_name(translated["book_structure"], export_format),
+                            mime=book_export.EXPORT_FORMATS[export_format]["mime"]
+                        )
+                    if downloaded:
+                        st.session_state.translation_prepared = None
+    else:
+        st.info("No chapters have been copied to the final book yet. Go to Content Generation to copy chapters.")
 
-        export_content += "## Conclusion\n" + book['conclusion']
+hot_chapters = set()
+if st.session_state.current_chapter:
+    hot_chapters = {
+        ("chapters", f"chapter_{st.session_state.current_chapter['number']}"),
+        ("book_content", str(st.session_state.current_chapter['number'])),
+    }
+st.session_state.memory.end_run(session_book(), session_indexes(), hot_chapters, release_chapter_copies)
 
-        if st.download_button(
-            "Download Book",
-            data=export_content,
-            file_name=f"{book['title'].lower().replace(' ', '_')}.{'md' if export_format == 'Markdown' else 'txt'}",
-            mime="text/markdown" if export_format == "Markdown" else "text/plain"
-        ):
-            st.success("Book downloaded successfully!")
-    else:
-        st.info("No chapters have been copied to the final book yet. Go to Content Generation to copy chapters.")
\ No newline at end of file
+screen_span.end()
+run_span.end()
+st.session_state.trace_open_spans = []
+startup_probe.record_run(_script_start, _imports_done)
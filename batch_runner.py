@@ -0,0 +1,314 @@
+"""Generate many books from a manifest without the UI.
+
+    python batch_runner.py books.csv --out batch_output --processes 4 --requests-per-minute 60
+
+The manifest is a CSV file with a header row, or a JSONL file with one
+object per line. Every book needs a title, theme and audience. style,
+goals, provider, model and chapter_words are optional; an id column, if
+present, names the book's output directory.
+
+Books run concurrently across a process pool. Inside each book the
+chapters are generated in parallel and the introduction and conclusion
+after them, as in the app. Every provider call of every process goes
+through one shared rate limit. Each book's directory gets the project
+archive and one file per export format. summary.json and summary.csv
+report the time and tokens spent on each book.
+
+Every book is a checkpointed run (see runs.py) in its output directory.
+Running the same manifest into the same directory again resumes the
+books that did not finish, without regenerating anything already done.
+"""
+import csv
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+
+import book_export
+import book_scheduler
+import project_store
+import prompts
+import providers
+import runs
+import structure_generation
+import token_budget
+import tracing
+
+REQUIRED_FIELDS = ("title", "theme", "audience")
+DEFAULT_SPEC = {
+    "style": "Informative",
+    "goals": "",
+    "provider": providers.DEFAULT_PROVIDER,
+    "model": None,
+    "chapter_words": 2000,
+}
+SUMMARY_FIELDS = (
+    "id", "title", "status", "seconds", "structure_seconds", "chapters", "words",
+    "input_tokens", "output_tokens", "resumed_parts", "failed_parts", "output_dir", "error",
+)
+
+# Set in each worker process by _init_worker
+_limiter = None
+
+
+def _jsonl_rows(path, f):
+    for line, text in enumerate(f, 1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError as e:
+            raise ValueError(f"{path}:{line}: invalid JSON: {e}") from e
+        if not isinstance(row, dict):
+            raise ValueError(f"{path}:{line}: expected a JSON object, got {type(row).__name__}")
+        yield line, row
+
+
+def read_manifest(path):
+    """Return the book specs of a CSV or JSONL manifest, with defaults filled in
+
+    Raises ValueError naming the line of the first invalid row, including
+    a book id already used by an earlier row or one that is not a plain
+    slug (ids name the books' output directories).
+    """
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            rows = list(_jsonl_rows(path, f))
+        else:
+            rows = list(enumerate(csv.DictReader(f), 2))
+
+    specs = []
+    lines_by_id = {}
+    for line, row in rows:
+        spec = dict(DEFAULT_SPEC)
+        spec.update({key: value for key, value in row.items() if value not in (None, "")})
+        missing = [field for field in REQUIRED_FIELDS if not spec.get(field)]
+        if missing:
+            raise ValueError(f"{path}:{line}: missing {', '.join(missing)}")
+        if spec["provider"] not in providers.PROVIDERS:
+            raise ValueError(f"{path}:{line}: unknown provider {spec['provider']}")
+        spec["model"] = spec["model"] or providers.default_model(spec["provider"])
+        spec["chapter_words"] = int(spec["chapter_words"])
+        spec["id"] = str(spec.get("id") or slug(f"{len(specs) + 1:03d}-{spec['title']}"))
+        # Each id is a book's output directory
+        if not ID_PATTERN.match(spec["id"]):
+            raise ValueError(
+                f"{path}:{line}: id {spec['id']!r} must be 1-60 lowercase letters, digits or dashes"
+            )
+        if spec["id"] in lines_by_id:
+            raise ValueError(f"{path}:{line}: id {spec['id']} is already used on line {lines_by_id[spec['id']]}")
+        lines_by_id[spec["id"]] = line
+        specs.append(spec)
+    return specs
+
+
+# Book ids as slug() makes them, safe as directory names
+ID_PATTERN = re.compile(r"^[a-z0-9-]{1,60}$")
+
+
+def slug(text):
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")[:60] or "book"
+
+
+def _init_worker(limiter):
+    global _limiter
+    _limiter = limiter
+
+
+def generate_book(spec, run_dir, parallel_parts=4, limiter=None):
+    """Generate a whole book from a spec, checkpointed as a run in run_dir
+
+    An unfinished run already in run_dir is resumed. Returns
+    (book_structure, generated_chapters, report). Parts that failed are
+    listed in the report and left out of the book.
+    """
+    provider, model = spec["provider"], spec["model"]
+    complete = providers.complete
+    complete_structured = providers.complete_structured
+    if limiter is not None:
+        complete = limiter.wrap(complete)
+        complete_structured = limiter.wrap(complete_structured)
+    report = {"input_tokens": 0, "output_tokens": 0, "failed_parts": {}, "structure_seconds": 0.0, "resumed_parts": 0}
+
+    try:
+        run = runs.Run(run_dir)
+    except OSError:
+        start = time.perf_counter()
+        structure_info = {}
+        book_structure = structure_generation.generate_structure(
+            provider, model,
+            prompts.create_structure_prompt(spec["title"], spec["theme"], spec["audience"], spec["style"], spec["goals"]),
+            token_budget.max_tokens_for(model, structure_generation.TARGET_WORDS),
+            complete=complete_structured, info=structure_info
+        )
+        book_structure.update({field: spec[field] for field in ("theme", "audience", "style", "goals")})
+        report["structure_seconds"] = round(time.perf_counter() - start, 2)
+        report["input_tokens"] += structure_info["input_tokens"]
+        report["output_tokens"] += structure_info["output_tokens"]
+        settings = {
+            book_scheduler.chapter_key(chapter["number"]): {
+                "word_count": spec["chapter_words"], "key_points": "", "custom_content": None
+            }
+            for chapter in book_structure["chapters"]
+        }
+        run = runs.Run.create(
+            book_structure, provider, model, settings,
+            book_scheduler.book_dependencies(book_structure), directory=run_dir, book_id=spec["id"]
+        )
+
+    book_structure = json.loads(json.dumps(run.meta["book_structure"]))
+    chapters = {book_scheduler.chapter_key(chapter["number"]): chapter for chapter in book_structure["chapters"]}
+    settings = run.meta["settings"]
+    generated_chapters = {}
+    resumed = run.completed_keys()
+
+    def on_done(key, record, error):
+        if error is not None:
+            report["failed_parts"][key] = str(error)
+            return
+        if key in resumed:
+            report["resumed_parts"] += 1
+        else:
+            report["input_tokens"] += record["info"]["input_tokens"]
+            report["output_tokens"] += record["info"]["output_tokens"]
+        if key in book_scheduler.SECTIONS:
+            book_scheduler.apply_section(book_structure, key, record["text"], record["info"], record["inputs"])
+        else:
+            generated_chapters[key] = book_scheduler.chapter_record(
+                chapters[key], record["text"], record["info"], settings[key], book_structure
+            )
+
+    def chapter_texts():
+        return {key: generated_chapters[key]["content"] for key in chapters if key in generated_chapters}
+
+    runs.execute(run, chapter_texts, on_done, parallel_parts, complete=complete)
+    return book_structure, generated_chapters, report
+
+
+def final_book(generated_chapters):
+    """Return the book content with every generated chapter copied into it"""
+    copied_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return {
+        chapter["number"]: {"title": chapter["title"], "content": chapter["content"], "copied_at": copied_at}
+        for chapter in generated_chapters.values()
+    }
+
+
+def write_book(out_dir, spec, book_structure, generated_chapters):
+    """Write a book's project archive and exports to out_dir; returns the final book content"""
+    os.makedirs(out_dir, exist_ok=True)
+    book_content = final_book(generated_chapters)
+    book_details = {field: spec[field] for field in ("title", "theme", "audience", "style", "goals")}
+    project_store.save_project(
+        os.path.join(out_dir, f"project.{project_store.FILE_EXTENSION}"),
+        book_structure, book_details, generated_chapters, book_content
+    )
+    for export_format, info in book_export.EXPORT_FORMATS.items():
+        with open(os.path.join(out_dir, f"book.{info['extension']}"), "w", encoding="utf-8") as f:
+            f.writelines(book_export.export_blocks(book_structure, book_content, export_format))
+    return book_content
+
+
+def run_book(spec, out_root, parallel_parts):
+    """Generate and write one book in a worker process; returns its summary row"""
+    out_dir = os.path.join(out_root, spec["id"])
+    row = {"id": spec["id"], "title": spec["title"], "output_dir": out_dir, "status": "ok", "error": ""}
+    start = time.perf_counter()
+    try:
+        with tracing.span("batch.book", book=spec["id"], model=spec["model"]):
+            book_structure, generated_chapters, report = generate_book(
+                spec, os.path.join(out_dir, "run"), parallel_parts, _limiter
+            )
+            book_content = write_book(out_dir, spec, book_structure, generated_chapters)
+        row.update(
+            structure_seconds=report["structure_seconds"],
+            chapters=f"{len(book_content)}/{len(book_structure['chapters'])}",
+            words=sum(len(chapter["content"].split()) for chapter in book_content.values()),
+            input_tokens=report["input_tokens"],
+            output_tokens=report["output_tokens"],
+            failed_parts=", ".join(sorted(report["failed_parts"])),
+            resumed_parts=report["resumed_parts"],
+        )
+        if report["failed_parts"]:
+            row["status"] = "partial"
+            row["error"] = "; ".join(f"{key}: {error}" for key, error in sorted(report["failed_parts"].items()))
+    except Exception as e:
+        row["status"] = "failed"
+        row["error"] = f"{type(e).__name__}: {e}"
+        traceback.print_exc(file=sys.stderr)
+    row["seconds"] = round(time.perf_counter() - start, 2)
+    tracing.flush()
+    return row
+
+
+def write_summary(out_root, rows):
+    with open(os.path.join(out_root, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(rows, f, indent=2, ensure_ascii=False)
+    with open(os.path.join(out_root, "summary.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def run_batch(specs, out_root, processes=4, parallel_parts=4, requests_per_minute=60, max_concurrent=8, progress=None):
+    """Generate every book of a manifest and return the summary rows in manifest order"""
+    os.makedirs(out_root, exist_ok=True)
+    context = multiprocessing.get_context("spawn")
+    limiter = providers.RateLimiter(requests_per_minute, max_concurrent, context)
+    rows = {}
+    with ProcessPoolExecutor(
+        max_workers=processes, mp_context=context, initializer=_init_worker, initargs=(limiter,)
+    ) as executor:
+        futures = {executor.submit(run_book, spec, out_root, parallel_parts): spec for spec in specs}
+        for future in as_completed(futures):
+            row = future.result()
+            rows[row["id"]] = row
+            if progress is not None:
+                progress(row, len(rows), len(specs))
+    ordered = [rows[spec["id"]] for spec in specs]
+    write_summary(out_root, ordered)
+    return ordered
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate books from a CSV or JSONL manifest")
+    parser.add_argument("manifest")
+    parser.add_argument("--out", default="batch_output", help="output directory")
+    parser.add_argument("--processes", type=int, default=4, help="books generated at the same time")
+    parser.add_argument("--parallel-parts", type=int, default=4, help="parts of one book generated at the same time")
+    parser.add_argument("--requests-per-minute", type=float, default=60, help="provider requests per minute, all books together")
+    parser.add_argument("--max-concurrent", type=int, default=8, help="provider requests in flight, all books together")
+    args = parser.parse_args()
+
+    try:
+        book_specs = read_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        sys.exit(f"Invalid manifest: {e}")
+
+    def show_progress(row, done, total):
+        print(
+            f"[{done}/{total}] {row['id']}: {row['status']} in {row['seconds']:.0f} s, "
+            f"{row.get('output_tokens', 0):,} output tokens {row['error']}".rstrip(),
+            flush=True
+        )
+
+    batch_start = time.perf_counter()
+    summary = run_batch(
+        book_specs, args.out, args.processes, args.parallel_parts,
+        args.requests_per_minute, args.max_concurrent, show_progress
+    )
+    failed = [row for row in summary if row["status"] != "ok"]
+    print(
+        f"{len(summary) - len(failed)}/{len(summary)} books complete in {time.perf_counter() - batch_start:.0f} s; "
+        f"{sum(row.get('input_tokens', 0) for row in summary):,} input and "
+        f"{sum(row.get('output_tokens', 0) for row in summary):,} output tokens. "
+        f"Summary in {os.path.join(args.out, 'summary.csv')}"
+    )
+    sys.exit(1 if failed else 0)
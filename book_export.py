@@ -0,0 +1,199 @@
+"""Export assembly for finished books.
+
+The export is built from per-chapter text blocks that are cached by their
+content, so a rerun that only changes a widget reuses every block, and the
+assembled block list is memoised on a hash of the whole book version. The
+block cache is shared by every session of the process, so it is bounded by
+the characters it holds rather than by its number of entries.
+Every format goes through markdown_tools, which nests chapter headings
+under the chapter title and collects the headings for the table of
+contents in the same pass.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from markdown_tools import AnchorRegistry, heading_line, table_of_contents, transform_markdown
+
+EXPORT_FORMATS = {
+    "Markdown": {"extension": "md", "mime": "text/markdown"},
+    "Plain Text": {"extension": "txt", "mime": "text/plain"},
+}
+
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), "bookcreator_exports")
+MAX_EXPORT_FILES = 50
+
+TOC_TITLE = "Table of Contents"
+
+_EXPORT_CACHE_SIZE = 16
+_export_cache = OrderedDict()
+# Sessions and API requests export from their own threads
+_export_lock = threading.Lock()
+
+# Characters of rendered blocks kept across all sessions
+BLOCK_CACHE_CHARS = int(os.environ.get("BOOKCREATOR_EXPORT_CACHE_CHARS", "4000000"))
+_block_cache = OrderedDict()
+_block_cache_chars = 0
+_block_lock = threading.Lock()
+
+
+def book_version_hash(book_structure, book_content):
+    """Return a stable hash identifying this version of the book"""
+    digest = hashlib.sha1()
+    digest.update(json.dumps(
+        [book_structure.get("title"), book_structure.get("introduction"), book_structure.get("conclusion")],
+        sort_keys=True
+    ).encode("utf-8"))
+    for num, chapter in sorted_chapters(book_content):
+        digest.update(f"\0{num}\0{chapter['title']}\0".encode("utf-8"))
+        digest.update(chapter["content"].encode("utf-8"))
+    return digest.hexdigest()
+
+
+def sorted_chapters(book_content):
+    """Return (number, chapter) pairs of the final book in reading order"""
+    return sorted(book_content.items(), key=lambda item: int(item[0]))
+
+
+def section_block(export_format, heading, body):
+    """Render a top-level section into its export block
+
+    Returns the block text and the (level, title) pairs of its headings.
+    Blocks are cached on a hash of the body, so the cache holds only the
+    rendered text, least recently used first out past BLOCK_CACHE_CHARS.
+    """
+    global _block_cache_chars
+    key = (export_format, heading, hashlib.sha1(body.encode("utf-8")).digest())
+    with _block_lock:
+        block = _block_cache.get(key)
+        if block is not None:
+            _block_cache.move_to_end(key)
+            return block
+
+    plain = export_format == "Plain Text"
+    headings = [(2, heading)]
+    text = transform_markdown(body, top_level=3, headings=headings, plain=plain)
+    block = (f"{heading_line(2, heading, plain)}\n{text}\n\n", tuple(headings))
+
+    with _block_lock:
+        if key not in _block_cache:
+            _block_cache[key] = block
+            _block_cache_chars += len(block[0])
+        while _block_cache_chars > BLOCK_CACHE_CHARS and len(_block_cache) > 1:
+            _, (old_text, _) = _block_cache.popitem(last=False)
+            _block_cache_chars -= len(old_text)
+    return block
+
+
+def chapter_block(export_format, number, title, content):
+    """Render a single chapter into its export block"""
+    return section_block(export_format, f"Chapter {number}: {title}", content)
+
+
+def export_blocks(book_structure, book_content, export_format):
+    """Return the ordered text blocks making up the exported book"""
+    key = (book_version_hash(book_structure, book_content), export_format)
+    with _export_lock:
+        blocks = _export_cache.get(key)
+        if blocks is not None:
+            _export_cache.move_to_end(key)
+            return blocks
+
+    plain = export_format == "Plain Text"
+    sections = [section_block(export_format, "Introduction", book_structure['introduction'])]
+    for num, chapter in sorted_chapters(book_content):
+        sections.append(chapter_block(export_format, num, chapter['title'], chapter['content']))
+    sections.append(section_block(export_format, "Conclusion", book_structure['conclusion']))
+
+    # Anchors are handed out in document order so repeated titles get the
+    # same suffixes the Markdown renderer will give them
+    anchors = AnchorRegistry()
+    anchors.anchor(book_structure['title'])
+    anchors.anchor(TOC_TITLE)
+    entries = [
+        (level, title, anchors.anchor(title))
+        for _, headings in sections
+        for level, title in headings
+    ]
+
+    blocks = (
+        f"{heading_line(1, book_structure['title'], plain)}\n\n",
+        f"{heading_line(2, TOC_TITLE, plain)}\n{table_of_contents(entries, plain=plain)}\n\n",
+    ) + tuple(text for text, _ in sections)
+    with _export_lock:
+        _export_cache[key] = blocks
+        _export_cache.move_to_end(key)
+        if len(_export_cache) > _EXPORT_CACHE_SIZE:
+            _export_cache.popitem(last=False)
+    return blocks
+
+
+def assemble_book(book_structure, book_content, export_format="Markdown"):
+    """Return the whole exported book as a single string"""
+    return "".join(export_blocks(book_structure, book_content, export_format))
+
+
+def export_file_name(book_structure, export_format):
+    """Return the download file name for the given format"""
+    extension = EXPORT_FORMATS[export_format]["extension"]
+    return f"{book_structure['title'].lower().replace(' ', '_')}.{extension}"
+
+
+def open_export_file(book_structure, book_content, export_format):
+    """Write the export to a temp file block by block and return it open for reading
+
+    Files are named after the book version, so an unchanged book is never
+    written twice. The file is returned open because another session may
+    prune it at any time: an open file stays readable after it is removed.
+    """
+    version = book_version_hash(book_structure, book_content)
+    extension = EXPORT_FORMATS[export_format]["extension"]
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, f"{version}.{extension}")
+    try:
+        export_file = open(path, "rb")
+    except FileNotFoundError:
+        pass
+    else:
+        # Mark it recently used, so pruning takes older files first
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return export_file
+
+    fd, tmp_path = tempfile.mkstemp(dir=EXPORT_DIR, suffix=".part")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.writelines(export_blocks(book_structure, book_content, export_format))
+    os.replace(tmp_path, path)
+    export_file = open(path, "rb")
+    _prune_export_files()
+    return export_file
+
+
+def _prune_export_files():
+    """Keep only the most recent export files; safe to run from several sessions at once"""
+    try:
+        names = os.listdir(EXPORT_DIR)
+    except OSError:
+        return
+    entries = []
+    for name in names:
+        if name.endswith(".part"):
+            continue
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            entries.append((os.path.getmtime(path), path))
+        except OSError:
+            pass  # Pruned by another session meanwhile
+    if len(entries) <= MAX_EXPORT_FILES:
+        return
+    entries.sort()
+    for _, path in entries[:-MAX_EXPORT_FILES]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
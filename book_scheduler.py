@@ -0,0 +1,264 @@
+"""Dependency-aware scheduling of book parts.
+
+A book is a small DAG: every chapter can be written on its own, while
+the full introduction and conclusion summarise the chapters and so
+depend on all of them. Each generated part records a hash of its inputs
+(the book details, its outline entry and settings, and for the
+introduction and conclusion the text of every chapter). A part whose
+inputs no longer match is stale, and so is everything downstream of it.
+
+DagScheduler runs a set of parts on a thread pool as soon as their
+dependencies are done. When there are more ready parts than workers, the
+ones heading the longest remaining chain go first, so the whole book
+takes roughly as long as its critical path.
+"""
+import contextvars
+import hashlib
+import json
+from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import prompts
+
+INTRODUCTION = "introduction"
+CONCLUSION = "conclusion"
+SECTIONS = (INTRODUCTION, CONCLUSION)
+
+# Word targets of the full introduction and conclusion
+SECTION_TARGET_WORDS = 800
+
+BOOK_INFO_FIELDS = ("title", "theme", "audience", "style")
+
+
+def chapter_key(number):
+    return f"chapter_{number}"
+
+
+def inputs_hash(*inputs):
+    """Return a short stable hash of JSON-serialisable inputs"""
+    encoded = json.dumps(inputs, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(encoded.encode("utf-8"), digest_size=12).hexdigest()
+
+
+def book_info(book_structure):
+    return {field: book_structure.get(field, "") for field in BOOK_INFO_FIELDS}
+
+
+def chapter_inputs(book_structure, chapter, settings):
+    """Return the inputs hash of a chapter from its outline entry and generation settings"""
+    return inputs_hash(
+        "chapter", book_info(book_structure), chapter["title"], chapter["description"],
+        settings.get("key_points") or "", settings.get("custom_content") or "", settings.get("word_count")
+    )
+
+
+def section_inputs(book_structure, section, brief, chapter_texts, word_count=SECTION_TARGET_WORDS):
+    """Return the inputs hash of the introduction or conclusion
+
+    chapter_texts maps chapter keys to their current text, so editing or
+    regenerating any chapter makes both sections stale.
+    """
+    digests = {key: hashlib.blake2b(text.encode("utf-8"), digest_size=12).hexdigest() for key, text in chapter_texts.items()}
+    return inputs_hash(section, book_info(book_structure), brief, digests, word_count)
+
+
+def section_brief(book_structure, section):
+    """Return the outline of the introduction or conclusion from the structure step"""
+    return book_structure.get(f"{section}_brief", book_structure[section])
+
+
+def part_request(book_structure, key, settings, chapter_texts):
+    """Return the (prompt, target_words) that generate a part
+
+    settings maps chapter keys to their generation settings; chapter_texts
+    maps chapter keys to their text and is only used for the introduction
+    and conclusion.
+    """
+    if key in SECTIONS:
+        chapters = {chapter_key(chapter["number"]): chapter for chapter in book_structure["chapters"]}
+        create = prompts.create_introduction_prompt if key == INTRODUCTION else prompts.create_conclusion_prompt
+        prompt = create(
+            book_structure,
+            section_brief(book_structure, key),
+            [dict(chapters[k], content=text) for k, text in chapter_texts.items() if k in chapters],
+            f"{SECTION_TARGET_WORDS} words"
+        )
+        return prompt, SECTION_TARGET_WORDS
+
+    chapter = next(c for c in book_structure["chapters"] if chapter_key(c["number"]) == key)
+    chapter_settings = settings[key]
+    prompt = prompts.create_chapter_prompt(
+        book_structure, chapter, chapter_settings.get("key_points") or "",
+        f"{chapter_settings['word_count']} words", chapter_settings.get("custom_content")
+    )
+    return prompt, chapter_settings["word_count"]
+
+
+def chapter_record(chapter, text, generation_info, settings, book_structure):
+    """Return the generated-chapter entry for a newly written chapter"""
+    return {
+        "number": chapter["number"],
+        "title": chapter["title"],
+        "content": text,
+        "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "metadata": dict(
+            settings,
+            generation=generation_info,
+            inputs=chapter_inputs(book_structure, chapter, settings)
+        ),
+    }
+
+
+def apply_section(book_structure, section, text, generation_info, inputs):
+    """Replace the short introduction or conclusion of a structure with the full one
+
+    The short text is kept as the section's brief.
+    """
+    book_structure.setdefault(f"{section}_brief", book_structure[section])
+    book_structure[section] = text
+    book_structure.setdefault("generated_sections", {})[section] = {
+        "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "inputs": inputs,
+        "generation": generation_info,
+    }
+
+
+def book_dependencies(book_structure):
+    """Return {part: set of parts it depends on} for a book structure"""
+    chapters = {chapter_key(chapter["number"]) for chapter in book_structure["chapters"]}
+    deps = {key: set() for key in chapters}
+    for section in SECTIONS:
+        deps[section] = set(chapters)
+    return deps
+
+
+def dependents(deps):
+    """Invert a dependency mapping into {part: set of parts that depend on it}"""
+    inverse = {key: set() for key in deps}
+    for key, requires in deps.items():
+        for required in requires:
+            inverse.setdefault(required, set()).add(key)
+    return inverse
+
+
+def invalidate(deps, dirty):
+    """Return the dirty parts plus everything downstream of them"""
+    inverse = dependents(deps)
+    result = set()
+    stack = list(dirty)
+    while stack:
+        key = stack.pop()
+        if key in result:
+            continue
+        result.add(key)
+        stack.extend(inverse.get(key, ()))
+    return result
+
+
+def critical_path(deps, weights=None):
+    """Return {part: weight of the heaviest chain starting at that part}"""
+    inverse = dependents(deps)
+    lengths = {}
+
+    def length(key):
+        if key not in lengths:
+            weight = (weights or {}).get(key, 1)
+            lengths[key] = weight + max((length(after) for after in inverse.get(key, ())), default=0)
+        return lengths[key]
+
+    for key in deps:
+        length(key)
+    return lengths
+
+
+class DependencyError(Exception):
+    """A part was skipped because a part it depends on failed"""
+
+
+class DagScheduler:
+    """Run parts of a DAG on a thread pool in dependency order"""
+
+    def __init__(self, deps, weights=None, max_workers=4):
+        for key, requires in deps.items():
+            unknown = requires - deps.keys()
+            if unknown:
+                raise ValueError(f"{key} depends on unknown parts: {', '.join(sorted(unknown))}")
+        self.deps = deps
+        # Before critical_path, which would recurse forever on a cycle
+        self._check_acyclic()
+        self.priority = critical_path(deps, weights)
+        self.max_workers = max_workers
+
+    def _check_acyclic(self):
+        remaining = {key: set(requires) for key, requires in self.deps.items()}
+        while remaining:
+            ready = [key for key, requires in remaining.items() if not requires]
+            if not ready:
+                raise ValueError(f"Dependency cycle among: {', '.join(sorted(remaining))}")
+            for key in ready:
+                del remaining[key]
+            for requires in remaining.values():
+                requires.difference_update(ready)
+
+    def run(self, parts, prepare, on_done=None):
+        """Run the given parts and return ({part: result}, {part: exception})
+
+        Dependencies outside parts are taken as already done.
+        prepare(part) is called in the calling thread once the part's
+        dependencies have finished, so it may read their results, and
+        returns a callable that does the work in a worker thread.
+        on_done(part, result, error) is also called in the calling thread.
+        """
+        parts = set(parts)
+        waiting = {key: self.deps[key] & parts for key in parts}
+        results, errors = {}, {}
+        running = {}
+
+        def finish(key, result, error):
+            if error is None:
+                results[key] = result
+            else:
+                errors[key] = error
+            if on_done is not None:
+                on_done(key, result, error)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while waiting or running:
+                ready = sorted(
+                    (key for key, requires in waiting.items() if not requires),
+                    key=lambda key: (-self.priority[key], key)
+                )
+                for key in ready:
+                    if len(running) >= self.max_workers:
+                        break
+                    del waiting[key]
+                    try:
+                        job = prepare(key)
+                    except Exception as e:
+                        finish(key, None, e)
+                        self._release(waiting, key, errors, finish)
+                        continue
+                    # Worker threads inherit the tracing context of the caller
+                    future = executor.submit(contextvars.copy_context().run, job)
+                    running[future] = key
+
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    error = future.exception()
+                    finish(key, None if error else future.result(), error)
+                    self._release(waiting, key, errors, finish)
+        return results, errors
+
+    def _release(self, waiting, key, errors, finish):
+        """Mark a part finished; on failure skip everything that depends on it"""
+        if key not in errors:
+            for requires in waiting.values():
+                requires.discard(key)
+            return
+        for skipped in sorted(invalidate(self.deps, {key}) - {key}):
+            if skipped in waiting:
+                del waiting[skipped]
+                finish(skipped, None, DependencyError(f"skipped because {key} failed"))
@@ -0,0 +1,121 @@
+"""Incremental text statistics for chapters and the whole book.
+
+Each chapter has a stats record keyed by the hash of its content, so the
+text is only analysed again when it actually changes. Book totals are kept
+as running sums and adjusted on every update, which makes the book-level
+view O(1) to display.
+"""
+import hashlib
+import re
+
+# Average silent reading speed for non-fiction, in words per minute
+READING_WORDS_PER_MINUTE = 230
+
+_SENTENCE_END = re.compile(r"[.!?…]+(?=\s|$)")
+_HEADING = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+
+_SUMMED_FIELDS = ("words", "sentences", "paragraphs", "target_words", "targeted_words")
+
+
+def content_hash(content):
+    """Return a short hash of a chapter's text"""
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def heading_outline(content):
+    """Return the (level, title) pairs of the Markdown headings in a text"""
+    outline = []
+    in_fence = False
+    for line in content.splitlines():
+        stripped = line.lstrip()
+        if stripped.startswith("```") or stripped.startswith("~~~"):
+            in_fence = not in_fence
+            continue
+        if in_fence:
+            continue
+        match = _HEADING.match(line)
+        if match:
+            outline.append((len(match.group(1)), match.group(2)))
+    return outline
+
+
+def compute_chapter_stats(content, target_words=None):
+    """Compute the statistics record for a single chapter"""
+    words = len(content.split())
+    paragraphs = len([p for p in content.split("\n\n") if p.strip()])
+    sentences = len(_SENTENCE_END.findall(content))
+    record = {
+        "hash": content_hash(content),
+        "words": words,
+        "sentences": sentences,
+        "paragraphs": paragraphs,
+        "reading_minutes": words / READING_WORDS_PER_MINUTE,
+        "outline": heading_outline(content),
+        "target_words": target_words or 0,
+    }
+    record.update(_target_fields(words, target_words))
+    return record
+
+
+def _target_fields(words, target_words):
+    """Return the target-vs-actual fields for a word count"""
+    if not target_words:
+        return {"targeted_words": 0, "target_delta": None, "target_ratio": None}
+    return {
+        "targeted_words": words,
+        "target_delta": words - target_words,
+        "target_ratio": words / target_words,
+    }
+
+
+class StatsIndex:
+    """Per-chapter stats records plus running book totals"""
+
+    def __init__(self):
+        self.records = {}
+        self._totals = {field: 0 for field in _SUMMED_FIELDS}
+
+    def update(self, key, content, target_words=None):
+        """Record the stats of a chapter, reanalysing only if its text changed"""
+        previous = self.records.get(key)
+        if previous is not None and previous["hash"] == content_hash(content):
+            if target_words is None or target_words == previous["target_words"]:
+                return previous
+            record = dict(previous, target_words=target_words)
+            record.update(_target_fields(record["words"], target_words))
+        else:
+            if target_words is None and previous is not None:
+                target_words = previous["target_words"]
+            record = compute_chapter_stats(content, target_words)
+
+        if previous is not None:
+            self._adjust(previous, -1)
+        self._adjust(record, 1)
+        self.records[key] = record
+        return record
+
+    def remove(self, key):
+        """Forget the stats of a chapter"""
+        previous = self.records.pop(key, None)
+        if previous is not None:
+            self._adjust(previous, -1)
+
+    def get(self, key):
+        """Return the stats record of a chapter, or None"""
+        return self.records.get(key)
+
+    def totals(self):
+        """Return the aggregated statistics of the whole book"""
+        totals = dict(self._totals)
+        totals["chapters"] = len(self.records)
+        totals["reading_minutes"] = totals["words"] / READING_WORDS_PER_MINUTE
+        if totals["target_words"]:
+            totals["target_delta"] = totals["targeted_words"] - totals["target_words"]
+            totals["target_ratio"] = totals["targeted_words"] / totals["target_words"]
+        else:
+            totals["target_delta"] = totals["target_ratio"] = None
+        return totals
+
+    def _adjust(self, record, sign):
+        for field in _SUMMED_FIELDS:
+            self._totals[field] += sign * record[field]
@@ -0,0 +1,158 @@
+"""Preflight estimates of what generating a book will cost and how long it will take.
+
+Every part's prompt is built exactly as the generation would build it, and
+its tokens are estimated from the number of words:
+
+- input tokens from the prompt, at the input tokens per prompt word of
+  past generations (continuation rounds included);
+- output tokens from the word target, times how far past their target
+  the model's generations have run (or the early-stop tolerance), at
+  token_budget.words_per_token;
+- time from the output tokens at the model's past seconds per token, with
+  the parts laid out over the workers in dependency order as the
+  DagScheduler runs them, and no faster than the provider's request rate
+  limit allows;
+- cost from the provider's prices per million tokens.
+
+All the ratios are calibrated from the usage log of token_budget, and
+fall back to defaults until there is data for the model.
+"""
+import heapq
+import math
+import os
+from collections import namedtuple
+
+import book_scheduler
+import providers
+import token_budget
+
+# Before any calibration data exists
+DEFAULT_INPUT_TOKENS_PER_WORD = 1.45
+DEFAULT_SECONDS_PER_TOKEN = 0.02
+# Time to the first token of every request
+REQUEST_SECONDS = 1.5
+
+# Stands in for the text of chapters not written yet in the introduction and conclusion prompts
+PLACEHOLDER_CHAPTER = " ".join(["parola"] * 150)
+
+PartEstimate = namedtuple("PartEstimate", "key input_tokens output_tokens seconds cost")
+
+_calibration = {"mtime": None, "input": {}, "speed": {}}
+
+
+def _calibrate():
+    try:
+        mtime = os.path.getmtime(token_budget.USAGE_FILE)
+    except OSError:
+        mtime = None
+    if mtime == _calibration["mtime"]:
+        return
+    inputs, speeds = {}, {}
+    for record in token_budget.read_usage():
+        kind = record.get("kind", "text")
+        if kind == "generation" and record.get("prompt_words") and record.get("input_tokens"):
+            inputs.setdefault(record["model"], []).append(record)
+        elif kind == "text" and record.get("seconds") and (record["output_tokens"] or 0) >= token_budget.CALIBRATION_MIN_TOKENS:
+            speeds.setdefault(record["model"], []).append(record)
+    window = token_budget.CALIBRATION_WINDOW
+    _calibration["input"] = {
+        model: sum(r["input_tokens"] for r in records[-window:]) / sum(r["prompt_words"] for r in records[-window:])
+        for model, records in inputs.items()
+    }
+    _calibration["speed"] = {
+        model: sum(r["seconds"] for r in records[-window:]) / sum(r["output_tokens"] for r in records[-window:])
+        for model, records in speeds.items()
+    }
+    _calibration["mtime"] = mtime
+
+
+def input_tokens_per_word(model):
+    """Return the input tokens a generation takes per prompt word, calibrated from past usage"""
+    _calibrate()
+    return _calibration["input"].get(model) or DEFAULT_INPUT_TOKENS_PER_WORD
+
+
+def seconds_per_token(model):
+    """Return a model's generation time per output token, calibrated from past usage"""
+    _calibrate()
+    return _calibration["speed"].get(model) or DEFAULT_SECONDS_PER_TOKEN
+
+
+def prices(provider, model):
+    """Return the (input, output) USD price per million tokens of a model, or None if unknown"""
+    spec = providers.get_provider(provider)
+    price = (spec.prices or {}).get(model)
+    return tuple(price) if price else None
+
+
+def estimate_part(key, prompt, target_words, provider, model, early_stop=None):
+    """Return the PartEstimate of one generation; cost is None when the model has no known price"""
+    length = token_budget.overshoot(model)
+    if early_stop is not None:
+        length = min(length, 1 + early_stop)
+    input_tokens = round(len(prompt.split()) * input_tokens_per_word(model))
+    output_tokens = round(target_words * length / token_budget.words_per_token(model))
+    seconds = REQUEST_SECONDS + output_tokens * seconds_per_token(model)
+    price = prices(provider, model)
+    cost = (input_tokens * price[0] + output_tokens * price[1]) / 1e6 if price else None
+    return PartEstimate(key, input_tokens, output_tokens, seconds, cost)
+
+
+def wall_seconds(deps, durations, workers):
+    """Lay parts out over workers as the DagScheduler runs them and return when the last one ends
+
+    A part starts once its dependencies have finished and a worker is
+    free; among the parts ready, the one heading the longest chain goes
+    first. Dependencies outside durations are taken as already done.
+    """
+    priority = book_scheduler.critical_path(deps, durations)
+    free = [0.0] * max(workers, 1)
+    finished = {}
+    remaining = set(durations)
+    while remaining:
+        ready = [key for key in remaining if all(dep in finished or dep not in durations for dep in deps[key])]
+        key = max(ready, key=lambda part: (priority[part], part))
+        start = max([heapq.heappop(free)] + [finished[dep] for dep in deps[key] if dep in finished])
+        finished[key] = start + durations[key]
+        heapq.heappush(free, finished[key])
+        remaining.remove(key)
+    return max(finished.values(), default=0.0)
+
+
+def estimate_book(book_structure, settings, parts, provider, model, workers, early_stop=None, chapter_texts=None):
+    """Estimate generating the given parts of a book; returns ([PartEstimate], totals)
+
+    settings are the chapters' generation settings as for
+    book_scheduler.part_request. chapter_texts holds chapters already
+    written; the others are stood in for in the introduction and
+    conclusion prompts. totals sums the parts' tokens and cost (None if
+    any price is unknown) and has the wall-clock seconds for workers
+    running in parallel.
+    """
+    chapter_texts = dict(chapter_texts or {})
+    for chapter in book_structure["chapters"]:
+        chapter_texts.setdefault(book_scheduler.chapter_key(chapter["number"]), PLACEHOLDER_CHAPTER)
+    estimates = []
+    for key in [book_scheduler.chapter_key(c["number"]) for c in book_structure["chapters"]] + list(book_scheduler.SECTIONS):
+        if key not in parts:
+            continue
+        prompt, target_words = book_scheduler.part_request(book_structure, key, settings, chapter_texts)
+        estimates.append(estimate_part(key, prompt, target_words, provider, model, early_stop))
+
+    spec = providers.get_provider(provider)
+    workers = min(workers, spec.max_concurrent or workers)
+    seconds = wall_seconds(
+        book_scheduler.book_dependencies(book_structure), {part.key: part.seconds for part in estimates}, workers
+    )
+    if spec.requests_per_minute:
+        seconds = max(seconds, len(estimates) * 60 / spec.requests_per_minute)
+    costs = [part.cost for part in estimates]
+    totals = {
+        "parts": len(estimates),
+        "input_tokens": sum(part.input_tokens for part in estimates),
+        "output_tokens": sum(part.output_tokens for part in estimates),
+        "seconds": seconds,
+        "sequential_seconds": sum(part.seconds for part in estimates),
+        "cost": None if None in costs else math.fsum(costs),
+    }
+    return estimates, totals
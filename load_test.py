@@ -0,0 +1,274 @@
+"""Load test of the Streamlit app with many simulated sessions.
+
+    python load_test.py --sessions 20 --concurrency 5 --chapters 3 --tokens-per-second 0
+
+Every session is a streamlit.testing AppTest running app.py headlessly
+through the real screens: configuration, book structure, generating and
+editing chapters, copying them to the final book, and export. Requests
+go to a mock provider, registered as the "mock" provider API, that
+answers with a valid book structure and chapters of the requested length,
+streamed at --tokens-per-second (0 answers at once, so only the app's own
+work is measured).
+
+--concurrency sessions are open at a time in this process, sharing its
+modules as the sessions of one Streamlit server do, and take turns
+rerunning: AppTest swaps process-wide runtime state for every run, so two
+runs cannot overlap in threads. A server's reruns are mostly Python work
+under one GIL, so they largely take turns as well.
+
+The report gives rerun latency percentiles, overall and per screen; the
+memory each finished session keeps and the peak per open session, from
+tracemalloc; and the throughput in reruns per second and sessions per
+minute. AppTest leaves out the websocket and browser, so the figures are
+the app's own cost, a lower bound for a deployed instance. --max-p95-ms
+fails the run when reruns get slower than a budget, e.g. as a deploy
+check.
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+
+import project_store
+import providers
+import runs
+import token_budget
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+MOCK_PROVIDER = "Load Test Mock"
+MOCK_MODEL = "mock-model"
+# Words streamed per chunk by the mock provider
+CHUNK_WORDS = 4
+# Seconds a single rerun may take before AppTest gives up
+RERUN_TIMEOUT = 120
+
+_VOCABULARY = (
+    "libro capitolo lettore esempio metodo pratica idea progetto risultato strategia processo obiettivo "
+    "analisi dato scelta valore tempo lavoro squadra cliente mercato prodotto sistema modello problema"
+).split()
+
+
+def _mock_text(words, seed):
+    """Return Markdown of about the given number of words, in headed sections of short paragraphs"""
+    generator = random.Random(seed)
+    blocks = []
+    written = 0
+    while written < words:
+        if len(blocks) % 6 == 0:
+            blocks.append(f"## Sezione {len(blocks) // 6 + 1}")
+        paragraph = [generator.choice(_VOCABULARY) for _ in range(min(60, words - written))]
+        blocks.append(" ".join(paragraph).capitalize() + ".")
+        written += len(paragraph)
+    return "\n\n".join(blocks)
+
+
+def _mock_structure(chapters):
+    return {
+        "title": "Libro di prova",
+        "introduction": _mock_text(80, "introduction"),
+        "chapters": [
+            {"number": number, "title": f"Capitolo di prova {number}", "description": _mock_text(40, number)}
+            for number in range(1, chapters + 1)
+        ],
+        "conclusion": _mock_text(80, "conclusion"),
+    }
+
+
+def register_mock_provider(chapters=3, tokens_per_second=0):
+    """Register the mock provider; structures have the given number of chapters"""
+
+    def call(spec, prompt, model, max_tokens, on_text=None):
+        # max_tokens_for() asked for the target plus headroom; answer with about the target
+        words = max(int(max_tokens * token_budget.words_per_token(model) / token_budget.HEADROOM), 20)
+        text = _mock_text(words, hash(str(prompt)))
+        if on_text is None:
+            return providers.Completion(text, "stop", False, len(str(prompt).split()), max_tokens)
+        pieces = text.split(" ")
+        streamed = []
+        for start in range(0, len(pieces), CHUNK_WORDS):
+            chunk = " ".join(pieces[start:start + CHUNK_WORDS]) + (" " if start + CHUNK_WORDS < len(pieces) else "")
+            if tokens_per_second:
+                time.sleep(CHUNK_WORDS / token_budget.words_per_token(model) / tokens_per_second)
+            streamed.append(chunk)
+            if on_text(chunk):
+                return providers.Completion("".join(streamed), providers.STOPPED, False, len(str(prompt).split()), None)
+        return providers.Completion(text, "stop", False, len(str(prompt).split()), max_tokens)
+
+    def call_structured(spec, prompt, model, max_tokens, schema, name):
+        return providers.Completion(json.dumps(_mock_structure(chapters)), "stop", False, len(str(prompt).split()), 500)
+
+    providers.API_BACKENDS["mock"] = (lambda spec: None, call, call_structured)
+    providers.register(providers.ProviderSpec(MOCK_PROVIDER, "mock", (MOCK_MODEL,), None))
+
+
+def _widget(elements, label):
+    for element in elements:
+        if element.label == label:
+            return element
+    raise LookupError(f"No widget labelled {label!r} on the page")
+
+
+class Session:
+    """One simulated user, timing every rerun of its AppTest"""
+
+    def __init__(self, number, chapters):
+        from streamlit.testing.v1 import AppTest
+
+        self.number = number
+        self.chapters = chapters
+        self.app = AppTest.from_file(APP_FILE, default_timeout=RERUN_TIMEOUT)
+        # (screen, seconds) of every rerun
+        self.reruns = []
+
+    def _run(self, screen, element=None, allow_errors=False):
+        start = time.perf_counter()
+        (element or self.app).run()
+        self.reruns.append((screen, time.perf_counter() - start))
+        if self.app.exception:
+            raise RuntimeError(f"session {self.number}, {screen}: {self.app.exception[0].message}")
+        errors = [error.value for error in self.app.error]
+        if errors and not allow_errors:
+            raise RuntimeError(f"session {self.number}, {screen}: {errors[0]}")
+
+    def walk(self):
+        """Go through the whole flow, yielding after every rerun"""
+        app = self.app
+        # The configuration screen shows an error for every provider without an API key
+        yield self._run("config", allow_errors=True)
+        yield self._run("config", _widget(app.selectbox, "Select AI Provider").select(MOCK_PROVIDER), allow_errors=True)
+        yield self._run("config", _widget(app.button, "Save Configuration").click())
+
+        _widget(app.text_input, "Book Title").input(f"Load test book {self.number}")
+        _widget(app.text_area, "Main Theme").input("Gestione del tempo per piccoli team")
+        _widget(app.text_input, "Target Audience").input("Professionisti")
+        yield self._run("structure", _widget(app.button, "Generate Structure").click())
+        yield self._run("structure", _widget(app.button, "Proceed to Content Generation").click())
+
+        for number in range(1, self.chapters + 1):
+            yield self._run("content", _widget(app.selectbox, "Open chapter").select(number))
+            yield self._run("generate", app.button(key=f"generate_{number}").click())
+            editor = app.text_area(key=f"edit_content_{number}")
+            editor.input(editor.value + "\n\nUn paragrafo aggiunto a mano.")
+            yield self._run("edit", _widget(app.button, "💾 Save Changes").click())
+            yield self._run("edit", _widget(app.button, "📋 Copy to final book").click())
+
+        yield self._run("export", _widget(app.button, "4. Export Book").click())
+        yield self._run("export", _widget(app.button, "Prepare Download").click())
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def run_load_test(sessions, concurrency, chapters, trace_memory=True, progress=None):
+    """Walk the given number of sessions, concurrency open at a time, and return the report"""
+    if trace_memory:
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+    finished, failures = [], []
+    waiting = deque(range(1, sessions + 1))
+    open_sessions = deque()
+    start = time.perf_counter()
+    while waiting or open_sessions:
+        while waiting and len(open_sessions) < concurrency:
+            session = Session(waiting.popleft(), chapters)
+            open_sessions.append((session, session.walk()))
+        # One rerun of the session whose turn it is
+        session, steps = open_sessions.popleft()
+        try:
+            next(steps)
+        except StopIteration:
+            finished.append(session)
+        except Exception as e:
+            failures.append(f"{type(e).__name__}: {e}")
+        else:
+            open_sessions.append((session, steps))
+            continue
+        if progress is not None:
+            progress(len(finished) + len(failures), sessions)
+    seconds = time.perf_counter() - start
+
+    reruns = [(screen, elapsed) for session in finished for screen, elapsed in session.reruns]
+    latencies = [elapsed * 1000 for _, elapsed in reruns]
+    screens = {}
+    for screen, elapsed in reruns:
+        screens.setdefault(screen, []).append(elapsed * 1000)
+    report = {
+        "sessions": sessions,
+        "concurrency": concurrency,
+        "chapters": chapters,
+        "completed": len(finished),
+        "failures": failures,
+        "seconds": round(seconds, 2),
+        "reruns": len(reruns),
+        "reruns_per_second": round(len(reruns) / seconds, 2) if seconds else None,
+        "sessions_per_minute": round(len(finished) * 60 / seconds, 2) if seconds else None,
+        "latency_ms": {
+            name: round(percentile(latencies, fraction), 1)
+            for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p95", 0.95), ("p99", 0.99), ("max", 1.0))
+        },
+        "screens_ms": {
+            screen: {"p50": round(percentile(values, 0.5), 1), "p95": round(percentile(values, 0.95), 1)}
+            for screen, values in screens.items()
+        },
+    }
+    if trace_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # Finished sessions are still held, as a server holds the sessions of open tabs
+        report["memory_kb"] = {
+            "retained_per_session": round((current - baseline) / 1024 / max(len(finished), 1)),
+            "peak_per_open_session": round((peak - baseline) / 1024 / min(concurrency, sessions)),
+            "peak_total": round((peak - baseline) / 1024),
+        }
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import streamlit.config
+    import streamlit.logger
+
+    parser = argparse.ArgumentParser(description="Load test app.py with simulated sessions against a mock provider")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=5, help="sessions open at a time")
+    parser.add_argument("--chapters", type=int, default=3, help="chapters in each generated book")
+    parser.add_argument("--tokens-per-second", type=float, default=0,
+                        help="streaming speed of the mock provider; 0 answers at once")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="skip memory tracing, which slows reruns down")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--max-p95-ms", type=float, help="fail if the 95th percentile rerun is slower than this")
+    args = parser.parse_args()
+
+    # Keep the mock books out of the real projects and runs, and the mock calls out of the usage calibration
+    scratch = tempfile.mkdtemp(prefix="bookcreator_load_test_")
+    token_budget.USAGE_FILE = os.path.join(scratch, "usage.jsonl")
+    project_store.PROJECTS_DIR = os.path.join(scratch, "projects")
+    runs.RUNS_DIR = os.path.join(scratch, "runs")
+    register_mock_provider(args.chapters, args.tokens_per_second)
+    # AppTest runs without a server; its warnings about that would bury the progress
+    streamlit.config.set_option("logger.level", "error")
+    streamlit.logger.set_log_level("error")
+
+    result = run_load_test(
+        args.sessions, args.concurrency, args.chapters, not args.no_tracemalloc,
+        progress=lambda done, total: print(f"\r{done}/{total} sessions", end="", file=sys.stderr, flush=True)
+    )
+    print(file=sys.stderr)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    if result["failures"]:
+        sys.exit(1)
+    if args.max_p95_ms is not None and result["latency_ms"]["p95"] > args.max_p95_ms:
+        print(f"Rerun budget exceeded: p95 {result['latency_ms']['p95']:.0f} ms > {args.max_p95_ms:.0f} ms")
+        sys.exit(1)
@@ -0,0 +1,226 @@
+"""Streaming import of JSON project files.
+
+Older versions of BookCreator saved projects as one JSON document::
+
+    {"book_structure": {...}, "generated_chapters": {"chapter_1": {...}, ...},
+     "book_content": {"1": {...}, ...}, "timestamp": "...", "version": "1.0"}
+
+The importer reads such a file in chunks. Chapters are decoded one at a
+time, validated against their schema and written straight into a new
+project archive, so only one chapter is held in memory at any point.
+Chapters that fail validation are quarantined in the archive and the
+import carries on. A file that is cut off or syntactically broken keeps
+everything imported before the damage.
+
+Run this module directly to benchmark it on a multi-megabyte project.
+"""
+import codecs
+import json
+
+import schemas
+from project_store import ProjectFormatError, ProjectWriter
+
+CHUNK_SIZE = 64 * 1024
+
+# Largest single JSON value (one chapter, or the structure) accepted
+MAX_VALUE_BYTES = 64 * 1024 * 1024
+
+CHAPTER_SECTIONS = {
+    "generated_chapters": ("chapters", schemas.GENERATED_CHAPTER_SCHEMA),
+    "book_content": ("book_content", schemas.BOOK_CONTENT_CHAPTER_SCHEMA),
+}
+
+_WHITESPACE = " \t\n\r"
+
+
+class _JsonStream:
+    """Incremental reader for the members of a JSON document"""
+
+    def __init__(self, fileobj, chunk_size=CHUNK_SIZE):
+        self._file = fileobj
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        self._json = json.JSONDecoder()
+        self._chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.bytes_read = 0
+
+    def _fill(self, size=None):
+        data = self._file.read(size or self._chunk_size)
+        if not data:
+            self.buffer += self._decoder.decode(b"", final=True)
+            self.eof = True
+            return
+        self.bytes_read += len(data)
+        if self.pos > self._chunk_size:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        self.buffer += self._decoder.decode(data)
+
+    def peek(self):
+        """Return the next non-whitespace character, or '' at the end"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self._fill()
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"expected '{char}' at byte ~{self.bytes_read}, found {found or 'end of file'!r}")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next JSON value and return it with its raw text"""
+        self.peek()
+        read_size = self._chunk_size
+        while True:
+            try:
+                value, end = self._json.raw_decode(self.buffer, self.pos)
+                # A number at the very end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    raw = self.buffer[self.pos:end]
+                    self.pos = end
+                    return value, raw
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            if len(self.buffer) - self.pos > MAX_VALUE_BYTES:
+                raise ValueError("a single value in the file is too large")
+            # Read ever larger chunks so a large value is not re-parsed too often
+            self._fill(read_size)
+            read_size *= 2
+
+
+def iter_project(fileobj):
+    """Yield the top-level fields and chapters of a JSON project
+
+    Yields ("field", name, value, raw) for top-level members and
+    ("chapter", section, key, value, raw) for every member of
+    generated_chapters and book_content.
+    """
+    stream = _JsonStream(fileobj)
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+    while True:
+        name, _ = stream.value()
+        stream.expect(":")
+        if name in CHAPTER_SECTIONS and stream.peek() == "{":
+            stream.expect("{")
+            if stream.peek() != "}":
+                while True:
+                    key, _ = stream.value()
+                    stream.expect(":")
+                    value, raw = stream.value()
+                    yield ("chapter", name, key, value, raw), stream.bytes_read
+                    if stream.peek() != ",":
+                        break
+                    stream.expect(",")
+            stream.expect("}")
+        else:
+            value, raw = stream.value()
+            yield ("field", name, value, raw), stream.bytes_read
+        if stream.peek() != ",":
+            break
+        stream.expect(",")
+    stream.expect("}")
+
+
+def import_json_project(fileobj, path, total_bytes=None, progress=None):
+    """Import a JSON project file into a new project archive at path
+
+    progress, if given, is called as progress(bytes_read, total_bytes,
+    chapters_imported) after every chapter. Returns a report dict with the
+    imported and quarantined counts and any error that stopped the import
+    early. Raises ProjectFormatError if no valid book structure was found.
+    """
+    report = {"imported": 0, "quarantined": [], "error": None, "fields": {}}
+    book_structure = None
+    book_details = {}
+
+    with ProjectWriter(path) as writer:
+        try:
+            for event, bytes_read in iter_project(fileobj):
+                if event[0] == "field":
+                    _, name, value, _ = event
+                    if name == "book_structure":
+                        errors = schemas.validate(value, schemas.BOOK_STRUCTURE_SCHEMA, "book_structure")
+                        if errors:
+                            raise ProjectFormatError("; ".join(errors))
+                        book_structure = value
+                    elif name == "book_details" and isinstance(value, dict):
+                        book_details = value
+                    elif not isinstance(value, (dict, list)):
+                        report["fields"][name] = value
+                    continue
+
+                _, name, key, value, raw = event
+                section, schema = CHAPTER_SECTIONS[name]
+                errors = schemas.validate(value, schema, f"{name}.{key}")
+                if section == "book_content" and not str(key).isdigit():
+                    errors.append(f"{name}.{key}: key must be a chapter number")
+                if errors:
+                    writer.quarantine(section, key, raw, errors)
+                    report["quarantined"].append({"section": name, "key": key, "errors": errors})
+                else:
+                    writer.add_chapter(section, key, value)
+                    report["imported"] += 1
+                if progress is not None:
+                    progress(bytes_read, total_bytes, report["imported"])
+        except (ValueError, UnicodeDecodeError) as e:
+            if isinstance(e, ProjectFormatError):
+                raise
+            # Keep what was imported before the damaged part of the file
+            report["error"] = f"Import stopped early: {e}"
+
+        if book_structure is None:
+            raise ProjectFormatError("The file does not contain a valid book structure")
+        writer.close(book_structure, book_details)
+    return report
+
+
+if __name__ == "__main__":
+    import io
+    import os
+    import random
+    import tempfile
+    import time
+    import tracemalloc
+
+    random.seed(0)
+    vocabulary = [f"word{i}" for i in range(5000)]
+    chapters = {
+        f"chapter_{n}": {
+            "number": n,
+            "title": f"Chapter {n}",
+            "content": " ".join(random.choice(vocabulary) for _ in range(10_000)),
+            "generated_at": "2024-01-01 00:00:00",
+        }
+        for n in range(1, 61)
+    }
+    chapters["chapter_61"] = {"number": "61", "title": "Broken"}
+    structure = {"title": "Benchmark", "introduction": "", "conclusion": "",
+                 "chapters": [{"number": n, "title": f"Chapter {n}", "description": ""} for n in range(1, 62)]}
+    data = json.dumps({"book_structure": structure, "generated_chapters": chapters,
+                       "timestamp": "2024-01-01 00:00:00", "version": "1.0"}, indent=2).encode("utf-8")
+    del chapters
+    print(f"Project file: {len(data) / 1e6:.1f} MB")
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    json.load(io.BytesIO(data))
+    print(f"json.load:        {(time.perf_counter() - start) * 1000:7.1f} ms   peak {tracemalloc.get_traced_memory()[1] / 1e6:6.1f} MB")
+    tracemalloc.stop()
+
+    path = os.path.join(tempfile.mkdtemp(), "imported.bcproj")
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = import_json_project(io.BytesIO(data), path, len(data))
+    print(f"streaming import: {(time.perf_counter() - start) * 1000:7.1f} ms   peak {tracemalloc.get_traced_memory()[1] / 1e6:6.1f} MB")
+    tracemalloc.stop()
+    print(f"Imported {result['imported']} chapters, quarantined {len(result['quarantined'])}")
+    os.remove(path)
@@ -0,0 +1,440 @@
+"""Chunked, compressed project archives.
+
+A project is a zip archive with:
+
+- ``manifests/NNNNNN.json``: a small manifest per save. The highest number
+  is the current one. It lists every chapter with its metadata and the
+  archive entry holding its text.
+- ``structure/NNNNNN.json``: the book structure and details, written
+  only when they change.
+- ``chapters/<key>/rNNNN.md`` and ``book/<number>/rNNNN.md``: one
+  deflate-compressed entry per chapter revision.
+- ``quarantine/NNNN.json``: entries an import could not validate, kept
+  for inspection instead of being dropped.
+
+Saving appends only the entries whose content changed plus a new
+manifest. Opening reads just the manifest and structure; chapter bodies
+are read on demand. When superseded entries take up most of the file, the
+archive is compacted. prune_projects() removes the archives of PROJECTS_DIR
+that have not been used for a while, or the least recently used ones once
+they take up too much disk.
+
+Run this module directly to benchmark save/load time and peak memory.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+import zlib
+from datetime import datetime
+
+FORMAT_NAME = "bookcreator-project"
+FORMAT_VERSION = 2
+FILE_EXTENSION = "bcproj"
+
+PROJECTS_DIR = os.environ.get(
+    "BOOKCREATOR_PROJECTS_DIR",
+    os.path.join(os.path.expanduser("~"), ".bookcreator", "projects")
+)
+
+# Compact once superseded entries make up more than this share of the archive
+COMPACT_RATIO = 0.5
+
+# Archives in PROJECTS_DIR unused for longer are removed, and the oldest go past the size limit
+PROJECT_MAX_AGE_DAYS = float(os.environ.get("BOOKCREATOR_PROJECT_MAX_AGE_DAYS", "30"))
+PROJECTS_MAX_BYTES = int(float(os.environ.get("BOOKCREATOR_PROJECTS_MAX_MB", "2048")) * 1024 * 1024)
+
+# Archive folder for the chapters of each manifest section
+SECTION_PREFIXES = {"chapters": "chapters", "book_content": "book"}
+
+# Chapter keys that hold or locate the body rather than describe the chapter.
+# A chapter's text is in "content", or, while it is not loaded, either
+# zlib-compressed in "compressed_content" or in the archive at "archive_entry".
+BODY_FIELDS = ("content", "compressed_content", "archive_entry")
+
+
+class ProjectFormatError(ValueError):
+    """Raised when a file is not a readable project archive"""
+
+
+def text_hash(text):
+    """Return the hash used to detect changed chapter bodies"""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def project_path(project_id):
+    """Return the on-disk path of a project archive"""
+    return os.path.join(PROJECTS_DIR, f"{project_id}.{FILE_EXTENSION}")
+
+
+class ProjectArchive:
+    """Read access to a project archive, loading chapter bodies lazily"""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with zipfile.ZipFile(path) as archive:
+                names = archive.namelist()
+                manifests = sorted(n for n in names if n.startswith("manifests/"))
+                if not manifests:
+                    raise ProjectFormatError("Archive has no manifest")
+                self.manifest = json.loads(archive.read(manifests[-1]))
+                if self.manifest.get("format") != FORMAT_NAME:
+                    raise ProjectFormatError("Not a BookCreator project")
+                if self.manifest.get("version", 0) > FORMAT_VERSION:
+                    raise ProjectFormatError(
+                        f"Project format {self.manifest['version']} is newer than this app supports"
+                    )
+                self.structure = json.loads(archive.read(self.manifest["structure_entry"]))
+        except (zipfile.BadZipFile, KeyError, json.JSONDecodeError) as e:
+            raise ProjectFormatError(f"Invalid project archive: {e}") from e
+        self.sequence = int(manifests[-1].split("/")[1].split(".")[0])
+        # Highest revision written per chapter folder, including chapters since removed
+        self.last_revisions = {}
+        for name in names:
+            folder, _, file_name = name.rpartition("/")
+            revision = file_name[1:].split(".")[0]
+            if folder.split("/")[0] in SECTION_PREFIXES.values() and file_name.startswith("r") and revision.isdigit():
+                self.last_revisions[folder] = max(self.last_revisions.get(folder, 0), int(revision))
+        # Opening a project counts as using it, for prune_projects()
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def read_body(self, entry):
+        """Read one chapter body from the archive"""
+        with zipfile.ZipFile(self.path) as archive:
+            return archive.read(entry).decode("utf-8")
+
+    def generated_chapters(self):
+        """Return draft chapters with their bodies left unloaded"""
+        return {key: _lazy_chapter(record) for key, record in self.manifest["chapters"].items()}
+
+    def book_content(self):
+        """Return final-book chapters with their bodies left unloaded"""
+        return {int(number): _lazy_chapter(record) for number, record in self.manifest["book_content"].items()}
+
+
+def _lazy_chapter(record):
+    chapter = dict(record["fields"])
+    chapter["content"] = None
+    chapter["archive_entry"] = record["entry"]
+    return chapter
+
+
+def load_body(archive, chapter):
+    """Return a chapter's text, decompressing it or reading it from the archive on first use"""
+    if chapter.get("content") is None:
+        if chapter.get("compressed_content") is not None:
+            chapter["content"] = zlib.decompress(chapter.pop("compressed_content")).decode("utf-8")
+        elif chapter.get("archive_entry"):
+            chapter["content"] = archive.read_body(chapter["archive_entry"])
+    return chapter["content"]
+
+
+def compress_body(chapter, level=6):
+    """Keep a loaded chapter's text zlib-compressed until it is used again; returns its size in bytes"""
+    content = chapter.get("content")
+    if content is None:
+        return 0
+    raw = content.encode("utf-8")
+    chapter["compressed_content"] = zlib.compress(raw, level)
+    chapter["content"] = None
+    return len(raw)
+
+
+def unsaved_body(chapter):
+    """Return the chapter text held in memory, compressed or not, or None if it is only in the archive"""
+    if chapter.get("content") is not None:
+        return chapter["content"]
+    if chapter.get("compressed_content") is not None:
+        return zlib.decompress(chapter["compressed_content"]).decode("utf-8")
+    return None
+
+
+def peek_body(archive, chapter):
+    """Return a chapter's text like load_body, but leave a compressed or unloaded chapter as it is"""
+    body = unsaved_body(chapter)
+    if body is None and chapter.get("archive_entry"):
+        body = archive.read_body(chapter["archive_entry"])
+    return body
+
+
+def _write_chapter(archive, section, key, content, fields, revision):
+    """Write one chapter revision and return its manifest record"""
+    entry = f"{SECTION_PREFIXES[section]}/{key}/r{revision:04d}.md"
+    archive.writestr(entry, content)
+    return {
+        "entry": entry,
+        "hash": text_hash(content),
+        "revision": revision,
+        "words": len(content.split()),
+        "fields": fields,
+    }
+
+
+def _chapter_fields(chapter):
+    return {k: v for k, v in chapter.items() if k not in BODY_FIELDS}
+
+
+def _new_manifest(book_structure, structure_hash, structure_entry):
+    return {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "saved_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "title": (book_structure or {}).get("title", ""),
+        "structure_hash": structure_hash,
+        "structure_entry": structure_entry,
+        "chapters": {},
+        "book_content": {},
+        "quarantined": [],
+    }
+
+
+def _structure_json(book_structure, book_details):
+    return json.dumps(
+        {"book_structure": book_structure, "book_details": book_details},
+        ensure_ascii=False, sort_keys=True
+    )
+
+
+class ProjectWriter:
+    """Writes a new project archive one chapter at a time
+
+    Used by importers so that chapter bodies go straight to disk instead of
+    being collected in memory first.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._archive = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+        self.manifest = _new_manifest(None, None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self._archive.close()
+            os.remove(self.path)
+
+    def add_chapter(self, section, key, chapter):
+        """Write a chapter of the given manifest section"""
+        self.manifest[section][str(key)] = _write_chapter(
+            self._archive, section, str(key), chapter["content"], _chapter_fields(chapter), 1
+        )
+
+    def quarantine(self, section, key, raw, errors):
+        """Keep an invalid entry in the archive without importing it"""
+        entry = f"quarantine/{len(self.manifest['quarantined']) + 1:04d}.json"
+        self._archive.writestr(entry, raw)
+        self.manifest["quarantined"].append({"section": section, "key": str(key), "entry": entry, "errors": errors})
+
+    def close(self, book_structure, book_details):
+        """Write the structure and manifest and close the archive"""
+        structure_json = _structure_json(book_structure, book_details)
+        self.manifest.update(
+            title=book_structure.get("title", ""),
+            structure_hash=text_hash(structure_json),
+            structure_entry="structure/000001.json",
+        )
+        self._archive.writestr(self.manifest["structure_entry"], structure_json)
+        self._archive.writestr("manifests/000001.json", json.dumps(self.manifest, ensure_ascii=False))
+        self._archive.close()
+        return self.manifest
+
+
+def save_project(path, book_structure, book_details, generated_chapters, book_content):
+    """Save a project, appending only the entries that changed
+
+    Chapters whose body was never loaded are known to be unchanged and keep
+    pointing at their existing entry. Returns the new manifest.
+    """
+    previous = None
+    if os.path.exists(path):
+        try:
+            previous = ProjectArchive(path)
+        except ProjectFormatError:
+            previous = None
+
+    if previous is None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        old_manifest = {"chapters": {}, "book_content": {}, "structure_hash": None}
+        last_revisions = {}
+        sequence = 1
+        mode = "w"
+    else:
+        old_manifest = previous.manifest
+        last_revisions = previous.last_revisions
+        sequence = previous.sequence + 1
+        mode = "a"
+
+    structure_json = _structure_json(book_structure, book_details)
+    structure_hash = text_hash(structure_json)
+    manifest = _new_manifest(book_structure, structure_hash, old_manifest.get("structure_entry"))
+    manifest["quarantined"] = old_manifest.get("quarantined", [])
+
+    with zipfile.ZipFile(path, mode, compression=zipfile.ZIP_DEFLATED) as archive:
+        if structure_hash != old_manifest["structure_hash"]:
+            manifest["structure_entry"] = f"structure/{sequence:06d}.json"
+            archive.writestr(manifest["structure_entry"], structure_json)
+
+        for section, chapters in (("chapters", generated_chapters), ("book_content", book_content)):
+            for key, chapter in chapters.items():
+                key = str(key)
+                old = old_manifest[section].get(key)
+                fields = _chapter_fields(chapter)
+                content = unsaved_body(chapter)
+                if content is None and old is not None:
+                    manifest[section][key] = dict(old, fields=fields)
+                    continue
+                content = content or ""
+                body_hash = text_hash(content)
+                if old is not None and old["hash"] == body_hash:
+                    manifest[section][key] = dict(old, fields=fields)
+                    continue
+                # A chapter removed and written again must not reuse an entry name
+                folder = f"{SECTION_PREFIXES[section]}/{key}"
+                revision = max(old["revision"] if old else 0, last_revisions.get(folder, 0)) + 1
+                manifest[section][key] = _write_chapter(archive, section, key, content, fields, revision)
+                chapter["archive_entry"] = manifest[section][key]["entry"]
+
+        archive.writestr(f"manifests/{sequence:06d}.json", json.dumps(manifest, ensure_ascii=False))
+
+    if _dead_ratio(path, manifest) > COMPACT_RATIO:
+        compact(path)
+    return manifest
+
+
+def _live_entries(manifest, manifest_name):
+    live = {manifest_name, manifest["structure_entry"]}
+    live.update(record["entry"] for record in manifest.get("quarantined", []))
+    for section in ("chapters", "book_content"):
+        live.update(record["entry"] for record in manifest[section].values())
+    return live
+
+
+def _dead_ratio(path, manifest):
+    with zipfile.ZipFile(path) as archive:
+        infos = archive.infolist()
+        latest = max(i.filename for i in infos if i.filename.startswith("manifests/"))
+        live = _live_entries(manifest, latest)
+        total = sum(i.compress_size for i in infos) or 1
+        dead = sum(i.compress_size for i in infos if i.filename not in live)
+    return dead / total
+
+
+def prune_projects(keep=()):
+    """Remove archives of PROJECTS_DIR unused for PROJECT_MAX_AGE_DAYS, then the least recently used past PROJECTS_MAX_BYTES
+
+    keep lists the archives in use, e.g. by open sessions; they are never
+    removed. Returns the number of archives removed.
+    """
+    keep = {os.path.abspath(path) for path in keep}
+    try:
+        names = os.listdir(PROJECTS_DIR)
+    except OSError:
+        return 0
+    total = 0
+    candidates = []
+    for name in names:
+        if not name.endswith(f".{FILE_EXTENSION}"):
+            continue
+        path = os.path.join(PROJECTS_DIR, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue  # Removed meanwhile
+        total += stat.st_size
+        if os.path.abspath(path) not in keep:
+            candidates.append((stat.st_mtime, stat.st_size, path))
+
+    cutoff = time.time() - PROJECT_MAX_AGE_DAYS * 86400
+    removed = 0
+    for mtime, size, path in sorted(candidates):
+        if mtime >= cutoff and total <= PROJECTS_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+def compact(path):
+    """Rewrite an archive keeping only the entries of its current manifest"""
+    current = ProjectArchive(path)
+    manifest_name = f"manifests/{current.sequence:06d}.json"
+    live = _live_entries(current.manifest, manifest_name)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    os.close(fd)
+    with zipfile.ZipFile(path) as source, \
+            zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED) as target:
+        for info in source.infolist():
+            if info.filename in live:
+                with source.open(info) as src, target.open(info, "w") as dst:
+                    shutil.copyfileobj(src, dst)
+    os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    import random
+    import time
+    import tracemalloc
+
+    random.seed(0)
+    vocabulary = [f"word{i}" for i in range(5000)]
+    chapters = {
+        f"chapter_{n}": {
+            "number": n,
+            "title": f"Chapter {n}",
+            "content": " ".join(random.choice(vocabulary) for _ in range(10_000)),
+            "generated_at": "2024-01-01 00:00:00",
+            "metadata": {"word_count": 10_000},
+        }
+        for n in range(1, 31)
+    }
+    structure = {"title": "Benchmark", "introduction": "", "conclusion": "",
+                 "chapters": [{"number": n, "title": f"Chapter {n}", "description": ""} for n in range(1, 31)]}
+    print(f"Book: {len(chapters)} chapters, {sum(len(c['content'].split()) for c in chapters.values()):,} words")
+
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, f"bench.{FILE_EXTENSION}")
+
+    def measure(label, func):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{label:<34} {elapsed * 1000:8.1f} ms   peak {peak / 1e6:6.1f} MB")
+        return result
+
+    blob_path = os.path.join(workdir, "bench.json")
+
+    def save_json_blob():
+        with open(blob_path, "w") as f:
+            f.write(json.dumps({"book_structure": structure, "generated_chapters": chapters}, indent=2))
+
+    def load_json_blob():
+        with open(blob_path) as f:
+            return json.load(f)
+
+    measure("json blob save", save_json_blob)
+    measure("json blob load", load_json_blob)
+    measure("archive first save", lambda: save_project(path, structure, {}, chapters, {}))
+    chapters["chapter_7"]["content"] += " one more edit"
+    measure("archive save, one chapter changed", lambda: save_project(path, structure, {}, chapters, {}))
+    opened = measure("archive open (manifest+structure)", lambda: ProjectArchive(path))
+    lazy = opened.generated_chapters()
+    measure("archive load one chapter", lambda: load_body(opened, lazy["chapter_7"]))
+    print(f"json blob size: {os.path.getsize(blob_path) / 1e6:.1f} MB, archive size: {os.path.getsize(path) / 1e6:.1f} MB")
+    shutil.rmtree(workdir)
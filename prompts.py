@@ -0,0 +1,184 @@
+"""Prompts sent to the AI providers.
+
+The prompts live outside app.py so the scheduler, the batch runner and
+the API service build exactly the same requests as the UI.
+"""
+
+# Output budget for chapter descriptions, in words
+DESCRIPTION_TARGET_WORDS = 150
+
+
+def create_structure_prompt(title, theme, audience, style, goals):
+    return f"""
+    As an expert editorial consultant, help me create a detailed structure for a non-fiction book with these characteristics:
+
+    - Title: {title}
+    - Main Theme: {theme}
+    - Target Audience: {audience}
+    - Writing Style: {style}
+    - Book Goals: {goals}
+
+    Please generate a complete structure including:
+    1. A compelling introduction presenting the theme and book objectives
+    2. 6-10 logically organized chapters, each with an engaging title and brief content description (3-5 sentences)
+    3. A conclusion summarizing key points and leaving readers with meaningful reflections
+
+    Format the response in JSON as follows:
+    {{
+        "title": "Book Title",
+        "introduction": "Introduction text...",
+        "chapters": [
+            {{
+                "number": 1,
+                "title": "Chapter 1 Title",
+                "description": "Chapter description..."
+            }},
+            ...
+        ],
+        "conclusion": "Conclusion text..."
+    }}
+    """
+
+
+def create_description_prompt(book_info, chapter_title):
+    """Create the prompt that writes a fresh description for a chapter"""
+    return f"""
+    You are an expert editorial consultant. Help write an engaging description for
+    the chapter '{chapter_title}' of a book titled '{book_info["title"]}' on the theme '{book_info["theme"]}' 
+    for an audience of '{book_info["audience"]}' in {book_info["style"]} style.
+
+    Write a concise description (3-5 sentences) that clearly explains what this chapter will cover.
+    The description should be engaging and informative, fitting the book's overall context.
+    """
+
+
+def create_chapter_prompt(book_info, chapter_info, key_points, length, custom_content=None):
+    """Crea il prompt per generare un capitolo specifico"""
+    prompt = f"""
+    Sei un autore di libri non-fiction esperto. Stai scrivendo un capitolo per il seguente libro:
+
+    - Titolo del libro: {book_info['title']}
+    - Tema principale: {book_info['theme']}
+    - Pubblico target: {book_info['audience']}
+    - Stile di scrittura: {book_info['style']}
+
+    CAPITOLO DA SCRIVERE:
+    - Numero: {chapter_info['number']}
+    - Titolo: {chapter_info['title']}
+    - Descrizione: {chapter_info['description']}
+
+    Punti chiave da includere:
+    {key_points if key_points else "Utilizza la tua creatività basandoti sulla descrizione del capitolo."}
+    """
+
+    if custom_content:
+        prompt += f"""
+
+    Contenuto personalizzato da incorporare nel capitolo:
+    {custom_content}
+
+    Per favore, integra organicamente questo contenuto personalizzato nel capitolo, mantenendo uno stile coerente e fluido.
+    """
+
+    prompt += f"""
+
+    Lunghezza approssimativa: {length}
+
+    Scrivi un capitolo completo, ben strutturato e coinvolgente. Includi esempi concreti, riferimenti pertinenti e, dove appropriato, aneddoti per illustrare i concetti. Assicurati che il capitolo mantenga uno stile coerente con il resto del libro e si colleghi logicamente ai capitoli precedenti e successivi.
+
+    Formatta il contenuto con titoli chiari usando la sintassi Markdown (##) per le sezioni principali e (###) per le sottosezioni.
+    """
+    return prompt
+
+
+def _chapter_digest(chapters, max_words):
+    """Return the chapters as '- title: opening words' lines, at most max_words words each"""
+    lines = []
+    for chapter in chapters:
+        words = chapter["content"].split()
+        excerpt = " ".join(words[:max_words]) + (" …" if len(words) > max_words else "")
+        lines.append(f"- Chapter {chapter['number']}, {chapter['title']}: {excerpt}")
+    return "\n    ".join(lines)
+
+
+def create_introduction_prompt(book_info, brief, chapters, length, excerpt_words=120):
+    """Create the prompt that writes the full introduction once the chapters are written"""
+    return f"""
+    You are an expert non-fiction author. You have finished the chapters of the following book and now need to write its introduction:
+
+    - Book Title: {book_info['title']}
+    - Main Theme: {book_info['theme']}
+    - Target Audience: {book_info['audience']}
+    - Writing Style: {book_info['style']}
+
+    Outline of the introduction:
+    {brief}
+
+    The chapters of the book, with their opening words:
+    {_chapter_digest(chapters, excerpt_words)}
+
+    Approximate length: {length}
+
+    Write a complete and engaging introduction that presents the theme, explains why the book is useful to the reader and previews the path through the chapters, without summarizing them one by one. Write in the same language and style as the chapters.
+
+    Format the content with Markdown syntax, using (##) for any sections. Do not repeat the "Introduction" title.
+    """
+
+
+def create_conclusion_prompt(book_info, brief, chapters, length, excerpt_words=120):
+    """Create the prompt that writes the full conclusion once the chapters are written"""
+    return f"""
+    You are an expert non-fiction author. You have finished the chapters of the following book and now need to write its conclusion:
+
+    - Book Title: {book_info['title']}
+    - Main Theme: {book_info['theme']}
+    - Target Audience: {book_info['audience']}
+    - Writing Style: {book_info['style']}
+
+    Outline of the conclusion:
+    {brief}
+
+    The chapters of the book, with their opening words:
+    {_chapter_digest(chapters, excerpt_words)}
+
+    Approximate length: {length}
+
+    Write a complete conclusion that draws together the key points of the chapters into an overall picture and leaves the reader with reflections and concrete next steps. Write in the same language and style as the chapters.
+
+    Format the content with Markdown syntax, using (##) for any sections. Do not repeat the "Conclusion" title.
+    """
+
+
+def create_rewrite_prompt(book_info, chapter_title, instruction, section, position, outline):
+    """Create the prompt that rewrites one section of a chapter with an instruction shared by all its sections"""
+    return f"""
+    You are an expert non-fiction editor. You are revising the chapter "{chapter_title}" of the book "{book_info['title']}" (audience: {book_info['audience']}, style: {book_info['style']}).
+
+    The chapter is revised one section at a time, with the same instruction for every section:
+    {instruction}
+
+    Outline of the chapter:
+    {outline}
+
+    This is section {position}. Rewrite it following the instruction. Keep the section's heading line (starting with #), if any, unchanged, and keep the Markdown formatting and the language of the original text. Reply with the rewritten section only, without comments.
+
+    Original section:
+
+    {section}
+    """
+
+
+def create_transition_prompt(instruction, before, after):
+    """Create the prompt that smooths the boundary between two separately rewritten sections"""
+    return f"""
+    Two consecutive sections of a chapter were revised separately following this instruction:
+    {instruction}
+
+    Last paragraph of the first section:
+    {before}
+
+    First paragraph of the next section:
+    {after}
+
+    Edit the two paragraphs only as much as needed for one to lead naturally into the other: remove repetitions and connect the ideas, without changing their content or their language. Return "end" (the last paragraph of the first section) and "start" (the first paragraph of the second).
+    """
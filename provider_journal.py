@@ -0,0 +1,206 @@
+"""Recording and replay of provider traffic.
+
+Set BOOKCREATOR_JOURNAL to a file path to append every provider request
+and response to it as JSON lines, with the time to the first chunk, the
+total time and the arrival time of each streamed chunk.
+
+Set BOOKCREATOR_REPLAY to a journal to serve those responses back instead
+of calling the providers. Requests are matched on a hash of the provider,
+model, messages and schema; identical requests get their responses in
+recorded order. max_tokens is left out: it follows the calibrated
+words per token, which drifts between the recording and the replay. With BOOKCREATOR_REPLAY_MATCH=sequence the
+responses are served in file order whatever the request, for sessions
+whose prompts vary (e.g. with timestamps). BOOKCREATOR_REPLAY_LATENCY
+scales the recorded timings: 1 (the default) replays them as recorded,
+0.5 twice as fast and 0 instantly.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+
+JOURNAL_FILE = os.environ.get("BOOKCREATOR_JOURNAL")
+REPLAY_FILE = os.environ.get("BOOKCREATOR_REPLAY")
+REPLAY_MATCH = os.environ.get("BOOKCREATOR_REPLAY_MATCH", "request")
+REPLAY_LATENCY = float(os.environ.get("BOOKCREATOR_REPLAY_LATENCY", "1"))
+
+
+class ReplayMissError(LookupError):
+    """The replay journal has no response left for a request"""
+
+
+def request_hash(provider, model, messages, schema_name=None):
+    encoded = json.dumps([provider, model, messages, schema_name], sort_keys=True, ensure_ascii=False)
+    return hashlib.blake2b(encoded.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class Journal:
+    """Append-only JSONL log of provider calls, safe to share between threads"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def start(self, provider, model, messages, max_tokens, schema_name=None, on_text=None):
+        """Return a Recording for one call; pass its on_text to the provider"""
+        return Recording(self, provider, model, messages, max_tokens, schema_name, on_text)
+
+    def write(self, entry):
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+class Recording:
+    """Timing of a single provider call while it runs"""
+
+    def __init__(self, journal, provider, model, messages, max_tokens, schema_name, on_text):
+        self.journal = journal
+        self.entry = {
+            "request": request_hash(provider, model, messages, schema_name),
+            "time": time.time(),
+            "provider": provider,
+            "model": model,
+            "max_tokens": max_tokens,
+            "schema": schema_name,
+            "messages": messages,
+            "chunks": [],
+        }
+        self._forward = on_text
+        self._start = time.perf_counter()
+        # Providers only stream when given a callback
+        self.on_text = self._chunk if on_text is not None else None
+
+    def _chunk(self, text):
+        self.entry["chunks"].append([round((time.perf_counter() - self._start) * 1000, 1), text])
+        return self._forward(text)
+
+    def finish(self, completion=None, error=None):
+        elapsed_ms = round((time.perf_counter() - self._start) * 1000, 1)
+        chunks = self.entry["chunks"]
+        self.entry.update(
+            total_ms=elapsed_ms,
+            first_chunk_ms=chunks[0][0] if chunks else elapsed_ms,
+        )
+        if completion is not None:
+            self.entry["response"] = completion._asdict()
+        if error is not None:
+            self.entry["error"] = f"{type(error).__name__}: {error}"
+        self.journal.write(self.entry)
+
+
+class Replayer:
+    """Serves the responses of a journal back in place of the providers"""
+
+    def __init__(self, path, match="request", latency_scale=1.0):
+        self.match = match
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._by_request = {}
+        self._sequence = deque()
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                # Hashed again rather than read from "request", so journals keyed with older fields still match
+                key = request_hash(entry["provider"], entry["model"], entry["messages"], entry.get("schema"))
+                self._by_request.setdefault(key, deque()).append(entry)
+                self._sequence.append(entry)
+
+    def _next(self, key):
+        with self._lock:
+            if self.match == "sequence":
+                return self._sequence.popleft() if self._sequence else None
+            queue = self._by_request.get(key)
+            return queue.popleft() if queue else None
+
+    def replay(self, provider, model, messages, max_tokens, schema_name=None, on_text=None):
+        """Return the recorded response fields for a request, streaming its chunks to on_text"""
+        entry = self._next(request_hash(provider, model, messages, schema_name))
+        if entry is None:
+            raise ReplayMissError(f"No recorded response left for this {provider} {model} request")
+
+        start = time.perf_counter()
+
+        def wait_until(offset_ms):
+            delay = offset_ms * self.latency_scale / 1000 - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+        response = entry.get("response")
+        if on_text is not None and entry["chunks"]:
+            streamed = []
+            for offset_ms, text in entry["chunks"]:
+                wait_until(offset_ms)
+                streamed.append(text)
+                if on_text(text) and response is not None:
+                    # Stopped by the caller, as a live stream would be (providers.STOPPED)
+                    return dict(response, text="".join(streamed), finish_reason="stopped", truncated=False,
+                                output_tokens=None)
+        elif on_text is not None and response:
+            wait_until(entry["first_chunk_ms"])
+            on_text(response["text"])
+        wait_until(entry["total_ms"])
+        if response is None:
+            raise RuntimeError(f"Recorded call failed: {entry.get('error', 'unknown error')}")
+        return response
+
+
+_journal = None
+_replayer = None
+_init_lock = threading.Lock()
+
+
+def journal():
+    """Return the journal configured by BOOKCREATOR_JOURNAL, or None"""
+    global _journal
+    if JOURNAL_FILE and _journal is None:
+        with _init_lock:
+            if _journal is None:
+                _journal = Journal(JOURNAL_FILE)
+    return _journal
+
+
+def replayer():
+    """Return the replayer configured by BOOKCREATOR_REPLAY, or None"""
+    global _replayer
+    if REPLAY_FILE and _replayer is None:
+        with _init_lock:
+            if _replayer is None:
+                _replayer = Replayer(REPLAY_FILE, REPLAY_MATCH, REPLAY_LATENCY)
+    return _replayer
+
+
+if __name__ == "__main__":
+    import argparse
+    import statistics
+
+    parser = argparse.ArgumentParser(description="Summarise the provider calls of a journal")
+    parser.add_argument("journal")
+    args = parser.parse_args()
+
+    calls = {}
+    with open(args.journal, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                calls.setdefault((entry["provider"], entry["model"]), []).append(entry)
+
+    for (provider, model), entries in sorted(calls.items()):
+        totals = [entry["total_ms"] for entry in entries]
+        first_chunks = [entry["first_chunk_ms"] for entry in entries]
+        output_tokens = sum((entry.get("response") or {}).get("output_tokens") or 0 for entry in entries)
+        failures = sum(1 for entry in entries if "error" in entry)
+        print(
+            f"{provider} {model}: {len(entries)} calls, {failures} failed, "
+            f"first chunk p50 {statistics.median(first_chunks):.0f} ms, "
+            f"total p50 {statistics.median(totals):.0f} ms, max {max(totals):.0f} ms, "
+            f"{output_tokens:,} output tokens"
+        )
@@ -0,0 +1,468 @@
+"""Calls to the AI providers.
+
+These functions do not touch Streamlit, so they can be used from the app,
+from worker threads and from command-line tools alike. Every call returns
+a Completion with the text, whether the provider cut it short because of
+the token limit, and the token usage. A streaming callback that returns
+True stops the stream: the Completion then has the text streamed so far,
+finish_reason STOPPED and, as providers only report it at the end, no
+output token count.
+
+Providers are looked up by name in a registry. Each one declares the API
+it speaks ("openai" or "anthropic", which picks the client factory and
+request code), its models and their output limits, its request limits,
+and whether it streams and supports prefill. OpenAI-compatible inference
+servers such as vLLM or llama.cpp are "openai" providers with their own
+base_url; they are read from the JSON list in BOOKCREATOR_PROVIDERS
+(default ~/.bookcreator/providers.json), e.g.
+
+    [{"name": "Local vLLM", "api": "openai", "base_url": "http://gpu1:8000/v1",
+      "models": ["meta-llama/Llama-3.1-70B-Instruct"], "output_limits": {"meta-llama/Llama-3.1-70B-Instruct": 8192},
+      "max_concurrent": 8}]
+
+Entries that are not valid are skipped with a warning. The app can add
+servers to that file only when BOOKCREATOR_SERVER_ADMIN=1, as they are
+offered to every user of the instance; it cannot name an API key
+variable or replace a provider already registered.
+"""
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+
+import provider_journal
+import schemas
+import startup_probe
+import token_budget
+import tracing
+
+Completion = namedtuple("Completion", "text finish_reason truncated input_tokens output_tokens")
+
+# finish_reason of a stream stopped by its on_text callback
+STOPPED = "stopped"
+
+# models[0] is the default. api_key_env None means the server needs no key.
+# supports_prefill: the API continues a trailing assistant message verbatim.
+# json_schema_models accept a JSON schema response format; json_mode_models
+# only guarantee syntactically valid JSON. requests_per_minute and
+# max_concurrent, if set, limit the calls of each process to the provider.
+# prices maps models to their [input, output] price in USD per million tokens.
+ProviderSpec = namedtuple(
+    "ProviderSpec",
+    "name api models api_key_env base_url streaming supports_prefill json_schema_models json_mode_models "
+    "output_limits requests_per_minute max_concurrent prices",
+    defaults=(None, None, True, False, (), (), None, None, None, None)
+)
+
+PROVIDERS_FILE = os.environ.get(
+    "BOOKCREATOR_PROVIDERS",
+    os.path.join(os.path.expanduser("~"), ".bookcreator", "providers.json")
+)
+# The configuration screen may add servers to PROVIDERS_FILE, for every user
+ALLOW_SERVER_ADMIN = os.environ.get("BOOKCREATOR_SERVER_ADMIN") == "1"
+
+# Name of the provider used when none is chosen
+DEFAULT_PROVIDER = "OpenAI"
+
+PROVIDERS = {}
+# Providers added at runtime, saved back to PROVIDERS_FILE
+_custom_providers = {}
+_limiters = {}
+_registry_lock = threading.Lock()
+
+
+class RateLimiter:
+    """Provider request rate and concurrency limit
+
+    Requests are spaced evenly to stay under requests_per_minute, and no
+    more than max_concurrent are in flight at once; either may be None for
+    no limit. The state lives in
+    multiprocessing primitives, so one limiter can be shared by threads and
+    by the processes of a pool.
+    """
+
+    def __init__(self, requests_per_minute, max_concurrent, context=None):
+        if context is None:
+            import multiprocessing as context
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._next_start = context.Value("d", 0.0)
+        self._slots = context.BoundedSemaphore(max_concurrent) if max_concurrent else None
+
+    def __enter__(self):
+        if self._slots is not None:
+            self._slots.acquire()
+        with self._next_start.get_lock():
+            now = time.time()
+            start = max(now, self._next_start.value)
+            self._next_start.value = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._slots is not None:
+            self._slots.release()
+        return False
+
+    def wrap(self, func):
+        """Return func made to wait for the rate limit on every call"""
+        def limited(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+        return limited
+
+
+def register(spec, save=False, replace=True):
+    """Add or replace a provider; with save=True it is also written to PROVIDERS_FILE
+
+    With replace=False, a ValueError is raised if the name is taken.
+    """
+    if spec.api not in API_BACKENDS:
+        raise ValueError(f"Unknown provider API {spec.api!r}; expected one of {', '.join(API_BACKENDS)}")
+    if not spec.models:
+        raise ValueError(f"Provider {spec.name} declares no models")
+    spec = spec._replace(
+        models=tuple(spec.models),
+        json_schema_models=frozenset(spec.json_schema_models),
+        json_mode_models=frozenset(spec.json_mode_models),
+    )
+    with _registry_lock:
+        if not replace and spec.name in PROVIDERS:
+            raise ValueError(f"A provider named {spec.name!r} already exists")
+        PROVIDERS[spec.name] = spec
+        _limiters.pop(spec.name, None)
+        # max_tokens_for() looks output limits up by model alone
+        token_budget.MODEL_OUTPUT_LIMITS.update(spec.output_limits or {})
+        if save:
+            _custom_providers[spec.name] = spec
+            _save_providers_file()
+    return spec
+
+
+def _spec_from_json(entry):
+    unknown = set(entry) - set(ProviderSpec._fields)
+    if unknown:
+        raise ValueError(f"Unknown provider settings: {', '.join(sorted(unknown))}")
+    return ProviderSpec(**entry)
+
+
+def _save_providers_file():
+    entries = []
+    for spec in _custom_providers.values():
+        entry = {field: value for field, value in spec._asdict().items() if value not in (None, (), frozenset())}
+        entry["models"] = list(spec.models)
+        for field in ("json_schema_models", "json_mode_models"):
+            if field in entry:
+                entry[field] = sorted(entry[field])
+        entries.append(entry)
+    directory = os.path.dirname(PROVIDERS_FILE)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(PROVIDERS_FILE, "w", encoding="utf-8") as f:
+        json.dump(entries, f, indent=2, ensure_ascii=False)
+
+
+def load_providers_file(path=None):
+    """Register the providers listed in a JSON file
+
+    A missing file is not an error. The file is read when the module is
+    imported, so an unreadable file or entry is reported and skipped
+    rather than raised.
+    """
+    path = path or PROVIDERS_FILE
+    try:
+        with open(path, encoding="utf-8") as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError) as e:
+        print(f"[providers] skipped {path}: {e}", file=sys.stderr, flush=True)
+        return []
+    if not isinstance(entries, list):
+        print(f"[providers] skipped {path}: expected a JSON list of providers", file=sys.stderr, flush=True)
+        return []
+    loaded = []
+    for number, entry in enumerate(entries, 1):
+        try:
+            if not isinstance(entry, dict):
+                raise ValueError("expected a JSON object")
+            spec = register(_spec_from_json(entry))
+        except (TypeError, ValueError) as e:
+            print(f"[providers] skipped entry {number} of {path}: {e}", file=sys.stderr, flush=True)
+            continue
+        _custom_providers[spec.name] = spec
+        loaded.append(spec)
+    return loaded
+
+
+def get_provider(name):
+    try:
+        return PROVIDERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown provider {name!r}") from None
+
+
+def provider_names():
+    return list(PROVIDERS)
+
+
+def default_model(provider):
+    return get_provider(provider).models[0]
+
+
+def supports_prefill(provider):
+    spec = PROVIDERS.get(provider)
+    return bool(spec and spec.supports_prefill)
+
+
+def has_credentials(provider):
+    """Return whether the provider's API key is set, or it needs none"""
+    spec = get_provider(provider)
+    return spec.api_key_env is None or bool(os.environ.get(spec.api_key_env))
+
+
+def _limiter(spec):
+    if not (spec.requests_per_minute or spec.max_concurrent):
+        return None
+    with _registry_lock:
+        if spec.name not in _limiters:
+            _limiters[spec.name] = RateLimiter(spec.requests_per_minute, spec.max_concurrent)
+        return _limiters[spec.name]
+
+
+def _api_key(spec):
+    if spec.api_key_env is None:
+        # The SDKs insist on a key even for servers that ignore it
+        return "not-needed"
+    api_key = os.environ.get(spec.api_key_env)
+    if not api_key:
+        raise ValueError(f"{spec.name} API key not found in environment ({spec.api_key_env})")
+    return api_key
+
+
+# The SDKs are imported on first use: they are slow to import and most
+# reruns never call a provider.
+def init_openai_client(spec):
+    """Create an OpenAI client for an OpenAI or OpenAI-compatible provider"""
+    api_key = _api_key(spec)
+    start = time.perf_counter()
+    from openai import OpenAI
+    startup_probe.record_lazy_import("openai", time.perf_counter() - start)
+    return OpenAI(api_key=api_key, base_url=spec.base_url)
+
+
+def init_anthropic_client(spec):
+    """Create an Anthropic client for a provider speaking the Anthropic API"""
+    api_key = _api_key(spec)
+    start = time.perf_counter()
+    from anthropic import Anthropic
+    startup_probe.record_lazy_import("anthropic", time.perf_counter() - start)
+    return Anthropic(api_key=api_key, base_url=spec.base_url)
+
+
+def list_models(provider):
+    """Ask an OpenAI-compatible server which models it serves"""
+    spec = get_provider(provider)
+    if spec.api != "openai":
+        return list(spec.models)
+    return sorted(model.id for model in init_openai_client(spec).models.list())
+
+
+def as_messages(prompt):
+    """Accept either a prompt string or a list of chat messages"""
+    if isinstance(prompt, str):
+        return [{"role": "user", "content": prompt}]
+    return prompt
+
+
+def call_anthropic(spec, prompt, model, max_tokens, on_text=None):
+    """Call an Anthropic (Claude) provider, streaming text to on_text if given"""
+    client = init_anthropic_client(spec)
+
+    request = {"model": model, "max_tokens": max_tokens, "messages": as_messages(prompt)}
+    if on_text is None:
+        response = client.messages.create(**request)
+    else:
+        parts = []
+        with client.messages.stream(**request) as stream:
+            for text in stream.text_stream:
+                parts.append(text)
+                if on_text(text):
+                    # Leaving the block closes the connection, which ends generation
+                    usage = stream.current_message_snapshot.usage
+                    return Completion("".join(parts), STOPPED, False, usage.input_tokens, None)
+            response = stream.get_final_message()
+
+    text = "".join(block.text for block in response.content if block.type == "text")
+    return Completion(
+        text,
+        response.stop_reason,
+        response.stop_reason == "max_tokens",
+        response.usage.input_tokens,
+        response.usage.output_tokens
+    )
+
+
+def call_openai(spec, prompt, model, max_tokens, on_text=None):
+    """Call an OpenAI or OpenAI-compatible provider, streaming text to on_text if given"""
+    client = init_openai_client(spec)
+
+    request = {"model": model, "messages": as_messages(prompt), "max_tokens": max_tokens}
+    if on_text is None:
+        response = client.chat.completions.create(**request)
+        choice = response.choices[0]
+        text, finish_reason, usage = choice.message.content or "", choice.finish_reason, response.usage
+    else:
+        parts = []
+        finish_reason = usage = None
+        stream = client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **request)
+        for chunk in stream:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.delta.content:
+                parts.append(choice.delta.content)
+                if on_text(choice.delta.content):
+                    stream.close()
+                    finish_reason = STOPPED
+                    break
+            if choice.finish_reason:
+                finish_reason = choice.finish_reason
+        text = "".join(parts)
+
+    return Completion(
+        text,
+        finish_reason,
+        finish_reason == "length",
+        usage.prompt_tokens if usage else None,
+        usage.completion_tokens if usage else None
+    )
+
+
+def call_anthropic_structured(spec, prompt, model, max_tokens, schema, name):
+    """Call Anthropic with a forced tool call whose input follows the schema"""
+    client = init_anthropic_client(spec)
+
+    response = client.messages.create(
+        model=model,
+        max_tokens=max_tokens,
+        messages=as_messages(prompt),
+        tools=[{"name": name, "description": f"Record the {name.replace('_', ' ')}", "input_schema": schema}],
+        tool_choice={"type": "tool", "name": name}
+    )
+    tool_input = next((block.input for block in response.content if block.type == "tool_use"), None)
+    text = json.dumps(tool_input, ensure_ascii=False) if tool_input is not None else ""
+    return Completion(
+        text,
+        response.stop_reason,
+        response.stop_reason == "max_tokens",
+        response.usage.input_tokens,
+        response.usage.output_tokens
+    )
+
+
+def call_openai_structured(spec, prompt, model, max_tokens, schema, name):
+    """Call OpenAI with the strictest JSON response format the model supports"""
+    client = init_openai_client(spec)
+
+    request = {"model": model, "messages": as_messages(prompt), "max_tokens": max_tokens}
+    if model in spec.json_schema_models:
+        request["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": name, "schema": schemas.strict_schema(schema), "strict": True}
+        }
+    elif model in spec.json_mode_models:
+        request["response_format"] = {"type": "json_object"}
+    response = client.chat.completions.create(**request)
+    choice = response.choices[0]
+    return Completion(
+        choice.message.content or "",
+        choice.finish_reason,
+        choice.finish_reason == "length",
+        response.usage.prompt_tokens,
+        response.usage.completion_tokens
+    )
+
+
+def _trace_completion(call_span, completion):
+    call_span.set(
+        finish_reason=completion.finish_reason,
+        input_tokens=completion.input_tokens,
+        output_tokens=completion.output_tokens
+    )
+    return completion
+
+
+# Client factory, text call and structured call of each API
+API_BACKENDS = {
+    "openai": (init_openai_client, call_openai, call_openai_structured),
+    "anthropic": (init_anthropic_client, call_anthropic, call_anthropic_structured),
+}
+
+
+def _dispatch(provider, model, messages, max_tokens, on_text, schema, name):
+    spec = get_provider(provider)
+    _, call, call_structured = API_BACKENDS[spec.api]
+    with _limiter(spec) or contextlib.nullcontext():
+        if schema is not None:
+            return call_structured(spec, messages, model, max_tokens, schema, name)
+        if on_text is None or spec.streaming:
+            return call(spec, messages, model, max_tokens, on_text)
+        # A provider that cannot stream hands over the whole text at the end
+        completion = call(spec, messages, model, max_tokens)
+        on_text(completion.text)
+        return completion
+
+
+def _complete(provider, model, prompt, max_tokens, on_text=None, schema=None, name=None):
+    """Run one provider call, replaying or journaling it when configured"""
+    messages = as_messages(prompt)
+    with tracing.span(
+        "provider.call", provider=provider, model=model, max_tokens=max_tokens,
+        streaming=on_text is not None, schema=name
+    ) as call_span:
+        replayer = provider_journal.replayer()
+        if replayer is not None:
+            call_span.set(replayed=True)
+            fields = replayer.replay(provider, model, messages, max_tokens, name, on_text)
+            return _trace_completion(call_span, Completion(**fields))
+
+        journal = provider_journal.journal()
+        if journal is None:
+            return _trace_completion(call_span, _dispatch(provider, model, messages, max_tokens, on_text, schema, name))
+        recording = journal.start(provider, model, messages, max_tokens, name, on_text)
+        try:
+            completion = _dispatch(provider, model, messages, max_tokens, recording.on_text, schema, name)
+        except Exception as e:
+            recording.finish(error=e)
+            raise
+        recording.finish(completion)
+        return _trace_completion(call_span, completion)
+
+
+def complete_structured(provider, model, prompt, max_tokens, schema, name):
+    """Ask the provider for JSON matching a schema; the Completion text is that JSON"""
+    return _complete(provider, model, prompt, max_tokens, schema=schema, name=name)
+
+
+def complete(provider, model, prompt, max_tokens, on_text=None):
+    """Call the given provider and return a Completion"""
+    return _complete(provider, model, prompt, max_tokens, on_text)
+
+
+register(ProviderSpec(
+    "OpenAI", "openai", ("gpt-4o", "gpt-4-turbo-preview", "gpt-4"), "OPENAI_API_KEY",
+    json_schema_models=("gpt-4o",), json_mode_models=("gpt-4-turbo-preview",),
+    prices={"gpt-4o": [2.5, 10], "gpt-4-turbo-preview": [10, 30], "gpt-4": [30, 60]}
+))
+register(ProviderSpec(
+    "Anthropic", "anthropic", ("claude-3-5-sonnet-20241022", "claude-3-opus-20240229", "claude-3-sonnet-20240229"),
+    "ANTHROPIC_API_KEY", supports_prefill=True,
+    prices={"claude-3-5-sonnet-20241022": [3, 15], "claude-3-opus-20240229": [15, 75], "claude-3-sonnet-20240229": [3, 15]}
+))
+load_providers_file()
@@ -0,0 +1,265 @@
+"""Chapter revision history and book draft branches.
+
+Every chapter has a tree of revisions. A revision is stored either as a
+zlib-compressed snapshot of the full text or as a compressed line delta
+against its parent. A snapshot is taken every SNAPSHOT_INTERVAL
+revisions along a chain, or whenever a delta would be nearly as large as
+the text. Storage therefore grows with the amount of text edited, not
+with the number of saves.
+
+A branch is just a mapping of chapter keys to head revisions. Creating a
+branch copies that mapping, so every chapter the branches have not
+edited is shared between them.
+
+Restoring an earlier revision, undo included, commits its text as a new
+revision on top of the head, so nothing written after it is lost and it
+can be restored in turn. A chapter cleared for regeneration leaves its
+branch but keeps its last revision, so the draft can still be brought
+back.
+"""
+import difflib
+import json
+import zlib
+from datetime import datetime
+
+SNAPSHOT_INTERVAL = 10
+DEFAULT_BRANCH = "main"
+
+
+def _encode_delta(base, text):
+    """Encode text as line operations against base"""
+    base_lines = base.splitlines(keepends=True)
+    lines = text.splitlines(keepends=True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, base_lines, lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append("".join(lines[j1:j2]))
+    return zlib.compress(json.dumps(ops, ensure_ascii=False).encode("utf-8"))
+
+
+def _apply_delta(base, data):
+    base_lines = base.splitlines(keepends=True)
+    parts = []
+    for op in json.loads(zlib.decompress(data)):
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            parts.extend(base_lines[op[0]:op[1]])
+    return "".join(parts)
+
+
+class _Revision:
+    __slots__ = ("id", "parent", "snapshot", "data", "depth", "label", "created_at", "words", "fields", "restores")
+
+    def __init__(self, rev_id, parent, snapshot, data, depth, label, words, fields, restores=None):
+        self.id = rev_id
+        self.parent = parent
+        self.snapshot = snapshot
+        self.data = data
+        self.depth = depth
+        self.label = label
+        self.created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.words = words
+        self.fields = fields
+        # The earlier revision whose text this one brought back
+        self.restores = restores
+
+
+class ChapterHistory:
+    """Revision tree of a single chapter"""
+
+    def __init__(self):
+        self.revisions = {}
+        self._cache = {}
+
+    def add(self, text, parent=None, label="", fields=None, restores=None):
+        """Store a new revision and return its id"""
+        rev_id = len(self.revisions) + 1
+        snapshot = zlib.compress(text.encode("utf-8"))
+        parent_rev = self.revisions.get(parent)
+        depth = 0
+        data = snapshot
+        is_snapshot = True
+        if parent_rev is not None and parent_rev.depth + 1 < SNAPSHOT_INTERVAL:
+            delta = _encode_delta(self.text(parent), text)
+            if len(delta) < len(snapshot) * 0.8:
+                data, is_snapshot, depth = delta, False, parent_rev.depth + 1
+        self.revisions[rev_id] = _Revision(
+            rev_id, parent, is_snapshot, data, depth, label, len(text.split()), fields or {}, restores
+        )
+        self._remember(rev_id, text)
+        return rev_id
+
+    def text(self, rev_id):
+        """Rebuild the text of a revision"""
+        if rev_id in self._cache:
+            return self._cache[rev_id]
+        chain = []
+        revision = self.revisions[rev_id]
+        while not revision.snapshot and revision.id not in self._cache:
+            chain.append(revision)
+            revision = self.revisions[revision.parent]
+        if revision.id in self._cache:
+            text = self._cache[revision.id]
+        else:
+            text = zlib.decompress(revision.data).decode("utf-8")
+        for revision in reversed(chain):
+            text = _apply_delta(text, revision.data)
+        self._remember(rev_id, text)
+        return text
+
+    def lineage(self, rev_id):
+        """Return the revisions from rev_id back to the first one"""
+        revisions = []
+        while rev_id is not None:
+            revision = self.revisions[rev_id]
+            revisions.append(revision)
+            rev_id = revision.parent
+        return revisions
+
+    def stored_bytes(self):
+        return sum(len(r.data) for r in self.revisions.values())
+
+    def forget_texts(self):
+        """Drop the rebuilt texts; they are rebuilt from the stored revisions when next needed"""
+        self._cache = {}
+
+    def _remember(self, rev_id, text):
+        # Keep only a couple of rebuilt texts, enough to make undo and diff cheap
+        self._cache[rev_id] = text
+        while len(self._cache) > 4:
+            self._cache.pop(next(iter(self._cache)))
+
+
+class BookHistory:
+    """Chapter histories plus named branches of the whole book"""
+
+    def __init__(self):
+        self.chapters = {}
+        self.branches = {DEFAULT_BRANCH: {}}
+        # Per branch, the last revision of chapters cleared from it
+        self.cleared = {DEFAULT_BRANCH: {}}
+        self.current_branch = DEFAULT_BRANCH
+
+    @property
+    def heads(self):
+        return self.branches[self.current_branch]
+
+    @property
+    def cleared_heads(self):
+        return self.cleared.setdefault(self.current_branch, {})
+
+    def commit(self, chapter_key, text, label, fields=None):
+        """Record a new revision of a chapter on the current branch
+
+        A cleared chapter continues from its last revision. Returns the new
+        revision id, or None if the text did not change.
+        """
+        history = self.chapters.setdefault(chapter_key, ChapterHistory())
+        head = self.heads.get(chapter_key)
+        if head is None:
+            head = self.cleared_heads.pop(chapter_key, None)
+        if head is not None and history.text(head) == text:
+            self.heads[chapter_key] = head
+            return None
+        rev_id = history.add(text, parent=head, label=label, fields=fields)
+        self.heads[chapter_key] = rev_id
+        return rev_id
+
+    def forget_texts(self, chapter_key):
+        """Drop the full texts kept of a chapter's recent revisions, e.g. once the chapter is compressed"""
+        history = self.chapters.get(chapter_key)
+        if history is not None:
+            history.forget_texts()
+
+    def head_text(self, chapter_key):
+        head = self.heads.get(chapter_key)
+        return None if head is None else self.chapters[chapter_key].text(head)
+
+    def lineage(self, chapter_key):
+        """Return the revisions leading to the chapter's head on this branch"""
+        head = self.heads.get(chapter_key)
+        return [] if head is None else self.chapters[chapter_key].lineage(head)
+
+    def checkout(self, chapter_key, rev_id, label=None):
+        """Commit an earlier revision's text as the chapter's new head and return the text
+
+        The revisions after rev_id stay in the lineage, so they can be
+        restored in turn.
+        """
+        history = self.chapters[chapter_key]
+        revision = history.revisions[rev_id]
+        text = history.text(rev_id)
+        head = history.add(
+            text, parent=self.heads.get(chapter_key), label=label or f"Restored #{rev_id}",
+            fields=revision.fields, restores=revision.restores or rev_id
+        )
+        self.heads[chapter_key] = head
+        return text
+
+    def undo_target(self, chapter_key):
+        """Return the revision undo would bring back, or None
+
+        Undoing a restore steps back from the restored revision, so
+        repeated undos keep going back instead of toggling.
+        """
+        head = self.heads.get(chapter_key)
+        if head is None:
+            return None
+        revisions = self.chapters[chapter_key].revisions
+        return revisions[revisions[head].restores or head].parent
+
+    def undo(self, chapter_key):
+        """Step the chapter back to its previous revision and return its text"""
+        target = self.undo_target(chapter_key)
+        if target is None:
+            return None
+        return self.checkout(chapter_key, target, label=f"Undo to #{target}")
+
+    def clear(self, chapter_key):
+        """Take a chapter off the current branch, keeping its last revision for restore()"""
+        head = self.heads.pop(chapter_key, None)
+        if head is not None:
+            self.cleared_heads[chapter_key] = head
+
+    def restore(self, chapter_key):
+        """Put a cleared chapter back on the branch; returns (text, fields) of its last revision"""
+        head = self.cleared_heads.pop(chapter_key)
+        self.heads[chapter_key] = head
+        return self.chapters[chapter_key].text(head), self.chapters[chapter_key].revisions[head].fields
+
+    def diff(self, chapter_key, from_rev, to_rev):
+        """Return a unified diff between two revisions of a chapter"""
+        history = self.chapters[chapter_key]
+        return "".join(difflib.unified_diff(
+            history.text(from_rev).splitlines(keepends=True),
+            history.text(to_rev).splitlines(keepends=True),
+            fromfile=f"revision {from_rev}",
+            tofile=f"revision {to_rev}",
+        ))
+
+    def create_branch(self, name):
+        """Start a new branch from the current one and switch to it"""
+        if name in self.branches:
+            raise ValueError(f"Branch '{name}' already exists")
+        self.branches[name] = dict(self.heads)
+        self.cleared[name] = dict(self.cleared_heads)
+        self.current_branch = name
+
+    def switch_branch(self, name):
+        """Switch branch and return {chapter_key: (text, fields)} for its chapters"""
+        self.current_branch = name
+        return {
+            key: (self.chapters[key].text(rev_id), self.chapters[key].revisions[rev_id].fields)
+            for key, rev_id in self.heads.items()
+        }
+
+    def storage(self):
+        """Return (stored_bytes, revision_count) over all chapters"""
+        return (
+            sum(h.stored_bytes() for h in self.chapters.values()),
+            sum(len(h.revisions) for h in self.chapters.values()),
+        )
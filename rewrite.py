@@ -0,0 +1,217 @@
+"""Whole-chapter rewrite operations as a map over sections.
+
+Sending a whole chapter in one prompt is slow and the answer runs into
+the output token limit on long chapters. Instead the chapter is split at
+its headings into sections of at most SECTION_WORDS words (map), every
+section is rewritten concurrently with the same instruction, and the
+sections are joined back in order (reduce). Since each section is
+rewritten on its own, the reduce step then asks for a light edit of the
+paragraphs on either side of every boundary, so the chapter still reads
+as one piece.
+
+Each section is generated with token_budget.generate_with_continuation,
+so a section cut off by the token limit is continued rather than lost.
+"""
+import contextvars
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import prompts
+import providers
+import token_budget
+import tracing
+from markdown_tools import chunk_sections, with_padding_of
+
+SECTION_WORDS = 700
+
+# UI label -> the wording put in the instruction
+STYLE_OPTIONS = {
+    "Current": "unchanged",
+    "More formal": "more formal",
+    "More informal": "more informal",
+    "More technical": "more technical",
+    "More popular": "more accessible to a general audience",
+    "More narrative": "more narrative",
+    "More concise": "more concise",
+}
+FORMAT_OPTIONS = {
+    "Current": "unchanged",
+    "More subheadings": "more subheadings",
+    "More paragraphs": "more, shorter paragraphs",
+    "More bullet lists": "more bullet lists",
+    "More tables": "more tables",
+    "Academic format": "academic format",
+}
+
+# Keyed by UI label; instruction is formatted with the operation's options
+# and length is the expected size of the result relative to the original
+OPERATIONS = {
+    "Apply style": {
+        "instruction": (
+            "Change the style and format of the text. Writing style: {style}. Structure format: {format}. "
+            "Keep all the original information and content, but adapt the presentation and tone."
+        ),
+        "length": 1.0,
+    },
+    "Summarize and condense": {
+        "instruction": "Summarize and condense the text, keeping all the key points but cutting verbosity.",
+        "length": 0.6,
+    },
+    "Add practical examples": {
+        "instruction": (
+            "Add practical examples, case studies or realistic scenarios to make the text more concrete "
+            "and applicable, keeping the existing content."
+        ),
+        "length": 1.5,
+    },
+    "Improve readability": {
+        "instruction": (
+            "Improve the readability and clarity of the text, keeping all the information but making "
+            "the language smoother and more accessible."
+        ),
+        "length": 1.0,
+    },
+}
+
+TRANSITION_SCHEMA = {
+    "type": "object",
+    "required": ["end", "start"],
+    "properties": {"end": {"type": "string"}, "start": {"type": "string"}},
+}
+# A smoothed paragraph this much longer or shorter than the original is discarded
+TRANSITION_MAX_CHANGE = 2.0
+
+
+def instruction_for(operation, **options):
+    return OPERATIONS[operation]["instruction"].format(**options)
+
+
+def _heading(section):
+    for line in section.splitlines():
+        if line.lstrip().startswith("#"):
+            return line.strip().lstrip("#").strip()
+        if line.strip():
+            return None
+    return None
+
+
+def _prose_blocks(body):
+    """Return the indices of the prose paragraphs of a section body split on blank lines"""
+    return [
+        index for index, block in enumerate(body.split("\n\n"))
+        if block.strip() and (block.lstrip()[0].isalpha() or block.lstrip()[0] in "\"'«“")
+    ]
+
+
+def _boundaries(bodies):
+    """Return (section, block, next section, block) for every transition that can be smoothed
+
+    A paragraph is edited by at most one transition, so a section with a
+    single paragraph only takes part in the first of its two.
+    """
+    used = set()
+    pairs = []
+    for index in range(len(bodies) - 1):
+        before, after = _prose_blocks(bodies[index]), _prose_blocks(bodies[index + 1])
+        if not before or not after:
+            continue
+        end, start = (index, before[-1]), (index + 1, after[0])
+        if end in used or start in used:
+            continue
+        used.update((end, start))
+        pairs.append(end + start)
+    return pairs
+
+
+def rewrite_chapter(text, operation, book_structure, chapter_title, provider, model, options=None, smooth=True,
+                    max_workers=4, complete=providers.complete, complete_structured=providers.complete_structured,
+                    progress=None):
+    """Rewrite a chapter section by section and return (text, report)
+
+    options fill in the operation's instruction (style and format for
+    "Apply style", as values of STYLE_OPTIONS and FORMAT_OPTIONS). progress(done, total), if given, is called from the
+    calling thread as sections and transitions finish. The report has the
+    number of sections and smoothed transitions, the tokens used, how many
+    sections were still cut off, and the elapsed seconds.
+    """
+    instruction = instruction_for(operation, **(options or {}))
+    length = OPERATIONS[operation]["length"]
+    prefill = providers.supports_prefill(provider)
+    sections = chunk_sections(text, SECTION_WORDS)
+    outline = "\n    ".join(
+        f"{number}. {_heading(section) or '(chapter opening)'}" for number, section in enumerate(sections, 1)
+    )
+    report = {"sections": len(sections), "transitions": 0, "input_tokens": 0, "output_tokens": 0, "truncated": 0}
+    start = time.perf_counter()
+
+    def call(messages, max_tokens, on_text):
+        return complete(provider, model, messages, max_tokens, on_text)
+
+    def rewrite_section(number, section):
+        prompt = prompts.create_rewrite_prompt(
+            book_structure, chapter_title, instruction, section.strip(), f"{number} di {len(sections)}", outline
+        )
+        target_words = max(int(len(section.split()) * length), 50)
+        rewritten, info = token_budget.generate_with_continuation(call, prompt, model, target_words, prefill=prefill)
+        return with_padding_of(section, rewritten), info
+
+    def smooth_transition(before, after):
+        return complete_structured(
+            provider, model, prompts.create_transition_prompt(instruction, before, after),
+            token_budget.max_tokens_for(model, len(before.split()) + len(after.split())),
+            TRANSITION_SCHEMA, "transition"
+        )
+
+    rewritten = list(sections)
+    with tracing.span("rewrite.chapter", operation=operation, sections=len(sections)):
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Map: every section at once, each worker inheriting the caller's tracing context
+            futures = {
+                executor.submit(contextvars.copy_context().run, rewrite_section, number, section): number - 1
+                for number, section in enumerate(sections, 1) if section.strip()
+            }
+            total = len(futures)
+            for done, future in enumerate(as_completed(futures), 1):
+                section_text, info = future.result()
+                rewritten[futures[future]] = section_text
+                report["input_tokens"] += info["input_tokens"]
+                report["output_tokens"] += info["output_tokens"]
+                report["truncated"] += info["truncated"]
+                if progress is not None:
+                    progress(done, total)
+
+            # Reduce: smooth the paragraphs on either side of every section boundary
+            bodies = [section.strip() for section in rewritten]
+            boundaries = _boundaries(bodies) if smooth else []
+            blocks = [body.split("\n\n") for body in bodies]
+            futures = {
+                executor.submit(
+                    contextvars.copy_context().run, smooth_transition, blocks[a][i], blocks[b][j]
+                ): (a, i, b, j)
+                for a, i, b, j in boundaries
+            }
+            for done, future in enumerate(as_completed(futures), total + 1):
+                a, i, b, j = futures[future]
+                completion = future.result()
+                report["input_tokens"] += completion.input_tokens or 0
+                report["output_tokens"] += completion.output_tokens or 0
+                if progress is not None:
+                    progress(done, total + len(futures))
+                try:
+                    smoothed = json.loads(completion.text)
+                    end, start_text = smoothed["end"].strip(), smoothed["start"].strip()
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    continue
+                changes = (len(end) / max(len(blocks[a][i]), 1), len(start_text) / max(len(blocks[b][j]), 1))
+                if not end or not start_text or any(not 1 / TRANSITION_MAX_CHANGE <= c <= TRANSITION_MAX_CHANGE for c in changes):
+                    continue
+                blocks[a][i], blocks[b][j] = end, start_text
+                report["transitions"] += 1
+
+    result = "\n".join(
+        with_padding_of(section, "\n\n".join(section_blocks)) if section.strip() else section
+        for section, section_blocks in zip(rewritten, blocks)
+    )
+    report["seconds"] = round(time.perf_counter() - start, 2)
+    return result, report
@@ -0,0 +1,336 @@
+"""Checkpoints of whole-book generation runs.
+
+A run generates a set of book parts from a fixed book structure,
+provider, model and settings. Everything a resumed run needs is on disk
+in the run's directory:
+
+- ``run.json``: the structure, provider, model, chapter settings and the
+  parts to generate, plus the run status.
+- ``parts/<key>.json``: a completed part (its text, generation info and
+  inputs hash), written atomically as soon as the part is done.
+- ``partial/<key>.txt``: the text streamed so far for a part in progress.
+- ``lock``: present while the run is being executed, its mtime refreshed
+  every HEARTBEAT_SECONDS. A run whose lock is fresh cannot be executed
+  a second time, by this process or another one; a lock left behind by a
+  crash goes stale and is taken over.
+
+Resuming a run skips the completed parts and continues each interrupted
+one from its streamed text instead of starting it over, so output
+already paid for is never requested again.
+"""
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+import book_scheduler
+import providers
+import token_budget
+import tracing
+
+RUNS_DIR = os.environ.get(
+    "BOOKCREATOR_RUNS_DIR",
+    os.path.join(os.path.expanduser("~"), ".bookcreator", "runs")
+)
+
+RUN_FILE = "run.json"
+LOCK_FILE = "lock"
+HEARTBEAT_SECONDS = 10
+# A lock not refreshed for this long was left by a process that is gone
+STALE_LOCK_SECONDS = 3 * HEARTBEAT_SECONDS
+# Streamed text is flushed to disk at least this often
+PARTIAL_FLUSH_SECONDS = 1.0
+# A partial part shorter than this is not worth continuing
+MIN_PARTIAL_WORDS = 50
+
+_SAFE_KEY = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+# Serialises lock takeovers between the threads of this process
+_lock_guard = threading.Lock()
+# run.json path -> (mtime, meta), so listing runs only reads the files that changed
+_meta_cache = {}
+
+
+class RunBusyError(RuntimeError):
+    """Raised when a run is already being executed"""
+
+
+def _write_json(path, data):
+    """Write JSON atomically, so a crash never leaves a half-written file"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class PartialWriter:
+    """on_text callback appending streamed text to a part's partial file"""
+
+    def __init__(self, path):
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def __call__(self, text):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(text)
+            if time.monotonic() - self._last_flush >= PARTIAL_FLUSH_SECONDS:
+                self._file.flush()
+                self._last_flush = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class Run:
+    """A checkpointed generation run stored in its own directory"""
+
+    def __init__(self, directory, meta=None):
+        self.directory = directory
+        if meta is None:
+            with open(os.path.join(directory, RUN_FILE), encoding="utf-8") as f:
+                meta = json.load(f)
+        self.meta = meta
+
+    @classmethod
+    def create(cls, book_structure, provider, model, settings, parts, directory=None, **extra):
+        """Start a new run; directory defaults to a new run id under RUNS_DIR"""
+        run_id = uuid.uuid4().hex[:12]
+        directory = directory or os.path.join(RUNS_DIR, run_id)
+        os.makedirs(os.path.join(directory, "parts"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "partial"), exist_ok=True)
+        meta = {
+            "run_id": run_id,
+            "created": time.time(),
+            "status": "running",
+            "book_structure": book_structure,
+            "provider": provider,
+            "model": model,
+            "settings": settings,
+            "parts": sorted(parts),
+            **extra,
+        }
+        _write_json(os.path.join(directory, RUN_FILE), meta)
+        return cls(directory)
+
+    @classmethod
+    def open(cls, run_id, root=None):
+        return cls(os.path.join(root or RUNS_DIR, run_id))
+
+    @property
+    def run_id(self):
+        return self.meta["run_id"]
+
+    @property
+    def parts(self):
+        return set(self.meta["parts"])
+
+    def _part_path(self, folder, key, extension):
+        if not _SAFE_KEY.match(key):
+            raise ValueError(f"Invalid part key: {key!r}")
+        return os.path.join(self.directory, folder, f"{key}.{extension}")
+
+    def completed_keys(self):
+        """Return the set of completed parts without reading their text"""
+        try:
+            names = os.listdir(os.path.join(self.directory, "parts"))
+        except OSError:
+            return set()
+        return {name[:-len(".json")] for name in names if name.endswith(".json")} & self.parts
+
+    def completed(self):
+        """Return {part: {"text", "info", "inputs"}} for every completed part"""
+        done = {}
+        for key in self.meta["parts"]:
+            try:
+                with open(self._part_path("parts", key, "json"), encoding="utf-8") as f:
+                    done[key] = json.load(f)
+            except (OSError, ValueError):
+                continue
+        return done
+
+    def save_part(self, key, text, info, inputs=None):
+        """Checkpoint a completed part and drop its streamed text"""
+        _write_json(self._part_path("parts", key, "json"), {"text": text, "info": info, "inputs": inputs})
+        try:
+            os.remove(self._part_path("partial", key, "txt"))
+        except OSError:
+            pass
+
+    def partial_text(self, key):
+        """Return the streamed text of an interrupted part, or "" if too little to continue from"""
+        try:
+            with open(self._part_path("partial", key, "txt"), encoding="utf-8") as f:
+                text = f.read()
+        except OSError:
+            return ""
+        return text if len(text.split()) >= MIN_PARTIAL_WORDS else ""
+
+    def stream_to(self, key, resume_from=""):
+        """Return a PartialWriter for a part, starting from the text being continued"""
+        path = self._part_path("partial", key, "txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(resume_from)
+        return PartialWriter(path)
+
+    def set_status(self, status):
+        self.meta["status"] = status
+        self.meta["updated"] = time.time()
+        _write_json(os.path.join(self.directory, RUN_FILE), self.meta)
+
+    def is_active(self):
+        """Whether the run is being executed right now, here or in another process"""
+        try:
+            return time.time() - os.path.getmtime(os.path.join(self.directory, LOCK_FILE)) < STALE_LOCK_SECONDS
+        except OSError:
+            return False
+
+    def acquire(self):
+        """Take the run's lock, raising RunBusyError if it is being executed"""
+        path = os.path.join(self.directory, LOCK_FILE)
+        with _lock_guard:
+            for _ in range(2):
+                try:
+                    os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                    return
+                except FileExistsError:
+                    if self.is_active():
+                        raise RunBusyError(f"Run {self.run_id} is already being generated")
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        raise RunBusyError(f"Run {self.run_id} is already being generated")
+
+    def release(self):
+        try:
+            os.remove(os.path.join(self.directory, LOCK_FILE))
+        except OSError:
+            pass
+
+    def _heartbeat(self, stop):
+        path = os.path.join(self.directory, LOCK_FILE)
+        while not stop.wait(HEARTBEAT_SECONDS):
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+
+def execute(run, chapter_texts, on_done, max_workers=4, on_start=None, complete=providers.complete):
+    """Generate the parts of a run that are not complete yet
+
+    Parts completed by an earlier attempt are handed to on_done first,
+    without any request. The others are scheduled in dependency order;
+    each one is checkpointed from its worker thread as soon as it is done,
+    and its streamed text is kept so an interruption loses nothing.
+
+    chapter_texts() returns the current {chapter key: text} and is called
+    before the introduction or conclusion starts. on_start(part) and
+    on_done(part, record, error), where record has the part's text, info
+    and inputs, are called in the calling thread. complete has the
+    signature of providers.complete, so it can be rate limited. Returns
+    {part: exception} for the parts that failed. Raises RunBusyError if
+    the run is already being executed.
+    """
+    run.acquire()
+    stop = threading.Event()
+    threading.Thread(target=run._heartbeat, args=(stop,), name=f"run-{run.run_id}", daemon=True).start()
+    try:
+        return _execute(run, chapter_texts, on_done, max_workers, on_start, complete)
+    finally:
+        stop.set()
+        run.release()
+
+
+def _execute(run, chapter_texts, on_done, max_workers, on_start, complete):
+    book = run.meta["book_structure"]
+    provider, model = run.meta["provider"], run.meta["model"]
+    settings = run.meta["settings"]
+    prefill = providers.supports_prefill(provider)
+    early_stop = run.meta.get("early_stop")
+
+    done = run.completed()
+    for key in sorted(done, key=lambda key: key in book_scheduler.SECTIONS):
+        on_done(key, done[key], None)
+    remaining = run.parts - done.keys()
+
+    deps = book_scheduler.book_dependencies(book)
+    weights = {key: (settings.get(key) or {}).get("word_count") or book_scheduler.SECTION_TARGET_WORDS for key in deps}
+    scheduler = book_scheduler.DagScheduler(deps, weights, max_workers=max_workers)
+
+    def call(messages, max_tokens, on_text):
+        return complete(provider, model, messages, max_tokens, on_text)
+
+    def prepare(key):
+        texts, inputs = {}, None
+        if key in book_scheduler.SECTIONS:
+            texts = chapter_texts()
+            brief = book_scheduler.section_brief(book, key)
+            inputs = book_scheduler.section_inputs(book, key, brief, texts)
+        prompt, target_words = book_scheduler.part_request(book, key, settings, texts)
+        partial = run.partial_text(key)
+        if on_start is not None:
+            on_start(key)
+
+        def job():
+            writer = run.stream_to(key, partial)
+            try:
+                text, info = token_budget.generate_with_continuation(
+                    call, prompt, model, target_words, prefill=prefill, on_text=writer, partial=partial,
+                    early_stop=early_stop
+                )
+            finally:
+                writer.close()
+            run.save_part(key, text, info, inputs)
+            return {"text": text, "info": info, "inputs": inputs}
+        return job
+
+    with tracing.span("run.execute", run=run.run_id, parts=len(remaining), resumed=len(done)):
+        _, errors = scheduler.run(remaining, prepare, on_done)
+    run.set_status("failed" if errors else "complete")
+    return errors
+
+
+def _cached_meta(directory):
+    path = os.path.join(directory, RUN_FILE)
+    mtime = os.path.getmtime(path)
+    cached = _meta_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, encoding="utf-8") as f:
+            cached = (mtime, json.load(f))
+        _meta_cache[path] = cached
+    return cached[1]
+
+
+def list_runs(root=None, include_complete=False, project_id=None):
+    """Return the runs under root, most recent first
+
+    With project_id, only the runs started for that project. Only the
+    run files changed since the last listing are read again.
+    """
+    root = root or RUNS_DIR
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return []
+    found = []
+    for name in names:
+        directory = os.path.join(root, name)
+        try:
+            meta = _cached_meta(directory)
+        except (OSError, ValueError):
+            continue
+        if project_id is not None and meta.get("project_id") != project_id:
+            continue
+        if include_complete or meta["status"] != "complete":
+            found.append(Run(directory, dict(meta)))
+    return sorted(found, key=lambda run: run.meta["created"], reverse=True)
@@ -0,0 +1,109 @@
+"""JSON schemas for book data and a small validator for them.
+
+Only the subset of JSON Schema the app needs is supported: type,
+required, properties, items, minItems and minLength.
+"""
+
+CHAPTER_OUTLINE_SCHEMA = {
+    "type": "object",
+    "required": ["number", "title", "description"],
+    "properties": {
+        "number": {"type": "integer"},
+        "title": {"type": "string", "minLength": 1},
+        "description": {"type": "string"},
+    },
+}
+
+BOOK_STRUCTURE_SCHEMA = {
+    "type": "object",
+    "required": ["title", "introduction", "chapters", "conclusion"],
+    "properties": {
+        "title": {"type": "string", "minLength": 1},
+        "introduction": {"type": "string"},
+        "chapters": {"type": "array", "minItems": 1, "items": CHAPTER_OUTLINE_SCHEMA},
+        "conclusion": {"type": "string"},
+    },
+}
+
+GENERATED_CHAPTER_SCHEMA = {
+    "type": "object",
+    "required": ["number", "title", "content"],
+    "properties": {
+        "number": {"type": "integer"},
+        "title": {"type": "string"},
+        "content": {"type": "string"},
+        "generated_at": {"type": "string"},
+        "last_edited": {"type": "string"},
+        "metadata": {"type": "object"},
+    },
+}
+
+BOOK_CONTENT_CHAPTER_SCHEMA = {
+    "type": "object",
+    "required": ["title", "content"],
+    "properties": {
+        "title": {"type": "string"},
+        "content": {"type": "string"},
+        "copied_at": {"type": "string"},
+    },
+}
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool,
+    "null": type(None),
+}
+
+
+def strict_schema(schema):
+    """Return a copy of a schema in the form OpenAI's strict structured outputs accept
+
+    Every property becomes required, extra properties are forbidden and
+    keywords the strict mode does not support are dropped.
+    """
+    strict = {k: v for k, v in schema.items() if k not in ("minLength", "minItems")}
+    if "properties" in schema:
+        strict["properties"] = {name: strict_schema(sub) for name, sub in schema["properties"].items()}
+        strict["required"] = list(schema["properties"])
+        strict["additionalProperties"] = False
+    if "items" in schema:
+        strict["items"] = strict_schema(schema["items"])
+    return strict
+
+
+def validate(value, schema, path="$"):
+    """Return a list of validation errors, empty if the value matches the schema"""
+    expected = schema.get("type")
+    if expected is not None:
+        types = expected if isinstance(expected, list) else [expected]
+        if not any(_is_type(value, t) for t in types):
+            return [f"{path}: expected {' or '.join(types)}, got {type(value).__name__}"]
+
+    errors = []
+    if isinstance(value, dict):
+        for name in schema.get("required", []):
+            if name not in value:
+                errors.append(f"{path}: missing required field '{name}'")
+        for name, subschema in schema.get("properties", {}).items():
+            if name in value:
+                errors += validate(value[name], subschema, f"{path}.{name}")
+    elif isinstance(value, list):
+        if len(value) < schema.get("minItems", 0):
+            errors.append(f"{path}: expected at least {schema['minItems']} items")
+        if "items" in schema:
+            for i, item in enumerate(value):
+                errors += validate(item, schema["items"], f"{path}[{i}]")
+    elif isinstance(value, str):
+        if len(value) < schema.get("minLength", 0):
+            errors.append(f"{path}: must not be empty")
+    return errors
+
+
+def _is_type(value, name):
+    if name in ("integer", "number") and isinstance(value, bool):
+        return False
+    return isinstance(value, _TYPES[name])
@@ -0,0 +1,310 @@
+"""Positional inverted index for searching and replacing across the book.
+
+Every document (a generated chapter, a chapter of the final book, the
+introduction or the conclusion) is tokenised once when it changes. The
+index maps each token to the documents and token positions where it
+occurs, and keeps the character span of every token so matches can be
+highlighted and replaced without scanning the text again.
+
+A document can be released: its text and token spans are dropped but its
+postings kept, so it is still found without its text in memory. Searches
+read the text of a released document again, through a load(doc_id)
+callback, only when the document matches.
+
+Run this module directly to benchmark it on a synthetic 300k-word book.
+"""
+import hashlib
+import re
+from array import array
+
+_TOKEN = re.compile(r"\w+")
+_QUERY_PART = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def tokenize(text):
+    """Yield (token, start, end) for every word in a text"""
+    for match in _TOKEN.finditer(text):
+        yield match.group().lower(), match.start(), match.end()
+
+
+def parse_query(query):
+    """Split a query into phrases: quoted text is one phrase, other words are single-word phrases"""
+    phrases = []
+    for quoted, word in _QUERY_PART.findall(query):
+        tokens = [token for token, _, _ in tokenize(quoted if quoted else word)]
+        if tokens:
+            phrases.append(tokens)
+    return phrases
+
+
+class _Document:
+    __slots__ = ("text", "hash", "starts", "ends")
+
+    def __init__(self, text):
+        self.text = text
+        self.hash = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        self.starts = array("I")
+        self.ends = array("I")
+
+    def restore(self, text):
+        """Put back the text and token spans of a released document"""
+        self.text = text
+        for _, start, end in tokenize(text):
+            self.starts.append(start)
+            self.ends.append(end)
+
+
+class SearchIndex:
+    """Inverted index with positional postings, updated one document at a time"""
+
+    def __init__(self):
+        self.documents = {}
+        self.postings = {}
+
+    def __contains__(self, doc_id):
+        return doc_id in self.documents
+
+    def update(self, doc_id, text):
+        """Index a document, doing nothing if its text is unchanged"""
+        text = text or ""
+        previous = self.documents.get(doc_id)
+        document = _Document(text)
+        if previous is not None:
+            if previous.hash == document.hash:
+                if previous.text is None:
+                    previous.restore(text)
+                return False
+            self.remove(doc_id)
+
+        positions = {}
+        for position, (token, start, end) in enumerate(tokenize(text)):
+            document.starts.append(start)
+            document.ends.append(end)
+            positions.setdefault(token, array("I")).append(position)
+        for token, token_positions in positions.items():
+            self.postings.setdefault(token, {})[doc_id] = token_positions
+        self.documents[doc_id] = document
+        return True
+
+    def remove(self, doc_id):
+        """Drop a document from the index"""
+        document = self.documents.pop(doc_id, None)
+        if document is None:
+            return
+        if document.text is None:
+            # Released: its tokens are only known from the postings
+            tokens = [token for token, docs in self.postings.items() if doc_id in docs]
+        else:
+            tokens = [token for token, _, _ in tokenize(document.text)]
+        for token in tokens:
+            docs = self.postings.get(token)
+            if docs is not None:
+                docs.pop(doc_id, None)
+                if not docs:
+                    del self.postings[token]
+
+    def release(self, doc_id):
+        """Drop a document's text and token spans, keeping its postings so it is still found"""
+        document = self.documents.get(doc_id)
+        if document is not None:
+            document.text = None
+            document.starts = array("I")
+            document.ends = array("I")
+
+    def clear(self):
+        """Drop every document; the next sync indexes them again"""
+        self.documents = {}
+        self.postings = {}
+
+    def memory_bytes(self):
+        """Return roughly how many bytes the index holds: texts, token spans and postings"""
+        total = 0
+        for document in self.documents.values():
+            total += len(document.text or "") + document.starts.itemsize * (len(document.starts) + len(document.ends))
+        for docs in self.postings.values():
+            # Per-posting dict entry overhead, roughly
+            total += sum(positions.itemsize * len(positions) + 100 for positions in docs.values())
+        return total
+
+    def sync(self, documents, load=None):
+        """Bring the index in line with a {doc_id: text} mapping
+
+        A text of None stands for a document not held in memory, unchanged
+        since it was last indexed. It is read with load(doc_id) only if it
+        is not indexed yet, and then released.
+        """
+        for doc_id in list(self.documents):
+            if doc_id not in documents:
+                self.remove(doc_id)
+        for doc_id, text in documents.items():
+            if text is not None:
+                self.update(doc_id, text)
+            elif doc_id not in self.documents:
+                self.update(doc_id, load(doc_id))
+                self.release(doc_id)
+
+    def _load(self, doc_ids, load):
+        """Read back the text of the released documents among doc_ids; True if any had changed"""
+        changed = False
+        for doc_id in doc_ids:
+            if self.documents[doc_id].text is None:
+                changed = self.update(doc_id, load(doc_id)) or changed
+        return changed
+
+    def phrase_matches(self, tokens):
+        """Return {doc_id: [(first_position, last_position), ...]} for a token phrase"""
+        postings = [self.postings.get(token) for token in tokens]
+        if not tokens or any(p is None for p in postings):
+            return {}
+        rarest = min(range(len(tokens)), key=lambda i: len(postings[i]))
+        candidates = set(postings[rarest])
+        for docs in postings:
+            candidates.intersection_update(docs)
+
+        matches = {}
+        for doc_id in candidates:
+            if len(tokens) == 1:
+                found = [(p, p) for p in postings[0][doc_id]]
+            else:
+                following = [set(docs[doc_id]) for docs in postings[1:]]
+                found = [
+                    (p, p + len(tokens) - 1)
+                    for p in postings[0][doc_id]
+                    if all(p + offset in positions for offset, positions in enumerate(following, 1))
+                ]
+            if found:
+                matches[doc_id] = found
+        return matches
+
+    def search(self, query, load=None):
+        """Return {doc_id: [(start_char, end_char), ...]} for documents matching every phrase of a query
+
+        Released documents that match are read back with load(doc_id).
+        """
+        phrases = parse_query(query)
+        if not phrases:
+            return {}
+
+        def matching():
+            per_phrase = [self.phrase_matches(tokens) for tokens in phrases]
+            doc_ids = set(per_phrase[0])
+            for matches in per_phrase[1:]:
+                doc_ids.intersection_update(matches)
+            return per_phrase, doc_ids
+
+        per_phrase, doc_ids = matching()
+        if self._load(doc_ids, load):
+            per_phrase, doc_ids = matching()
+
+        results = {}
+        for doc_id in doc_ids:
+            document = self.documents[doc_id]
+            spans = sorted(
+                (document.starts[first], document.ends[last])
+                for matches in per_phrase
+                for first, last in matches[doc_id]
+            )
+            results[doc_id] = spans
+        return results
+
+    def snippets(self, doc_id, spans, context=60, limit=5):
+        """Return Markdown snippets of a document with the matches in bold"""
+        text = self.documents[doc_id].text
+        snippets = []
+        for start, end in spans[:limit]:
+            left = max(0, start - context)
+            right = min(len(text), end + context)
+            snippet = (
+                ("…" if left else "")
+                + text[left:start]
+                + "**" + text[start:end] + "**"
+                + text[end:right]
+                + ("…" if right < len(text) else "")
+            )
+            snippets.append(" ".join(snippet.split()))
+        return snippets
+
+    def replace(self, phrase, replacement, texts=None, match_case=True, load=None):
+        """Replace every occurrence of a phrase and return {doc_id: new_text} for the documents that changed
+
+        The postings only find candidates: a match is replaced only where the
+        original text equals the phrase exactly, punctuation and spacing
+        included, so "U.S." leaves "US" alone. match_case=False ignores case
+        in that comparison.
+
+        The index itself is not touched; callers store the new texts and
+        then update() each changed document. texts maps every doc_id to its
+        current text: a document whose indexed text is out of date is
+        indexed again first, so the new text is never built from an old one.
+        texts and load are as for sync(); released documents that match are
+        read back with load(doc_id).
+        """
+        if texts is not None:
+            self.sync(texts, load)
+        phrase_tokens = list(tokenize(phrase))
+        if not phrase_tokens:
+            return {}
+        tokens = [token for token, _, _ in phrase_tokens]
+        # Text of the phrase around its first and last word, e.g. the final dot of "U.S."
+        lead = phrase_tokens[0][1]
+        trail = len(phrase) - phrase_tokens[-1][2]
+        wanted = phrase if match_case else phrase.casefold()
+        candidates = self.phrase_matches(tokens)
+        if self._load(candidates, load):
+            candidates = self.phrase_matches(tokens)
+        changed = {}
+        for doc_id, matches in candidates.items():
+            document = self.documents[doc_id]
+            parts = []
+            cursor = 0
+            for first, last in sorted(matches):
+                start, end = document.starts[first] - lead, document.ends[last] + trail
+                if start < cursor:
+                    continue
+                found = document.text[start:end]
+                if (found if match_case else found.casefold()) != wanted:
+                    continue
+                parts.append(document.text[cursor:start])
+                parts.append(replacement)
+                cursor = end
+            parts.append(document.text[cursor:])
+            new_text = "".join(parts)
+            if new_text != document.text:
+                changed[doc_id] = new_text
+        return changed
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    random.seed(0)
+    vocabulary = [f"word{i}" for i in range(5000)]
+    chapters = {
+        f"chapter_{n}": " ".join(random.choice(vocabulary) for _ in range(15_000)) + " the quick brown fox"
+        for n in range(1, 21)
+    }
+    total_words = sum(len(text.split()) for text in chapters.values())
+
+    index = SearchIndex()
+    start = time.perf_counter()
+    index.sync(chapters)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index.update("chapter_1", chapters["chapter_1"] + " one more sentence")
+    update_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(100):
+        index.search('word42 "quick brown fox"')
+    query_time = (time.perf_counter() - start) / 100
+
+    start = time.perf_counter()
+    changed = index.replace("quick brown fox", "slow red fox")
+    replace_time = time.perf_counter() - start
+
+    print(f"Indexed {total_words:,} words in {build_time * 1000:.0f} ms")
+    print(f"Re-indexing one chapter: {update_time * 1000:.1f} ms")
+    print(f"Phrase query: {query_time * 1000:.2f} ms")
+    print(f"Bulk replace: {replace_time * 1000:.1f} ms ({len(changed)} chapters changed)")
@@ -0,0 +1,219 @@
+"""Memory management of the app's sessions.
+
+On a shared server most memory is held by the session state of users who
+left a tab open. Two things keep it down, both built on the lazy chapter
+bodies of project_store (a chapter whose "content" is None is loaded again
+by project_store.load_body on first use):
+
+- Cold chapters: at the end of every script run, a chapter body that has
+  not been used for COLD_AFTER_RUNS runs, and is not the chapter open in
+  the editor, is kept zlib-compressed until it is used again. The copies
+  of its text held by the search indexes and caches are dropped with it,
+  or compressing would free nothing; the indexes keep their postings and
+  vectors, so searching does not decompress it.
+- Idle sessions: a background thread saves every session idle for
+  IDLE_SECONDS to its project archive and drops its chapter bodies and
+  search indexes. The next run of the session picks up the archive, and
+  chapters and indexes come back as they are used. A session is never
+  evicted while a script run is in progress.
+
+report() and totals() give the memory held per session and across
+sessions, and what compression and eviction saved.
+"""
+import os
+import sys
+import threading
+import time
+import weakref
+
+import project_store
+import tracing
+
+IDLE_SECONDS = float(os.environ.get("BOOKCREATOR_IDLE_SECONDS", "900"))
+# Idle sessions are looked for this often
+SWEEP_SECONDS = 60
+COLD_AFTER_RUNS = 3
+COMPRESS_LEVEL = 6
+
+SHOW_IN_SIDEBAR = os.environ.get("BOOKCREATOR_MEMORY_PANEL", "").lower() in ("1", "true", "yes")
+
+SECTIONS = ("chapters", "book_content")
+
+_sessions = weakref.WeakSet()
+_sessions_lock = threading.Lock()
+_sweeper = None
+
+
+class SessionMemory:
+    """The book data of one session, as far as memory management is concerned
+
+    The app hands over references to its book data at the start and end of
+    every script run; between runs the background thread may evict them.
+    """
+
+    def __init__(self):
+        self.archive = None
+        self.runs = 0
+        self.busy = False
+        self.last_seen = time.time()
+        self.evicted = False
+        self.evictions = 0
+        self._book = None
+        self._indexes = ()
+        self._last_used = {}
+        # Uncompressed size of every chapter kept compressed or evicted
+        self._raw_bytes = {}
+        self._lock = threading.RLock()
+        _register(self)
+
+    def _chapters(self):
+        for section in SECTIONS:
+            for key, chapter in (self._book or {}).get(section, {}).items():
+                yield (section, str(key)), chapter
+
+    def _attach(self, book, indexes):
+        self._book = book
+        self._indexes = tuple(index for index in indexes if index is not None)
+
+    def begin_run(self, book, indexes):
+        """Mark the session active; returns the archive to read evicted chapters from, or None
+
+        book has book_structure, book_details, chapters, book_content and
+        the project_path it is saved to; indexes are derived indexes with
+        clear() and memory_bytes().
+        """
+        with self._lock:
+            self.busy = True
+            self.runs += 1
+            self.last_seen = time.time()
+            self._attach(book, indexes)
+            if not self.evicted:
+                return None
+            self.evicted = False
+            return self.archive
+
+    def end_run(self, book, indexes, hot=(), release=None):
+        """Compress the chapters that have gone cold, then mark the session idle
+
+        hot lists (section, key) pairs never to compress, e.g. the chapter
+        open in the editor. release(section, key) is called for every
+        chapter compressed, to drop the other references to its text
+        (index documents, cached revisions); they are rebuilt on demand.
+        """
+        with self._lock:
+            self._attach(book, indexes)
+            for chapter_id, chapter in self._chapters():
+                if chapter.get("content") is None:
+                    continue
+                # Text set directly replaces any compressed copy
+                chapter.pop("compressed_content", None)
+                if chapter_id in hot or chapter_id in self._raw_bytes:
+                    # Open, or decompressed during this run: in use
+                    self._last_used[chapter_id] = self.runs
+                    self._raw_bytes.pop(chapter_id, None)
+                    continue
+                last_used = self._last_used.setdefault(chapter_id, self.runs)
+                if self.runs - last_used >= COLD_AFTER_RUNS:
+                    self._raw_bytes[chapter_id] = project_store.compress_body(chapter, COMPRESS_LEVEL)
+                    if release is not None:
+                        release(*chapter_id)
+            self.busy = False
+            self.last_seen = time.time()
+
+    def evict_if_idle(self, now=None):
+        """Save an idle session to its project archive and drop its chapter bodies and indexes"""
+        now = now or time.time()
+        with self._lock:
+            if self.busy or self.evicted or now - self.last_seen < IDLE_SECONDS or not self._book:
+                return False
+            if self._book.get("book_structure") is None:
+                return False
+            with tracing.span("session.evict", idle_seconds=round(now - self.last_seen)):
+                path = self._book["project_path"]
+                manifest = project_store.save_project(
+                    path, self._book["book_structure"], self._book["book_details"],
+                    self._book["chapters"], self._book["book_content"]
+                )
+                self.archive = project_store.ProjectArchive(path)
+                for (section, key), chapter in self._chapters():
+                    record = manifest[section].get(key)
+                    if record is None:
+                        continue
+                    body = project_store.unsaved_body(chapter)
+                    if body is not None:
+                        self._raw_bytes[(section, key)] = len(body.encode("utf-8"))
+                    chapter["archive_entry"] = record["entry"]
+                    chapter["content"] = None
+                    chapter.pop("compressed_content", None)
+                for index in self._indexes:
+                    index.clear()
+            self.evicted = True
+            self.evictions += 1
+            return True
+
+    def report(self):
+        """Return the bytes held and saved by this session's book data"""
+        with self._lock:
+            loaded = compressed = evicted = saved = 0
+            for chapter_id, chapter in self._chapters():
+                if chapter.get("content") is not None:
+                    loaded += len(chapter["content"].encode("utf-8"))
+                elif chapter.get("compressed_content") is not None:
+                    compressed += len(chapter["compressed_content"])
+                    saved += self._raw_bytes.get(chapter_id, 0) - len(chapter["compressed_content"])
+                elif chapter_id in self._raw_bytes:
+                    evicted += self._raw_bytes[chapter_id]
+                    saved += self._raw_bytes[chapter_id]
+            indexes = sum(index.memory_bytes() for index in self._indexes)
+            return {
+                "chapter_bytes": loaded,
+                "compressed_bytes": compressed,
+                "index_bytes": indexes,
+                "resident_bytes": loaded + compressed + indexes,
+                "evicted_bytes": evicted,
+                "saved_bytes": saved,
+                "evicted": self.evicted,
+                "idle_seconds": round(time.time() - self.last_seen),
+            }
+
+
+def _register(memory):
+    global _sweeper
+    with _sessions_lock:
+        _sessions.add(memory)
+        if _sweeper is None:
+            _sweeper = threading.Thread(target=_sweep, name="session-memory", daemon=True)
+            _sweeper.start()
+
+
+def _sweep():
+    while True:
+        time.sleep(SWEEP_SECONDS)
+        with _sessions_lock:
+            sessions = list(_sessions)
+        for memory in sessions:
+            try:
+                memory.evict_if_idle()
+            except Exception as e:
+                print(f"[session_memory] eviction failed: {type(e).__name__}: {e}", file=sys.stderr, flush=True)
+
+
+def project_paths():
+    """Return the project archives of every live session, which must not be pruned"""
+    with _sessions_lock:
+        sessions = list(_sessions)
+    return {memory._book["project_path"] for memory in sessions if memory._book}
+
+
+def totals():
+    """Return the memory report summed over every live session"""
+    with _sessions_lock:
+        sessions = list(_sessions)
+    summary = {"sessions": len(sessions), "evicted_sessions": 0}
+    for memory in sessions:
+        for field, value in memory.report().items():
+            if field == "evicted":
+                summary["evicted_sessions"] += value
+            elif field != "idle_seconds":
+                summary[field] = summary.get(field, 0) + value
+    return summary
@@ -0,0 +1,97 @@
+"""Startup-time probe for the Streamlit app.
+
+app.py reports how long its imports and its first full render took in
+this process. The first run after a deploy or restart is the cold start
+users feel. It is written once to stderr, so it shows up in the service
+logs. Set BOOKCREATOR_STARTUP_PROBE=1 to also show the timings in the
+sidebar.
+
+Run this module directly to time the import of each dependency in a
+fresh interpreter, e.g. as a deploy check:
+
+    python startup_probe.py --max-ms 1500
+"""
+import os
+import subprocess
+import sys
+import time
+
+SHOW_IN_SIDEBAR = os.environ.get("BOOKCREATOR_STARTUP_PROBE") == "1"
+
+# Modules imported on every rerun of app.py
+HOT_PATH_MODULES = [
+    "streamlit", "book_export", "book_scheduler", "book_stats", "cost_estimate", "project_import", "project_store",
+    "prompts", "provider_journal", "providers", "revisions", "rewrite", "runs", "search_index", "session_memory", "structure_generation", "token_budget",
+    "tracing", "translation",
+]
+# Imported only when first needed: the provider SDKs when a provider is
+# called, numpy when repeated content is checked
+LAZY_MODULES = ["openai", "anthropic", "numpy"]
+
+_probe_loaded_at = time.perf_counter()
+cold_start = None
+last_run = None
+lazy_imports = {}
+
+
+def record_run(script_start, imports_done):
+    """Record the timings of a completed script run"""
+    global cold_start, last_run
+    now = time.perf_counter()
+    last_run = {
+        "imports_ms": (imports_done - script_start) * 1000,
+        "render_ms": (now - script_start) * 1000,
+    }
+    if cold_start is None:
+        cold_start = dict(last_run, since_process_ms=(now - _probe_loaded_at) * 1000)
+        print(
+            f"[startup] cold start: imports {cold_start['imports_ms']:.0f} ms, "
+            f"first render {cold_start['render_ms']:.0f} ms",
+            file=sys.stderr, flush=True
+        )
+
+
+def record_lazy_import(name, seconds):
+    """Record the one-off cost of a deferred SDK import"""
+    if name not in lazy_imports:
+        lazy_imports[name] = seconds * 1000
+        print(f"[startup] lazy import of {name}: {seconds * 1000:.0f} ms", file=sys.stderr, flush=True)
+
+
+def measure_import(module):
+    """Return the time in ms to import a module in a fresh interpreter, or None if it is missing"""
+    code = (
+        "import time; t = time.perf_counter(); "
+        f"import {module}; print((time.perf_counter() - t) * 1000)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if result.returncode != 0:
+        return None
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Measure BookCreator import times")
+    parser.add_argument("--max-ms", type=float, help="fail if the hot-path imports take longer than this")
+    args = parser.parse_args()
+
+    hot_total = 0.0
+    for group, modules in (("hot path", HOT_PATH_MODULES), ("lazy", LAZY_MODULES)):
+        for module in modules:
+            elapsed = measure_import(module)
+            if elapsed is None:
+                print(f"{group:<9} {module:<16} not installed")
+                continue
+            print(f"{group:<9} {module:<16} {elapsed:8.1f} ms")
+            if group == "hot path":
+                hot_total += elapsed
+    # Each module is timed on its own, so shared imports are counted more than once
+    print(f"hot path total (upper bound): {hot_total:.1f} ms")
+    if args.max_ms is not None and hot_total > args.max_ms:
+        print(f"Cold-start budget exceeded: {hot_total:.1f} ms > {args.max_ms:.1f} ms")
+        sys.exit(1)
@@ -0,0 +1,111 @@
+"""Book structure generation with structured output.
+
+The structure is requested through each provider's native structured
+output: a JSON schema response format on OpenAI and a forced tool call
+on Anthropic. Models without either fall back to the JSON described in
+the prompt. Every result is validated locally against
+schemas.BOOK_STRUCTURE_SCHEMA. A failed attempt is retried
+automatically, and every request is logged so the retry rate can be
+tracked.
+"""
+import json
+import os
+import time
+
+import providers
+import schemas
+import token_budget
+import tracing
+
+SCHEMA_NAME = "book_structure"
+MAX_ATTEMPTS = 2
+# Output budget of a structure response, in words
+TARGET_WORDS = 1500
+
+_retry_stats = {"mtime": None, "stats": None}
+
+
+class StructureGenerationError(Exception):
+    """Raised when no valid structure could be obtained"""
+
+    def __init__(self, message, response=None):
+        super().__init__(message)
+        self.response = response
+
+
+def parse_structure(text):
+    """Parse a structure response, tolerating Markdown code fences around the JSON"""
+    json_str = text
+    if "```json" in text:
+        json_str = text.split("```json")[1].split("```")[0].strip()
+    elif "```" in text:
+        json_str = text.split("```")[1].strip()
+    return json.loads(json_str)
+
+
+def generate_structure(provider, model, prompt, max_tokens, max_attempts=MAX_ATTEMPTS,
+                       complete=providers.complete_structured, info=None):
+    """Return a validated book structure dict
+
+    complete has the signature of providers.complete_structured, so callers
+    can wrap it, e.g. in a rate limiter. If info is a dict, it is filled
+    with the number of attempts and the tokens used. Raises
+    StructureGenerationError, carrying the last raw response, when every
+    attempt failed.
+    """
+    if info is None:
+        info = {}
+    info.update(attempts=0, input_tokens=0, output_tokens=0)
+    last_error = None
+    response = None
+    for attempt in range(1, max_attempts + 1):
+        start = time.perf_counter()
+        completion = complete(provider, model, prompt, max_tokens, schemas.BOOK_STRUCTURE_SCHEMA, SCHEMA_NAME)
+        info["attempts"] = attempt
+        info["input_tokens"] += completion.input_tokens or 0
+        info["output_tokens"] += completion.output_tokens or 0
+        response = completion.text
+        with tracing.span("structure.parse", attempt=attempt) as parse_span:
+            try:
+                structure = parse_structure(response)
+                errors = schemas.validate(structure, schemas.BOOK_STRUCTURE_SCHEMA)
+            except (ValueError, IndexError) as e:
+                errors = [f"invalid JSON: {e}"]
+            valid = not errors
+            parse_span.set(valid=valid)
+        token_budget.record_usage(
+            model, len(response.split()), completion.output_tokens, completion.input_tokens,
+            time.perf_counter() - start, kind="structure", attempt=attempt, valid=valid
+        )
+        if valid:
+            return structure
+        last_error = "; ".join(errors[:5])
+    raise StructureGenerationError(f"Invalid structure after {max_attempts} attempts: {last_error}", response)
+
+
+def retry_stats():
+    """Return how often structure requests needed a retry or failed outright
+
+    The usage log is only read again when it has changed.
+    """
+    try:
+        mtime = os.path.getmtime(token_budget.USAGE_FILE)
+    except OSError:
+        mtime = None
+    if _retry_stats["stats"] is None or mtime != _retry_stats["mtime"]:
+        _retry_stats["stats"] = _count_retries()
+        _retry_stats["mtime"] = mtime
+    return _retry_stats["stats"]
+
+
+def _count_retries():
+    attempts = [r for r in token_budget.read_usage() if r.get("kind") == "structure"]
+    requests = sum(1 for r in attempts if r.get("attempt") == 1)
+    retried = sum(1 for r in attempts if r.get("attempt") == 2)
+    failed_first = sum(1 for r in attempts if r.get("attempt") == 1 and not r.get("valid"))
+    return {
+        "requests": requests,
+        "retried": retried,
+        "first_attempt_failures": failed_first,
+        "retry_rate": retried / requests if requests else 0.0,
+    }
@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+import batch_runner
+
+
+def _manifest(tmp_path, rows):
+    path = tmp_path / "books.jsonl"
+    path.write_text("\n".join(json.dumps(row) for row in rows) + "\n", encoding="utf-8")
+    return str(path)
+
+
+BOOK = {"title": "Time Management", "theme": "Focus", "audience": "Teams"}
+
+
+def test_defaults_and_generated_ids(tmp_path):
+    specs = batch_runner.read_manifest(_manifest(tmp_path, [BOOK, dict(BOOK, title="Second Book!", chapter_words="900")]))
+    assert [spec["id"] for spec in specs] == ["001-time-management", "002-second-book"]
+    assert specs[1]["chapter_words"] == 900
+    assert specs[0]["model"]
+
+
+def test_csv_manifest(tmp_path):
+    path = tmp_path / "books.csv"
+    path.write_text("title,theme,audience,id\nA Book,Theme,Readers,a-book\n", encoding="utf-8")
+    assert batch_runner.read_manifest(str(path))[0]["id"] == "a-book"
+
+
+@pytest.mark.parametrize("book_id", ["../escape", "/etc/passwd", "Upper", "has space", "x" * 61])
+def test_ids_that_are_not_slugs_are_rejected_with_their_line(tmp_path, book_id):
+    path = _manifest(tmp_path, [BOOK, dict(BOOK, id=book_id)])
+    with pytest.raises(ValueError, match=r":2: id .* must be 1-60 lowercase letters, digits or dashes"):
+        batch_runner.read_manifest(path)
+
+
+def test_duplicate_ids_and_missing_fields_name_the_line(tmp_path):
+    with pytest.raises(ValueError, match="already used on line 1"):
+        batch_runner.read_manifest(_manifest(tmp_path, [dict(BOOK, id="same"), dict(BOOK, id="same")]))
+    with pytest.raises(ValueError, match=":1: missing audience"):
+        batch_runner.read_manifest(_manifest(tmp_path, [{"title": "T", "theme": "X"}]))
+    with pytest.raises(ValueError, match="unknown provider"):
+        batch_runner.read_manifest(_manifest(tmp_path, [dict(BOOK, provider="Nobody")]))
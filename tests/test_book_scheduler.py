@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+import book_scheduler
+from book_scheduler import DagScheduler, DependencyError
+
+
+def _deps(chapters=3):
+    structure = {"chapters": [{"number": n} for n in range(1, chapters + 1)]}
+    return book_scheduler.book_dependencies(structure)
+
+
+def test_sections_run_after_every_chapter():
+    deps = _deps()
+    finished = []
+    lock = threading.Lock()
+
+    def prepare(key):
+        # prepare runs once the dependencies are done, so they must all be finished
+        assert deps[key] <= set(finished)
+
+        def job():
+            with lock:
+                finished.append(key)
+            return key.upper()
+
+        return job
+
+    results, errors = DagScheduler(deps, max_workers=2).run(deps, prepare)
+    assert errors == {}
+    assert results["introduction"] == "INTRODUCTION"
+    assert set(finished[-2:]) == set(book_scheduler.SECTIONS)
+
+
+def test_longest_chain_goes_first():
+    deps = {"a": set(), "b": set(), "c": {"b"}}
+    order = []
+    scheduler = DagScheduler(deps, max_workers=1)
+    scheduler.run(deps, lambda key: order.append(key) or (lambda: None))
+    assert order == ["b", "a", "c"]
+
+
+def test_failure_skips_dependents_only():
+    deps = _deps(2)
+
+    def prepare(key):
+        def job():
+            if key == "chapter_1":
+                raise RuntimeError("provider down")
+            return key
+
+        return job
+
+    results, errors = DagScheduler(deps).run(deps, prepare)
+    assert set(results) == {"chapter_2"}
+    assert isinstance(errors["chapter_1"], RuntimeError)
+    assert all(isinstance(errors[section], DependencyError) for section in book_scheduler.SECTIONS)
+
+
+def test_dependencies_outside_the_run_count_as_done():
+    deps = _deps(2)
+    results, errors = DagScheduler(deps).run({"conclusion"}, lambda key: lambda: key)
+    assert results == {"conclusion": "conclusion"}
+
+
+def test_invalidate_marks_everything_downstream():
+    assert book_scheduler.invalidate(_deps(2), {"chapter_1"}) == {"chapter_1", "introduction", "conclusion"}
+    assert book_scheduler.invalidate(_deps(2), {"introduction"}) == {"introduction"}
+
+
+def test_cycles_and_unknown_parts_are_rejected():
+    with pytest.raises(ValueError, match="cycle"):
+        DagScheduler({"a": {"b"}, "b": {"a"}})
+    with pytest.raises(ValueError, match="unknown parts"):
+        DagScheduler({"a": {"missing"}})
@@ -0,0 +1,121 @@
+import io
+import json
+import zipfile
+
+import pytest
+
+import project_import
+import project_store
+
+STRUCTURE = {
+    "title": "Imported Book",
+    "introduction": "Intro",
+    "conclusion": "End",
+    "chapters": [{"number": n, "title": f"Chapter {n}", "description": ""} for n in (1, 2)],
+}
+
+
+class _ShortReads(io.BytesIO):
+    """A file returning a few bytes per read, so values and characters are split across chunks"""
+
+    def read(self, size=-1):
+        return super().read(min(size, 7) if size and size > 0 else 7)
+
+
+def _import(tmp_path, project):
+    data = project if isinstance(project, bytes) else json.dumps(project, ensure_ascii=False).encode("utf-8")
+    path = str(tmp_path / f"imported.{project_store.FILE_EXTENSION}")
+    report = project_import.import_json_project(_ShortReads(data), path, len(data))
+    return path, report
+
+
+def test_valid_chapters_are_imported(tmp_path):
+    project = {
+        "book_structure": STRUCTURE,
+        "generated_chapters": {
+            "chapter_1": {"number": 1, "title": "Chapter 1", "content": "Prima parte è già qui. " * 100},
+            "chapter_2": {"number": 2, "title": "Chapter 2", "content": "Seconda parte."},
+        },
+        "book_content": {"1": {"title": "Chapter 1", "content": "Final text."}},
+        "version": "1.0",
+    }
+    path, report = _import(tmp_path, project)
+
+    assert report["imported"] == 3
+    assert report["quarantined"] == []
+    assert report["error"] is None
+    assert report["fields"] == {"version": "1.0"}
+    archive = project_store.ProjectArchive(path)
+    assert archive.structure["book_structure"] == STRUCTURE
+    chapters = archive.generated_chapters()
+    assert project_store.load_body(archive, chapters["chapter_1"]) == "Prima parte è già qui. " * 100
+    assert project_store.load_body(archive, archive.book_content()[1]) == "Final text."
+
+
+def test_invalid_chapters_are_quarantined_and_kept(tmp_path):
+    broken = {"number": "2", "title": "Chapter 2"}
+    project = {
+        "book_structure": STRUCTURE,
+        "generated_chapters": {
+            "chapter_1": {"number": 1, "title": "Chapter 1", "content": "Fine."},
+            "chapter_2": broken,
+        },
+        "book_content": {"first": {"title": "Chapter 1", "content": "Final text."}},
+    }
+    path, report = _import(tmp_path, project)
+
+    assert report["imported"] == 1
+    assert [(q["section"], q["key"]) for q in report["quarantined"]] == [
+        ("generated_chapters", "chapter_2"), ("book_content", "first")
+    ]
+    assert any("number" in error for error in report["quarantined"][0]["errors"])
+    assert any("chapter number" in error for error in report["quarantined"][1]["errors"])
+
+    archive = project_store.ProjectArchive(path)
+    assert list(archive.generated_chapters()) == ["chapter_1"]
+    assert archive.book_content() == {}
+    quarantined = archive.manifest["quarantined"]
+    assert len(quarantined) == 2
+    with zipfile.ZipFile(path) as zf:
+        assert json.loads(zf.read(quarantined[0]["entry"])) == broken
+
+
+def test_quarantine_survives_later_saves_and_compaction(tmp_path):
+    project = {
+        "book_structure": STRUCTURE,
+        "generated_chapters": {"chapter_1": {"number": "x", "title": "Bad", "content": "Text"}},
+    }
+    path, _ = _import(tmp_path, project)
+    for n in range(4):
+        generated = {"chapter_1": {"number": 1, "title": "Chapter 1", "content": f"Draft {n}\n" * 1000}}
+        project_store.save_project(path, STRUCTURE, {}, generated, {})
+    project_store.compact(path)
+
+    archive = project_store.ProjectArchive(path)
+    entry = archive.manifest["quarantined"][0]["entry"]
+    with zipfile.ZipFile(path) as zf:
+        assert json.loads(zf.read(entry))["title"] == "Bad"
+
+
+def test_truncated_file_keeps_chapters_before_the_damage(tmp_path):
+    project = {
+        "book_structure": STRUCTURE,
+        "generated_chapters": {
+            "chapter_1": {"number": 1, "title": "Chapter 1", "content": "Complete."},
+            "chapter_2": {"number": 2, "title": "Chapter 2", "content": "Cut off " * 50},
+        },
+    }
+    data = json.dumps(project).encode("utf-8")
+    path, report = _import(tmp_path, data[:-200])
+
+    assert report["imported"] == 1
+    assert report["error"].startswith("Import stopped early")
+    assert list(project_store.ProjectArchive(path).generated_chapters()) == ["chapter_1"]
+
+
+def test_missing_or_invalid_structure_is_rejected(tmp_path):
+    with pytest.raises(project_store.ProjectFormatError):
+        _import(tmp_path, {"generated_chapters": {}})
+    with pytest.raises(project_store.ProjectFormatError):
+        _import(tmp_path, {"book_structure": {"title": "No chapters"}})
+    assert not (tmp_path / f"imported.{project_store.FILE_EXTENSION}").exists()
@@ -0,0 +1,152 @@
+import os
+import zipfile
+
+import pytest
+
+import project_store
+
+
+def _book(chapters=3):
+    structure = {
+        "title": "Test Book",
+        "introduction": "Intro",
+        "conclusion": "End",
+        "chapters": [{"number": n, "title": f"Chapter {n}", "description": ""} for n in range(1, chapters + 1)],
+    }
+    generated = {
+        f"chapter_{n}": {"number": n, "title": f"Chapter {n}", "content": f"Text of chapter {n}.\n" * 50}
+        for n in range(1, chapters + 1)
+    }
+    return structure, generated
+
+
+def _names(path):
+    with zipfile.ZipFile(path) as archive:
+        return archive.namelist()
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / f"book.{project_store.FILE_EXTENSION}")
+
+
+def test_round_trip_loads_bodies_lazily(path):
+    structure, generated = _book()
+    project_store.save_project(path, structure, {"style": "plain"}, generated, {1: dict(generated["chapter_1"])})
+
+    archive = project_store.ProjectArchive(path)
+    assert archive.structure["book_structure"] == structure
+    chapters = archive.generated_chapters()
+    assert all(chapter["content"] is None for chapter in chapters.values())
+    assert chapters["chapter_2"]["title"] == "Chapter 2"
+    assert project_store.load_body(archive, chapters["chapter_2"]) == generated["chapter_2"]["content"]
+    book = archive.book_content()
+    assert project_store.load_body(archive, book[1]) == generated["chapter_1"]["content"]
+
+
+def test_save_appends_only_changed_chapters(path):
+    structure, generated = _book()
+    project_store.save_project(path, structure, {}, generated, {})
+    before = set(_names(path))
+
+    generated["chapter_2"]["content"] += "One more line.\n"
+    manifest = project_store.save_project(path, structure, {}, generated, {})
+    added = set(_names(path)) - before
+
+    assert added == {"manifests/000002.json", manifest["chapters"]["chapter_2"]["entry"]}
+    assert manifest["chapters"]["chapter_2"]["revision"] == 2
+    archive = project_store.ProjectArchive(path)
+    assert archive.sequence == 2
+    assert archive.read_body(manifest["chapters"]["chapter_2"]["entry"]).endswith("One more line.\n")
+
+
+def test_unloaded_chapters_keep_their_entry(path):
+    structure, generated = _book()
+    first = project_store.save_project(path, structure, {}, generated, {})
+    archive = project_store.ProjectArchive(path)
+    lazy = archive.generated_chapters()
+    lazy["chapter_1"]["title"] = "Renamed"
+
+    manifest = project_store.save_project(path, structure, {}, lazy, {})
+    assert manifest["chapters"]["chapter_1"]["entry"] == first["chapters"]["chapter_1"]["entry"]
+    assert manifest["chapters"]["chapter_1"]["fields"]["title"] == "Renamed"
+
+
+def test_compressed_chapter_is_saved_and_peeked_without_loading(path):
+    structure, generated = _book(1)
+    chapter = generated["chapter_1"]
+    text = chapter["content"]
+    project_store.compress_body(chapter)
+    assert chapter["content"] is None
+
+    project_store.save_project(path, structure, {}, generated, {})
+    archive = project_store.ProjectArchive(path)
+    assert project_store.peek_body(archive, chapter) == text
+    assert chapter["content"] is None
+    assert project_store.load_body(archive, archive.generated_chapters()["chapter_1"]) == text
+
+
+def test_compaction_drops_superseded_entries(path):
+    structure, generated = _book(1)
+    for n in range(6):
+        generated["chapter_1"]["content"] = f"Version {n}\n" * 2000
+        manifest = project_store.save_project(path, structure, {}, generated, {})
+
+        # Saving compacts as soon as superseded entries take up most of the file
+        assert project_store._dead_ratio(path, manifest) <= project_store.COMPACT_RATIO
+    assert len([n for n in _names(path) if n.startswith("chapters/")]) < 6
+
+    project_store.compact(path)
+    names = _names(path)
+    assert [n for n in names if n.startswith("manifests/")] == ["manifests/000006.json"]
+    assert [n for n in names if n.startswith("chapters/")] == [manifest["chapters"]["chapter_1"]["entry"]]
+    archive = project_store.ProjectArchive(path)
+    assert archive.read_body(manifest["chapters"]["chapter_1"]["entry"]) == "Version 5\n" * 2000
+
+    # Revisions keep counting up after compaction, so entry names are never reused
+    generated["chapter_1"]["content"] = "Version 6\n"
+    manifest = project_store.save_project(path, structure, {}, generated, {})
+    assert manifest["chapters"]["chapter_1"]["revision"] == 7
+
+
+def test_removed_chapter_written_again_gets_a_new_entry(path):
+    structure, generated = _book(2)
+    first = project_store.save_project(path, structure, {}, generated, {})
+    chapter = generated.pop("chapter_2")
+    project_store.save_project(path, structure, {}, generated, {})
+    chapter["content"] = "Rewritten.\n"
+    generated["chapter_2"] = chapter
+
+    manifest = project_store.save_project(path, structure, {}, generated, {})
+    assert manifest["chapters"]["chapter_2"]["entry"] != first["chapters"]["chapter_2"]["entry"]
+    archive = project_store.ProjectArchive(path)
+    assert archive.read_body(manifest["chapters"]["chapter_2"]["entry"]) == "Rewritten.\n"
+
+
+def test_invalid_archives_are_rejected(tmp_path):
+    not_zip = tmp_path / "broken.bcproj"
+    not_zip.write_text("not a zip")
+    with pytest.raises(project_store.ProjectFormatError):
+        project_store.ProjectArchive(str(not_zip))
+
+    other = tmp_path / "other.bcproj"
+    with zipfile.ZipFile(other, "w") as archive:
+        archive.writestr("manifests/000001.json", '{"format": "something-else"}')
+    with pytest.raises(project_store.ProjectFormatError):
+        project_store.ProjectArchive(str(other))
+
+
+def test_prune_keeps_archives_in_use(tmp_path, monkeypatch):
+    monkeypatch.setattr(project_store, "PROJECTS_DIR", str(tmp_path))
+    structure, generated = _book(1)
+    paths = []
+    for n in range(3):
+        paths.append(str(tmp_path / f"{n}.{project_store.FILE_EXTENSION}"))
+        project_store.save_project(paths[-1], structure, {}, generated, {})
+    old = 1_000_000
+    for path in paths:
+        os.utime(path, (old, old))
+
+    assert project_store.prune_projects(keep=[paths[0]]) == 2
+    assert os.path.exists(paths[0])
+    assert not os.path.exists(paths[1])
@@ -0,0 +1,100 @@
+import revisions
+from revisions import BookHistory, ChapterHistory
+
+
+def _versions(count):
+    lines = [f"Line {n} of the chapter.\n" for n in range(40)]
+    texts = []
+    for n in range(count):
+        lines[n % len(lines)] = f"Line {n % len(lines)} edited in version {n}.\n"
+        texts.append("".join(lines))
+    return texts
+
+
+def test_every_revision_is_rebuilt_from_snapshots_and_deltas():
+    history = ChapterHistory()
+    texts = _versions(revisions.SNAPSHOT_INTERVAL * 2 + 3)
+    parent = None
+    for text in texts:
+        parent = history.add(text, parent=parent)
+
+    stored = list(history.revisions.values())
+    assert any(not r.snapshot for r in stored)
+    # A chain of deltas is broken by a snapshot every SNAPSHOT_INTERVAL revisions
+    assert sum(r.snapshot for r in stored) >= 3
+    assert max(r.depth for r in stored) < revisions.SNAPSHOT_INTERVAL
+
+    history.forget_texts()
+    for rev_id, text in enumerate(texts, 1):
+        assert history.text(rev_id) == text
+
+
+def test_small_edits_are_stored_as_deltas():
+    history = ChapterHistory()
+    texts = _versions(5)
+    parent = None
+    for text in texts:
+        parent = history.add(text, parent=parent)
+    assert history.stored_bytes() < len(texts[0]) * 2
+
+
+def test_commit_skips_unchanged_text():
+    book = BookHistory()
+    assert book.commit("chapter_1", "First draft.\n", "Generated") == 1
+    assert book.commit("chapter_1", "First draft.\n", "Saved") is None
+    assert book.head_text("chapter_1") == "First draft.\n"
+
+
+def test_undo_keeps_going_back_and_loses_nothing():
+    book = BookHistory()
+    for n in range(1, 4):
+        book.commit("chapter_1", f"Version {n}\n", f"Edit {n}")
+
+    assert book.undo("chapter_1") == "Version 2\n"
+    # Undoing a restore steps back further instead of toggling
+    assert book.undo("chapter_1") == "Version 1\n"
+    assert book.undo("chapter_1") is None
+    # Every text is still in the lineage, newest first
+    texts = [book.chapters["chapter_1"].text(r.id) for r in book.lineage("chapter_1")]
+    assert texts[0] == "Version 1\n"
+    assert "Version 3\n" in texts
+
+
+def test_checkout_commits_the_old_text_as_a_new_head():
+    book = BookHistory()
+    book.commit("chapter_1", "One\n", "Generated", {"title": "A"})
+    book.commit("chapter_1", "Two\n", "Edited", {"title": "B"})
+
+    assert book.checkout("chapter_1", 1) == "One\n"
+    head = book.heads["chapter_1"]
+    assert head == 3
+    revision = book.chapters["chapter_1"].revisions[head]
+    assert revision.restores == 1
+    assert revision.fields == {"title": "A"}
+    assert book.checkout("chapter_1", 2) == "Two\n"
+
+
+def test_cleared_chapter_can_be_restored_or_continued():
+    book = BookHistory()
+    book.commit("chapter_1", "Draft\n", "Generated", {"title": "A"})
+    book.clear("chapter_1")
+    assert book.head_text("chapter_1") is None
+    assert book.restore("chapter_1") == ("Draft\n", {"title": "A"})
+
+    book.clear("chapter_1")
+    rev_id = book.commit("chapter_1", "Regenerated\n", "Generated")
+    assert book.chapters["chapter_1"].revisions[rev_id].parent == 1
+
+
+def test_branches_share_unedited_chapters():
+    book = BookHistory()
+    book.commit("chapter_1", "Shared\n", "Generated")
+    book.commit("chapter_2", "Main\n", "Generated")
+    book.create_branch("alternative")
+    book.commit("chapter_2", "Alternative\n", "Edited")
+
+    main = book.switch_branch(revisions.DEFAULT_BRANCH)
+    assert main["chapter_1"][0] == "Shared\n"
+    assert main["chapter_2"][0] == "Main\n"
+    alternative = book.switch_branch("alternative")
+    assert alternative["chapter_2"][0] == "Alternative\n"
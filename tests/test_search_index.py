@@ -0,0 +1,76 @@
+from search_index import SearchIndex, parse_query
+
+
+def _index(documents):
+    index = SearchIndex()
+    index.sync(documents)
+    return index
+
+
+def test_query_phrases_and_words():
+    assert parse_query('brown "Quick, fox" jumps') == [["brown"], ["quick", "fox"], ["jumps"]]
+    index = _index({"a": "The quick brown fox.", "b": "A brown dog. Quick fox!"})
+    assert index.search('"quick brown"') == {"a": [(4, 15)]}
+    assert set(index.search("quick brown")) == {"a", "b"}
+    assert index.search('"brown quick"') == {}
+
+
+def test_replace_matches_the_literal_phrase_only():
+    index = _index({"a": "The U.S. and the US, or u s. U.S. again."})
+    assert index.replace("U.S.", "United States") == {
+        "a": "The United States and the US, or u s. United States again."
+    }
+
+
+def test_replace_keeps_punctuation_between_words():
+    index = _index({"a": "Quick, brown fox. Quick brown fox."})
+    assert index.replace("Quick brown", "Slow red") == {"a": "Quick, brown fox. Slow red fox."}
+
+
+def test_replace_is_case_sensitive_unless_asked():
+    index = _index({"a": "Quick brown fox. quick brown fox."})
+    assert index.replace("quick brown", "slow") == {"a": "Quick brown fox. slow fox."}
+    assert index.replace("quick brown", "slow", match_case=False) == {"a": "slow fox. slow fox."}
+
+
+def test_replace_leaves_the_index_to_the_caller():
+    index = _index({"a": "old text", "b": "nothing here"})
+    changed = index.replace("old", "new")
+    assert changed == {"a": "new text"}
+    assert index.search("old") == {"a": [(0, 3)]}
+    index.update("a", changed["a"])
+    assert index.search("old") == {}
+    assert index.search("new") == {"a": [(0, 3)]}
+
+
+def test_replace_reindexes_stale_documents_first():
+    index = _index({"a": "one old word"})
+    changed = index.replace("old", "new", texts={"a": "two old words and old"})
+    assert changed == {"a": "two new words and new"}
+
+
+def test_released_documents_are_found_and_loaded_only_on_a_match():
+    texts = {"a": "alpha beta", "b": "gamma delta"}
+    loaded = []
+
+    def load(doc_id):
+        loaded.append(doc_id)
+        return texts[doc_id]
+
+    index = _index(texts)
+    index.release("a")
+    index.release("b")
+    assert index.search("zeta", load=load) == {}
+    assert loaded == []
+    assert index.search("delta", load=load) == {"b": [(6, 11)]}
+    assert loaded == ["b"]
+    assert index.snippets("b", [(6, 11)]) == ["gamma **delta**"]
+    assert index.replace("alpha", "omega", texts={"a": None, "b": None}, load=load) == {"a": "omega beta"}
+
+
+def test_removing_a_released_document_drops_its_postings():
+    index = _index({"a": "shared only", "b": "shared"})
+    index.release("a")
+    index.remove("a")
+    assert "only" not in index.postings
+    assert index.search("shared") == {"b": [(0, 6)]}
@@ -0,0 +1,74 @@
+import pytest
+
+import providers
+import token_budget
+
+
+@pytest.fixture(autouse=True)
+def usage_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(token_budget, "USAGE_FILE", str(tmp_path / "usage.jsonl"))
+
+
+def test_splice_drops_the_repeated_overlap():
+    text = "The first part of the chapter ends with this sentence."
+    continuation = "ends with this sentence. And the chapter goes on."
+    assert token_budget.splice(text, continuation) == (
+        "The first part of the chapter ends with this sentence. And the chapter goes on."
+    )
+
+
+def test_splice_adds_a_space_after_a_sentence_and_not_inside_a_word():
+    assert token_budget.splice("One sentence.", "Another one.") == "One sentence. Another one."
+    assert token_budget.splice("A half-wri", "tten word") == "A half-written word"
+    assert token_budget.splice("Text", "") == "Text"
+
+
+def _calls(*answers):
+    """Return a provider call answering with the given (text, truncated) pairs, and the messages it got"""
+    received = []
+
+    def call(messages, max_tokens, on_text):
+        text, truncated = answers[len(received)]
+        received.append(messages)
+        return providers.Completion(text, "length" if truncated else "stop", truncated, 10, 100)
+
+    return call, received
+
+
+def test_cut_off_text_is_continued_and_spliced():
+    call, received = _calls(
+        ("Chapter start. The middle of the sentence is", True),
+        ("The middle of the sentence is finished here.", False),
+    )
+    text, info = token_budget.generate_with_continuation(call, "Write", "some-model", 500, prefill=True)
+
+    assert text == "Chapter start. The middle of the sentence is finished here."
+    assert info["rounds"] == 2
+    assert info["truncated"] is False
+    assert info["output_tokens"] == 200
+    # With prefill the partial text is the trailing assistant turn
+    assert received[1][-1] == {"role": "assistant", "content": "Chapter start. The middle of the sentence is"}
+
+
+def test_without_prefill_the_model_is_asked_to_continue():
+    call, received = _calls(("Cut", True), ("off.", False))
+    token_budget.generate_with_continuation(call, "Write", "some-model", 500, prefill=False)
+    assert received[1][-1] == {"role": "user", "content": token_budget.CONTINUE_INSTRUCTION}
+
+
+def test_still_cut_off_after_max_rounds_is_reported():
+    call, _ = _calls(*[(f"Part {n}.", True) for n in range(3)])
+    text, info = token_budget.generate_with_continuation(call, "Write", "some-model", 500, max_rounds=3)
+    assert text == "Part 0. Part 1. Part 2."
+    assert info["rounds"] == 3
+    assert info["truncated"] is True
+
+
+def test_resuming_continues_from_the_partial_text():
+    call, received = _calls((" and the rest.", False))
+    text, info = token_budget.generate_with_continuation(
+        call, "Write", "some-model", 500, prefill=True, partial="Streamed before the crash "
+    )
+    assert text == "Streamed before the crash and the rest."
+    assert info["resumed_words"] == 4
+    assert received[0][-1]["content"] == "Streamed before the crash"
@@ -0,0 +1,318 @@
+"""Output token budgets derived from word targets, and auto-continuation.
+
+The max_tokens of a request is estimated from the number of words wanted
+and the model's words-per-token ratio. The ratio starts from a default
+per model and is calibrated from the usage of past calls, which is
+appended to a local JSONL file. Past USAGE_MAX_BYTES the file is
+compacted to the latest records of each kind and model, which is all the
+calibration reads. When a response still stops because of
+the token limit, generate_with_continuation asks the model to carry on
+and splices the parts together.
+
+Models tend to run well past a word target. With early_stop, a streamed
+generation is cancelled at the first paragraph end once the text passes
+the target by the given tolerance, and the tokens and time this saved are
+estimated from how far past their target earlier generations ran.
+"""
+import json
+import math
+import os
+import threading
+import time
+
+USAGE_FILE = os.environ.get(
+    "BOOKCREATOR_USAGE_FILE",
+    os.path.join(os.path.expanduser("~"), ".bookcreator", "usage.jsonl")
+)
+
+# Words per output token before any calibration data exists. The prompts
+# are partly Italian, which tokenises less efficiently than English.
+DEFAULT_WORDS_PER_TOKEN = 0.7
+MODEL_WORDS_PER_TOKEN = {
+    "gpt-4o": 0.72,
+    "gpt-4-turbo-preview": 0.7,
+    "gpt-4": 0.7,
+    "claude-3-5-sonnet-20241022": 0.68,
+    "claude-3-opus-20240229": 0.68,
+    "claude-3-sonnet-20240229": 0.68,
+}
+
+# Largest max_tokens each model accepts for its output
+DEFAULT_OUTPUT_LIMIT = 4096
+MODEL_OUTPUT_LIMITS = {
+    "gpt-4o": 16384,
+    "gpt-4-turbo-preview": 4096,
+    "gpt-4": 4096,
+    "claude-3-5-sonnet-20241022": 8192,
+    "claude-3-opus-20240229": 4096,
+    "claude-3-sonnet-20240229": 4096,
+}
+
+# Extra room over the estimate, so an ordinary overshoot is not cut off
+HEADROOM = 1.3
+MIN_TOKENS = 256
+
+# Only calls with at least this many output tokens are used for calibration
+CALIBRATION_MIN_TOKENS = 200
+CALIBRATION_WINDOW = 50
+
+# The usage log is compacted past this size, keeping USAGE_KEEP records per kind and model
+USAGE_MAX_BYTES = int(float(os.environ.get("BOOKCREATOR_USAGE_MAX_MB", "1")) * 1024 * 1024)
+# Enough that every calibration window is still full when short calls are mixed in
+USAGE_KEEP = 4 * CALIBRATION_WINDOW
+
+CONTINUE_INSTRUCTION = (
+    "Your previous answer was cut off. Continue the text exactly where it stops, "
+    "without repeating anything and without any preamble."
+)
+
+# Length of a generation relative to its word target, before calibration
+DEFAULT_OVERSHOOT = 1.4
+# Default tolerance above the word target for early stopping
+EARLY_STOP_TOLERANCE = 0.1
+
+_usage_lock = threading.Lock()
+# Size of the log after the last compaction; with many models it may stay above USAGE_MAX_BYTES
+_compacted_bytes = 0
+_calibration = {"mtime": None, "ratios": {}, "overshoot": {}}
+
+
+def record_usage(model, output_words, output_tokens, input_tokens=None, seconds=None, kind="text", **extra):
+    """Append the usage of one provider call to the usage log"""
+    if not output_tokens and not extra:
+        return
+    record = {
+        "time": time.time(),
+        "model": model,
+        "kind": kind,
+        "output_words": output_words,
+        "output_tokens": output_tokens,
+        "input_tokens": input_tokens,
+        "seconds": seconds,
+        **extra,
+    }
+    with _usage_lock:
+        os.makedirs(os.path.dirname(USAGE_FILE), exist_ok=True)
+        with open(USAGE_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            size = f.tell()
+        if size > max(USAGE_MAX_BYTES, 2 * _compacted_bytes):
+            _compact_usage()
+
+
+def _compact_usage():
+    """Rewrite the usage log with only the latest USAGE_KEEP records of each kind and model"""
+    global _compacted_bytes
+    counts = {}
+    kept = []
+    for record in reversed(read_usage()):
+        group = (record.get("kind", "text"), record.get("model"))
+        counts[group] = counts.get(group, 0) + 1
+        if counts[group] <= USAGE_KEEP:
+            kept.append(record)
+    tmp_path = f"{USAGE_FILE}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.writelines(json.dumps(record) + "\n" for record in reversed(kept))
+    os.replace(tmp_path, USAGE_FILE)
+    _compacted_bytes = os.path.getsize(USAGE_FILE)
+
+
+def read_usage():
+    """Return every record of the usage log"""
+    try:
+        with open(USAGE_FILE, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except (OSError, ValueError):
+        return []
+
+
+def _calibrate():
+    """Recompute the calibrated ratios when the usage log has changed"""
+    try:
+        mtime = os.path.getmtime(USAGE_FILE)
+    except OSError:
+        mtime = None
+    if mtime == _calibration["mtime"]:
+        return
+    samples, generations = {}, {}
+    for record in read_usage():
+        kind = record.get("kind", "text")
+        if kind == "text" and (record["output_tokens"] or 0) >= CALIBRATION_MIN_TOKENS:
+            samples.setdefault(record["model"], []).append(record)
+        # Only generations left to finish on their own show how far models overshoot
+        elif kind == "generation" and not record.get("stopped_early") and record.get("target_words"):
+            generations.setdefault(record["model"], []).append(record)
+    _calibration["ratios"] = {
+        name: sum(r["output_words"] for r in recent) / sum(r["output_tokens"] for r in recent)
+        for name, records in samples.items()
+        for recent in [records[-CALIBRATION_WINDOW:]]
+    }
+    _calibration["overshoot"] = {
+        name: sum(r["output_words"] for r in recent) / sum(r["target_words"] for r in recent)
+        for name, records in generations.items()
+        for recent in [records[-CALIBRATION_WINDOW:]]
+    }
+    _calibration["mtime"] = mtime
+
+
+def words_per_token(model):
+    """Return the words-per-token ratio of a model, calibrated from past usage"""
+    _calibrate()
+    return _calibration["ratios"].get(model) or MODEL_WORDS_PER_TOKEN.get(model, DEFAULT_WORDS_PER_TOKEN)
+
+
+def overshoot(model):
+    """Return how long a model's generations run relative to their word target, calibrated from past usage"""
+    _calibrate()
+    return _calibration["overshoot"].get(model) or DEFAULT_OVERSHOOT
+
+
+def output_limit(model):
+    return MODEL_OUTPUT_LIMITS.get(model, DEFAULT_OUTPUT_LIMIT)
+
+
+def max_tokens_for(model, target_words):
+    """Return the max_tokens to request for roughly target_words of output"""
+    estimate = math.ceil(target_words / words_per_token(model) * HEADROOM)
+    return min(max(estimate, MIN_TOKENS), output_limit(model))
+
+
+def continuation_messages(prompt, partial, prefill):
+    """Return the messages asking a model to continue a cut-off answer
+
+    Providers that support it get the partial text as a trailing assistant
+    message, which they continue verbatim. The others are asked to continue
+    in a new turn.
+    """
+    messages = [{"role": "user", "content": prompt}, {"role": "assistant", "content": partial}]
+    if not prefill:
+        messages.append({"role": "user", "content": CONTINUE_INSTRUCTION})
+    return messages
+
+
+def splice(text, continuation, max_overlap=300):
+    """Join a continuation onto text, dropping any repeated overlap"""
+    if not continuation:
+        return text
+    for size in range(min(max_overlap, len(text), len(continuation)), 19, -1):
+        if text.endswith(continuation[:size]):
+            return text + continuation[size:]
+    if text and continuation[0].isalnum() and text[-1] in ".!?:;,)":
+        return text + " " + continuation
+    return text + continuation
+
+
+class EarlyStop:
+    """Streaming callback that asks for the stream to stop at the first paragraph end past a word limit
+
+    Text is forwarded to on_text up to that paragraph end, and the call
+    returns True there, which tells the provider call to stop streaming.
+    It also returns True whenever on_text does, e.g. when the reader left.
+    words counts the words written before this stream. Paragraph ends
+    inside code blocks or right after a heading do not count.
+    """
+
+    def __init__(self, limit, on_text=None, words=0):
+        self.limit = limit
+        self.on_text = on_text
+        self.words = words
+        self.text = ""
+        # Length of the streamed text to keep, once stopped
+        self.kept = None
+        self._counted = 0
+
+    def __call__(self, text):
+        if self.kept is not None:
+            return True
+        position = len(self.text)
+        self.text += text
+        end = self.text.rfind("\n") + 1
+        if end > self._counted:
+            # Counting up to a line break never splits a word
+            self.words += len(self.text[self._counted:end].split())
+            self._counted = end
+            if self.words >= self.limit and self._paragraph_end(end):
+                self.kept = end
+                text = self.text[position:end]
+        cancelled = self.on_text is not None and text and self.on_text(text)
+        return bool(cancelled) or self.kept is not None
+
+    def _paragraph_end(self, end):
+        kept = self.text[:end]
+        if not kept.endswith("\n\n") or kept.count("```") % 2:
+            return False
+        last_block = kept.strip().rsplit("\n\n", 1)[-1]
+        return not last_block.lstrip().startswith("#")
+
+
+def generate_with_continuation(call, prompt, model, target_words, prefill=False, max_rounds=4, on_text=None,
+                               partial="", early_stop=None):
+    """Generate about target_words of text, continuing past token-limit cut-offs
+
+    call(messages, max_tokens, on_text) must return a providers.Completion.
+    partial is text already generated for the prompt, e.g. streamed before
+    a crash; generation then continues from it instead of starting over.
+    early_stop, if given, is the tolerance above target_words (0.1 for
+    10%) past which the text is cut at the next paragraph end.
+    Returns (text, info) where info has the number of rounds, the total
+    tokens and whether the text was still cut off at the end; a text cut
+    by early_stop also has the estimated tokens and seconds saved.
+    """
+    messages = prompt
+    budget = max_tokens_for(model, target_words)
+    text = ""
+    info = {"rounds": 0, "input_tokens": 0, "output_tokens": 0, "truncated": False, "max_tokens": budget}
+    if partial:
+        text = partial.rstrip()
+        info["resumed_words"] = len(text.split())
+        budget = max_tokens_for(model, max(target_words - info["resumed_words"], target_words // 5))
+        messages = continuation_messages(prompt, text, prefill)
+    started = time.perf_counter()
+    while True:
+        start = time.perf_counter()
+        stop = None
+        if early_stop is not None:
+            stop = EarlyStop(math.ceil(target_words * (1 + early_stop)), on_text, len(text.split()))
+        completion = call(messages, budget, stop or on_text)
+        if stop is not None and stop.kept is not None:
+            # Tokens of a cancelled stream are not reported; estimate them from the text kept
+            kept = completion.text[:stop.kept]
+            completion = completion._replace(
+                text=kept, truncated=False,
+                output_tokens=completion.output_tokens or round(len(kept.split()) / words_per_token(model))
+            )
+            info["stopped_early"] = True
+        record_usage(
+            model, len(completion.text.split()), completion.output_tokens,
+            completion.input_tokens, time.perf_counter() - start
+        )
+        info["rounds"] += 1
+        info["input_tokens"] += completion.input_tokens or 0
+        info["output_tokens"] += completion.output_tokens or 0
+        text = splice(text, completion.text) if text else completion.text
+        info["truncated"] = completion.truncated
+        if not completion.truncated or info["rounds"] >= max_rounds:
+            _finish_generation(model, prompt, target_words, text, info, time.perf_counter() - started)
+            return text, info
+
+        # Prefilled assistant turns must not end with whitespace
+        text = text.rstrip()
+        remaining = max(target_words - len(text.split()), target_words // 5)
+        budget = max_tokens_for(model, remaining)
+        messages = continuation_messages(prompt, text, prefill)
+
+
+def _finish_generation(model, prompt, target_words, text, info, seconds):
+    """Log a whole generation and, if it was stopped early, estimate what that saved"""
+    words = len(text.split())
+    prompt_words = len((prompt if isinstance(prompt, str) else " ".join(m["content"] for m in prompt)).split())
+    stopped = info.get("stopped_early", False)
+    if stopped and info["output_tokens"]:
+        saved_words = max(target_words * overshoot(model) - words, 0)
+        info["saved_tokens"] = round(saved_words / words_per_token(model))
+        info["saved_seconds"] = round(info["saved_tokens"] * seconds / info["output_tokens"], 1)
+    record_usage(
+        model, words, info["output_tokens"], info["input_tokens"], seconds,
+        kind="generation", target_words=target_words, prompt_words=prompt_words, stopped_early=stopped,
+        rounds=info["rounds"]
+    )
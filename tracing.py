@@ -0,0 +1,280 @@
+"""Lightweight tracing with OTLP-compatible export.
+
+Spans are timed with time.time_ns() and nest through a context variable,
+so a provider call made while a screen renders becomes a child of that
+screen's span. Finished traces are exported in the OTLP/JSON encoding:
+
+- BOOKCREATOR_TRACE_FILE: append one ExportTraceServiceRequest per line,
+  the format of the OpenTelemetry collector's file exporter.
+- BOOKCREATOR_OTLP_ENDPOINT: POST the same payload to an OTLP/HTTP
+  collector, e.g. http://localhost:4318/v1/traces.
+
+Export happens on a background thread, so it never delays a rerun.
+BOOKCREATOR_TRACE_PANEL=1 keeps the recent spans in memory for the
+"slowest spans" panel in the sidebar. With none of these set, span() is a
+no-op.
+"""
+import contextvars
+import json
+import os
+import queue
+import secrets
+import sys
+import threading
+import time
+import urllib.request
+from collections import deque
+
+SERVICE_NAME = "bookcreator"
+TRACE_FILE = os.environ.get("BOOKCREATOR_TRACE_FILE")
+OTLP_ENDPOINT = os.environ.get("BOOKCREATOR_OTLP_ENDPOINT")
+SHOW_PANEL = os.environ.get("BOOKCREATOR_TRACE_PANEL") == "1"
+ENABLED = bool(TRACE_FILE or OTLP_ENDPOINT or SHOW_PANEL)
+
+# Spans kept in memory for the debug panel
+RECENT_SPANS = 2000
+# Spans of an unfinished trace exported in one batch at most
+MAX_BATCH = 512
+
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+
+_current = contextvars.ContextVar("bookcreator_span", default=None)
+_recent = deque(maxlen=RECENT_SPANS)
+_pending = []
+_pending_lock = threading.Lock()
+_export_queue = queue.Queue()
+_exporter = None
+
+
+class Span:
+    """A timed operation; use span() or start_span() to create one"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attributes", "start_ns", "end_ns", "status", "message")
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = STATUS_UNSET
+        self.message = None
+
+    @property
+    def duration_ms(self):
+        end_ns = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def fail(self, error):
+        self.status = STATUS_ERROR
+        self.message = f"{type(error).__name__}: {error}"
+
+    def end(self, **attributes):
+        """Finish the span; ending it a second time does nothing"""
+        if self.end_ns is not None:
+            return
+        self.attributes.update(attributes)
+        self.end_ns = time.time_ns()
+        _finish(self)
+
+
+class _NoopSpan:
+    """Returned while tracing is disabled, so call sites need no checks"""
+
+    name = None
+    duration_ms = 0.0
+
+    def set(self, **attributes):
+        pass
+
+    def fail(self, error):
+        pass
+
+    def end(self, **attributes):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class span:
+    """Context manager timing the enclosed block as a child of the current span"""
+
+    def __init__(self, name, parent=None, **attributes):
+        self._name = name
+        self._parent = parent
+        self._attributes = attributes
+        self._span = None
+        self._token = None
+
+    def __enter__(self):
+        if not ENABLED:
+            return _NOOP
+        parent = self._parent or _current.get()
+        self._span = Span(self._name, parent, self._attributes)
+        self._token = _current.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._span is None:
+            return False
+        _current.reset(self._token)
+        if exc is not None:
+            if _is_control_flow(exc):
+                # st.rerun() and st.stop() end the script through exceptions
+                self._span.set(interrupted=True)
+            else:
+                self._span.fail(exc)
+        self._span.end()
+        return False
+
+
+def start_span(name, parent=None, activate=True, **attributes):
+    """Start a span that is ended explicitly with span.end()
+
+    Spans started with activate=True become the parent of the spans opened
+    after them in the same thread or context.
+    """
+    if not ENABLED:
+        return _NOOP
+    new_span = Span(name, parent or _current.get(), attributes)
+    if activate:
+        _current.set(new_span)
+    return new_span
+
+
+def current_span():
+    return _current.get()
+
+
+def detach():
+    """Forget the active span, e.g. at the start of a new script run"""
+    _current.set(None)
+
+
+def _is_control_flow(exc):
+    return type(exc).__module__.startswith("streamlit.") and type(exc).__name__ in ("RerunException", "StopException")
+
+
+def _finish(finished):
+    if SHOW_PANEL:
+        _recent.append(finished)
+    if not (TRACE_FILE or OTLP_ENDPOINT):
+        return
+    with _pending_lock:
+        _pending.append(finished)
+        if finished.parent_id is not None and len(_pending) < MAX_BATCH:
+            return
+        batch = _pending[:]
+        _pending.clear()
+    _start_exporter()
+    _export_queue.put(batch)
+
+
+def _attribute_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_payload(spans):
+    """Return the OTLP/JSON ExportTraceServiceRequest for a list of spans"""
+    encoded = []
+    for s in spans:
+        item = {
+            "traceId": s.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            "kind": 1,
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.end_ns),
+            "attributes": [
+                {"key": key, "value": _attribute_value(value)}
+                for key, value in s.attributes.items() if value is not None
+            ],
+            "status": {"code": s.status, "message": s.message} if s.message else {"code": s.status},
+        }
+        if s.parent_id:
+            item["parentSpanId"] = s.parent_id
+        encoded.append(item)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": encoded}],
+        }]
+    }
+
+
+def _export(batch):
+    body = json.dumps(otlp_payload(batch), separators=(",", ":"))
+    if TRACE_FILE:
+        directory = os.path.dirname(TRACE_FILE)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write(body + "\n")
+    if OTLP_ENDPOINT:
+        request = urllib.request.Request(
+            OTLP_ENDPOINT, data=body.encode("utf-8"), headers={"Content-Type": "application/json"}, method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=5):
+            pass
+
+
+def _export_loop():
+    while True:
+        batch = _export_queue.get()
+        try:
+            _export(batch)
+        except Exception as e:
+            print(f"[tracing] export failed: {e}", file=sys.stderr, flush=True)
+        finally:
+            _export_queue.task_done()
+
+
+def _start_exporter():
+    global _exporter
+    if _exporter is None:
+        with _pending_lock:
+            if _exporter is None:
+                _exporter = threading.Thread(target=_export_loop, name="trace-exporter", daemon=True)
+                _exporter.start()
+
+
+def flush(timeout=5.0):
+    """Export every finished span now; used by command-line tools before exiting"""
+    with _pending_lock:
+        batch = _pending[:]
+        _pending.clear()
+    if batch:
+        _start_exporter()
+        _export_queue.put(batch)
+    if _exporter is None:
+        return
+    deadline = time.monotonic() + timeout
+    while _export_queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def slowest_spans(limit=10):
+    """Return the slowest recent spans, longest first"""
+    return sorted(_recent, key=lambda s: s.end_ns - s.start_ns, reverse=True)[:limit]
+
+
+def span_summary():
+    """Return {name: (count, total_ms, max_ms)} over the recent spans"""
+    summary = {}
+    for s in list(_recent):
+        elapsed = (s.end_ns - s.start_ns) / 1e6
+        count, total, longest = summary.get(s.name, (0, 0.0, 0.0))
+        summary[s.name] = (count + 1, total + elapsed, max(longest, elapsed))
+    return summary
@@ -0,0 +1,277 @@
+"""Translation of finished books.
+
+Chapters, the introduction and the conclusion are split into chunks at
+Markdown headings, packed up to CHUNK_WORDS words, so every chunk is a
+self-contained run of sections. Chunks are translated concurrently,
+through a provider rate limit, and put back together in order. The
+titles of the book and of every chapter go in one structured request.
+
+Every request carries the same glossary of fixed terms, so a term is
+translated the same way in every chunk. Translations are cached on disk
+by a hash of the chunk, language, glossary and model: after a small edit
+only the chunks that changed are sent again.
+
+    python translation.py project.bcproj --language English --glossary glossary.txt --out translated
+"""
+import contextvars
+import copy
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import providers
+import token_budget
+import tracing
+from markdown_tools import chunk_sections, with_padding_of
+
+CACHE_DIR = os.environ.get(
+    "BOOKCREATOR_TRANSLATION_CACHE",
+    os.path.join(os.path.expanduser("~"), ".bookcreator", "translations")
+)
+
+CHUNK_WORDS = 900
+# Translations run a little longer than their source in most languages
+LENGTH_ALLOWANCE = 1.3
+
+TITLES_SCHEMA = {
+    "type": "object",
+    "required": ["titles"],
+    "properties": {"titles": {"type": "array", "items": {"type": "string"}}},
+}
+
+
+def parse_glossary(text):
+    """Parse 'term = translation' lines into a dict, skipping blank and # lines"""
+    glossary = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#") or "=" not in line:
+            continue
+        term, translation = line.split("=", 1)
+        if term.strip():
+            glossary[term.strip()] = translation.strip()
+    return glossary
+
+
+def glossary_instructions(glossary):
+    if not glossary:
+        return ""
+    lines = "\n".join(f"- {term} → {translation}" for term, translation in sorted(glossary.items()))
+    return f"Always translate these terms exactly as given:\n{lines}\n\n"
+
+
+def chunk_prompt(chunk, language, glossary, context):
+    return (
+        f"Translate the following part of {context} into {language}.\n\n"
+        f"{glossary_instructions(glossary)}"
+        "Keep the Markdown formatting, headings, lists and code blocks exactly as they are; "
+        "never translate code. Reply with the translation only, without any comment.\n\n"
+        f"---\n{chunk}\n---"
+    )
+
+
+def titles_prompt(titles, language, glossary):
+    listing = "\n".join(f"{i}. {title}" for i, title in enumerate(titles, 1))
+    return (
+        f"Translate these book and chapter titles into {language}, keeping their order.\n\n"
+        f"{glossary_instructions(glossary)}"
+        f"{listing}"
+    )
+
+
+class TranslationCache:
+    """Translated chunks stored on disk by cache key"""
+
+    def __init__(self, directory=None):
+        self.directory = directory or CACHE_DIR
+
+    @staticmethod
+    def key(text, language, glossary, model):
+        encoded = json.dumps([text, language, sorted(glossary.items()), model], ensure_ascii=False)
+        return hashlib.blake2b(encoded.encode("utf-8"), digest_size=16).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+def translate_book(book_structure, book_content, language, glossary=None, provider=providers.DEFAULT_PROVIDER, model=None,
+                   max_workers=4, complete=providers.complete, complete_structured=providers.complete_structured,
+                   cache=None, progress=None):
+    """Translate a finished book and return (book_structure, book_content, report)
+
+    complete and complete_structured have the signatures of the providers
+    functions, so they can be rate limited. progress(done, total), if
+    given, is called from the calling thread as chunks finish. Each chunk
+    is generated with token_budget.generate_with_continuation, so a
+    translation longer than its budget is continued rather than cut off.
+    The report counts chunks, cache hits and chunks still cut off, which
+    are not cached, and sums the tokens used.
+    """
+    glossary = glossary or {}
+    model = model or providers.default_model(provider)
+    cache = cache or TranslationCache()
+    report = {"chunks": 0, "cached": 0, "truncated": 0, "input_tokens": 0, "output_tokens": 0}
+    prefill = providers.supports_prefill(provider)
+
+    # Each document is (target, chunks); the targets are filled in at the end
+    documents = [("introduction", "the introduction of a book", book_structure["introduction"])]
+    for number, chapter in book_content.items():
+        documents.append((number, f"chapter {number} of a book", chapter["content"]))
+    documents.append(("conclusion", "the conclusion of a book", book_structure["conclusion"]))
+
+    jobs = []
+    for target, context, text in documents:
+        for index, chunk in enumerate(chunk_sections(text, CHUNK_WORDS)):
+            jobs.append((target, index, context, chunk))
+    translated = {}
+    pending = []
+    for target, index, context, chunk in jobs:
+        key = cache.key(chunk, language, glossary, model)
+        cached = cache.get(key) if chunk.strip() else {"text": chunk}
+        if cached is not None:
+            translated[(target, index)] = cached["text"]
+            report["cached"] += 1
+        else:
+            pending.append((target, index, context, chunk, key))
+    report["chunks"] = len(jobs)
+
+    def call(messages, max_tokens, on_text):
+        return complete(provider, model, messages, max_tokens)
+
+    def translate_chunk(context, chunk, key):
+        prompt = chunk_prompt(chunk, language, glossary, context)
+        text, info = token_budget.generate_with_continuation(
+            call, prompt, model, len(chunk.split()) * LENGTH_ALLOWANCE, prefill=prefill
+        )
+        text = with_padding_of(chunk, text.strip().removeprefix("---").removesuffix("---"))
+        # A chunk still cut off is translated again next time rather than kept short for good
+        if not info["truncated"]:
+            cache.put(key, {"text": text})
+        return text, info
+
+    with tracing.span("translation.book", language=language, chunks=len(jobs), cached=report["cached"]):
+        titles = [book_structure["title"]] + [chapter["title"] for chapter in book_structure["chapters"]] \
+            + [chapter["title"] for chapter in book_content.values()]
+        translated_titles = _translate_titles(titles, language, glossary, provider, model, complete_structured, cache, report)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Worker threads inherit the tracing context of the caller
+            futures = {
+                executor.submit(contextvars.copy_context().run, translate_chunk, context, chunk, key): (target, index)
+                for target, index, context, chunk, key in pending
+            }
+            done = len(jobs) - len(pending)
+            if progress is not None:
+                progress(done, len(jobs))
+            for future in as_completed(futures):
+                text, info = future.result()
+                translated[futures[future]] = text
+                report["truncated"] += info["truncated"]
+                report["input_tokens"] += info["input_tokens"]
+                report["output_tokens"] += info["output_tokens"]
+                done += 1
+                if progress is not None:
+                    progress(done, len(jobs))
+
+    def assemble(target):
+        count = sum(1 for job in jobs if job[0] == target)
+        return "\n".join(translated[(target, index)] for index in range(count))
+
+    structure = copy.deepcopy(book_structure)
+    structure["title"] = translated_titles[0]
+    structure["introduction"] = assemble("introduction")
+    structure["conclusion"] = assemble("conclusion")
+    structure["language"] = language
+    chapter_count = len(book_structure["chapters"])
+    for chapter, title in zip(structure["chapters"], translated_titles[1:1 + chapter_count]):
+        chapter["title"] = title
+    content = {}
+    for (number, chapter), title in zip(book_content.items(), translated_titles[1 + chapter_count:]):
+        content[number] = dict(chapter, title=title, content=assemble(number))
+    return structure, content, report
+
+
+def _translate_titles(titles, language, glossary, provider, model, complete_structured, cache, report):
+    """Translate every title in one structured request, falling back to the originals"""
+    key = cache.key("\n".join(titles), language, glossary, model)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached["titles"]
+    completion = complete_structured(
+        provider, model, titles_prompt(titles, language, glossary),
+        token_budget.max_tokens_for(model, sum(len(t.split()) for t in titles) * 2), TITLES_SCHEMA, "titles"
+    )
+    report["input_tokens"] += completion.input_tokens or 0
+    report["output_tokens"] += completion.output_tokens or 0
+    try:
+        result = json.loads(completion.text)["titles"]
+    except (ValueError, KeyError, TypeError):
+        return titles
+    if len(result) != len(titles):
+        return titles
+    cache.put(key, {"titles": result})
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import book_export
+    import project_store
+
+    parser = argparse.ArgumentParser(description="Translate the final book of a project")
+    parser.add_argument("project", help=f".{project_store.FILE_EXTENSION} project archive")
+    parser.add_argument("--language", required=True)
+    parser.add_argument("--glossary", help="file of 'term = translation' lines")
+    parser.add_argument("--provider", default=providers.DEFAULT_PROVIDER, choices=providers.provider_names())
+    parser.add_argument("--model")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests-per-minute", type=float, default=60)
+    parser.add_argument("--out", default="translated")
+    args = parser.parse_args()
+
+    archive = project_store.ProjectArchive(args.project)
+    source_content = archive.book_content()
+    for source_chapter in source_content.values():
+        project_store.load_body(archive, source_chapter)
+        source_chapter.pop("archive_entry", None)
+    glossary_terms = {}
+    if args.glossary:
+        with open(args.glossary, encoding="utf-8") as glossary_file:
+            glossary_terms = parse_glossary(glossary_file.read())
+
+    limiter = providers.RateLimiter(args.requests_per_minute, args.workers)
+    translated_structure, translated_content, summary = translate_book(
+        archive.structure["book_structure"], source_content, args.language, glossary_terms,
+        args.provider, args.model, args.workers,
+        limiter.wrap(providers.complete), limiter.wrap(providers.complete_structured),
+        progress=lambda done, total: print(f"\r{done}/{total} chunks", end="", flush=True)
+    )
+    print()
+    os.makedirs(args.out, exist_ok=True)
+    for export_format in book_export.EXPORT_FORMATS:
+        path = os.path.join(args.out, book_export.export_file_name(translated_structure, export_format))
+        with open(path, "w", encoding="utf-8") as out_file:
+            out_file.writelines(book_export.export_blocks(translated_structure, translated_content, export_format))
+        print(path)
+    print(
+        f"{summary['chunks']} chunks, {summary['cached']} from cache, {summary['truncated']} cut off; "
+        f"{summary['input_tokens']:,} input and {summary['output_tokens']:,} output tokens"
+    )